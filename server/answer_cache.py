@@ -0,0 +1,62 @@
+# answer_cache.py
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+import config
+
+
+def normalize_question(question: str) -> str:
+    """Lower-cases a question and collapses whitespace so trivial variations share a cache entry."""
+    return " ".join(question.lower().split())
+
+
+def question_hash(question: str) -> str:
+    """SHA-256 of the normalized question, as stored in `queries.question_hash`."""
+    return hashlib.sha256(normalize_question(question).encode()).hexdigest()
+
+
+class AnswerCache:
+    """
+    In-memory LRU cache of answers. Entries expire after `ttl_seconds`, and the least
+    recently used ones are evicted once there are more than `max_entries` entries or
+    the cached answers total more than `max_bytes`.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, str]]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: Hashable) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, answer = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return answer
+
+    def put(self, key: Hashable, answer: str):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, answer)
+        self._bytes += len(answer)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable):
+        _, answer = self._entries.pop(key)
+        self._bytes -= len(answer)
+
+
+answer_cache = AnswerCache(
+    max_entries=config.ANSWER_CACHE_MAX_ENTRIES,
+    max_bytes=config.ANSWER_CACHE_MAX_BYTES,
+    ttl_seconds=config.ANSWER_CACHE_TTL_SECONDS,
+)
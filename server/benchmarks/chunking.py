@@ -0,0 +1,131 @@
+# benchmarks/chunking.py
+"""
+Benchmark of the page-wise chunker against the splitter it replaced, LangChain's
+RecursiveCharacterTextSplitter over the joined document text (skipped when
+langchain-text-splitters is not installed). Run from server/:
+
+    python -m benchmarks.chunking                # 2000 pages
+    python -m benchmarks.chunking --pages 200
+
+Reports the number of chunks, their mean length, how many characters are chunked in
+total per character of text (overlap makes this above 1), how many chunks are contained
+in the chunk before them (pure duplicates, embedded and stored for nothing), throughput in
+MB of text per second (best of --repeats runs) and the peak memory allocated while
+chunking, measured with tracemalloc in a separate run.
+
+Every chunk is embedded, upserted and indexed, so the chunk count and the characters
+chunked per character of text are what ingestion costs per document. The benchmark exits
+with status 1 when the page-wise chunker exceeds the joined-text splitter's (or, without
+LangChain, the recorded reference values below) by more than MAX_REGRESSION.
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Optional
+
+import config
+from benchmarks.documents import PARAGRAPHS_PER_PAGE, generate_paragraphs
+from chunker import iter_chunks
+
+
+# Chunks per 1000 characters of text and characters chunked per character of text from
+# LangChain's splitter on the generated documents, at chunk size 400 and overlap 150
+REFERENCE_CHUNKS_PER_KCHAR = 3.60
+REFERENCE_AMPLIFICATION = 1.19
+# Largest accepted relative excess over the reference in either measure
+MAX_REGRESSION = 0.05
+
+
+def _pages(paragraphs: List[str]) -> Iterator[str]:
+    """Page texts built on demand, like PyMuPDF's page.get_text()."""
+    for start in range(0, len(paragraphs), PARAGRAPHS_PER_PAGE):
+        yield "\n\n".join(paragraphs[start:start + PARAGRAPHS_PER_PAGE]) + "\n"
+
+
+def chunk_pagewise(paragraphs: List[str]) -> Iterator[str]:
+    for chunk in iter_chunks(_pages(paragraphs), first_page=1):
+        yield chunk["text"]
+
+
+def _langchain_splitter() -> Optional[Callable[[List[str]], Iterator[str]]]:
+    try:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+    except ImportError:
+        return None
+
+    def chunk_joined(paragraphs: List[str]) -> Iterator[str]:
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=config.CHUNK_SIZE, chunk_overlap=config.CHUNK_OVERLAP, length_function=len, add_start_index=True
+        )
+        text = "".join(_pages(paragraphs))
+        for document in splitter.create_documents([text]):
+            yield document.page_content
+    return chunk_joined
+
+
+def measure(chunker: Callable[[List[str]], Iterator[str]], paragraphs: List[str], text_chars: int, text_bytes: int, repeats: int) -> Dict:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in chunker(paragraphs):
+            pass
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    for _ in chunker(paragraphs):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    texts = list(chunker(paragraphs))
+    chunked_chars = sum(map(len, texts))
+    return {
+        "chunks": len(texts),
+        "mean_chars": chunked_chars / len(texts) if texts else 0.0,
+        "amplification": chunked_chars / text_chars,
+        "duplicates": sum(text in previous for previous, text in zip(texts, texts[1:])),
+        "seconds": best, "mb_per_s": text_bytes / best / 1e6, "peak_mb": peak / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Page-wise chunker against the joined-text splitter.")
+    parser.add_argument("--pages", type=int, default=2000, help="pages in the generated document")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per chunker; the best is reported")
+    args = parser.parse_args()
+
+    paragraphs = generate_paragraphs(args.pages * PARAGRAPHS_PER_PAGE, seed=7)
+    text_chars = sum(len(page) for page in _pages(paragraphs))
+    text_bytes = sum(len(page.encode()) for page in _pages(paragraphs))
+    print(f"Document: {args.pages} pages, {text_bytes / 1e6:.1f} MB of text, chunk size {config.CHUNK_SIZE}, overlap {config.CHUNK_OVERLAP}.\n")
+
+    results = {"page-wise (chunker.py)": measure(chunk_pagewise, paragraphs, text_chars, text_bytes, args.repeats)}
+    chunk_joined = _langchain_splitter()
+    if chunk_joined is None:
+        print("langchain-text-splitters is not installed; skipping the joined-text splitter.\n")
+    else:
+        results["joined text (LangChain)"] = measure(chunk_joined, paragraphs, text_chars, text_bytes, args.repeats)
+
+    print(f"{'chunker':<26} {'mean len':>9} {'duplicates':>11} {'chunks':>8} {'chars/text':>11} {'MB/s':>8} {'seconds':>9} {'peak MB':>9}")
+    for name, result in results.items():
+        print(f"{name:<26} {result['mean_chars']:>9.0f} {result['duplicates']:>11} {result['chunks']:>8} "
+              f"{result['amplification']:>11.2f} {result['mb_per_s']:>8.1f} {result['seconds']:>9.3f} {result['peak_mb']:>9.2f}")
+
+    result = results["page-wise (chunker.py)"]
+    if chunk_joined is not None:
+        reference = results["joined text (LangChain)"]
+        max_chunks, max_amplification = reference["chunks"], reference["amplification"]
+    else:
+        max_chunks, max_amplification = REFERENCE_CHUNKS_PER_KCHAR * text_chars / 1000, REFERENCE_AMPLIFICATION
+    failures = []
+    if result["chunks"] > max_chunks * (1 + MAX_REGRESSION):
+        failures.append(f"{result['chunks']} chunks against {max_chunks:.0f}")
+    if result["amplification"] > max_amplification * (1 + MAX_REGRESSION):
+        failures.append(f"{result['amplification']:.2f} chars/text against {max_amplification:.2f}")
+    if failures:
+        print(f"\nFAILED: the page-wise chunker regressed ({'; '.join(failures)}).")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
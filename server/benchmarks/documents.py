@@ -0,0 +1,93 @@
+# benchmarks/documents.py
+"""Generates deterministic policy-like documents as PDF, DOCX and EML bytes."""
+import io
+import random
+from email.message import EmailMessage
+from typing import List
+
+_SUBJECTS = [
+    "the insured person", "the policyholder", "the company", "the employee", "the hospital",
+    "the claimant", "the nominee", "the third party administrator", "the dependant", "the employer",
+]
+_ACTIONS = [
+    "shall be entitled to", "must notify the insurer of", "is not covered for", "may claim reimbursement of",
+    "shall bear the cost of", "must submit documents for", "is eligible for", "shall forfeit",
+]
+_OBJECTS = [
+    "pre-existing diseases", "maternity expenses", "room rent above the sub-limit", "day care procedures",
+    "ambulance charges", "organ donor expenses", "cataract surgery", "ayush treatment", "the grace period premium",
+    "domiciliary hospitalisation", "notice period pay", "annual leave encashment", "overtime allowance",
+]
+_CONDITIONS = [
+    "after a waiting period of {n} months", "within {n} days of discharge", "up to {n} percent of the sum insured",
+    "subject to a deductible of {n} thousand rupees", "only after {n} years of continuous coverage",
+    "unless terminated with {n} days notice",
+]
+
+# Paragraphs per page, used to size DOCX and EML documents like PDFs of the same page count
+PARAGRAPHS_PER_PAGE = 6
+
+
+def generate_paragraphs(count: int, seed: int) -> List[str]:
+    """Numbered clauses made of a few random policy sentences each."""
+    rng = random.Random(seed)
+    paragraphs = []
+    for i in range(count):
+        sentences = []
+        for _ in range(rng.randint(3, 6)):
+            condition = rng.choice(_CONDITIONS).format(n=rng.randint(2, 48))
+            sentences.append(f"{rng.choice(_SUBJECTS).capitalize()} {rng.choice(_ACTIONS)} {rng.choice(_OBJECTS)} {condition}.")
+        paragraphs.append(f"{i // 10 + 1}.{i % 10 + 1} " + " ".join(sentences))
+    return paragraphs
+
+
+def generate_questions(count: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [
+        f"What does clause {rng.randint(1, 9)}.{rng.randint(1, 10)} say about {rng.choice(_OBJECTS)} for {rng.choice(_SUBJECTS)}?"
+        for _ in range(count)
+    ]
+
+
+def make_pdf(paragraphs: List[str]) -> bytes:
+    import fitz
+
+    document = fitz.open()
+    for start in range(0, len(paragraphs), PARAGRAPHS_PER_PAGE):
+        page = document.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), "\n\n".join(paragraphs[start:start + PARAGRAPHS_PER_PAGE]), fontsize=9)
+    content = document.tobytes()
+    document.close()
+    return content
+
+
+def make_docx(paragraphs: List[str]) -> bytes:
+    import docx
+
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def make_eml(paragraphs: List[str]) -> bytes:
+    message = EmailMessage()
+    message["Subject"] = "Policy wording for renewal"
+    message["From"] = "underwriting@example.com"
+    message["To"] = "policyholder@example.com"
+    message.set_content("\n\n".join(paragraphs))
+    return message.as_bytes()
+
+
+FORMATS = {
+    "pdf": make_pdf,
+    "docx": make_docx,
+    "eml": make_eml,
+}
+
+
+def make_document(file_format: str, pages: int, seed: int) -> bytes:
+    """Returns a document of about `pages` pages in the given format ("pdf", "docx" or "eml")."""
+    return FORMATS[file_format](generate_paragraphs(pages * PARAGRAPHS_PER_PAGE, seed))
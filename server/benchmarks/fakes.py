@@ -0,0 +1,120 @@
+# benchmarks/fakes.py
+"""
+Deterministic local stand-ins for the Gemini API, installed by patching the
+`google.generativeai` module the services call into.
+"""
+import asyncio
+import hashlib
+import json
+import re
+from typing import List, Optional
+
+import numpy as np
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class FakeEmbedder:
+    """
+    Replaces `genai.embed_content_async`. Texts are embedded with the hashing trick
+    (each token adds a fixed pseudo-random unit vector), so texts sharing words are
+    similar and retrieval behaves plausibly. Every call sleeps `latency` seconds.
+    """
+
+    def __init__(self, dimension: int, latency: float):
+        self.dimension = dimension
+        self.latency = latency
+        self.calls = 0
+        self._token_vectors = {}
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            seed = int.from_bytes(hashlib.sha256(token.encode()).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+            self._token_vectors[token] = vector
+        return vector
+
+    def embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in _TOKEN_PATTERN.findall(text.lower()):
+            vector += self._token_vector(token)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    async def embed_content_async(self, model: str, content, task_type: Optional[str] = None, **kwargs) -> dict:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if isinstance(content, str):
+            return {"embedding": self.embed(content)}
+        return {"embedding": [self.embed(text) for text in content]}
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _FakeStream:
+    def __init__(self, fragments: List[str], latency: float):
+        self._fragments = fragments
+        self._latency = latency
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        delay = self._latency / max(len(self._fragments), 1)
+        for fragment in self._fragments:
+            await asyncio.sleep(delay)
+            yield _FakeResponse(fragment)
+
+
+class FakeLLM:
+    """
+    Replaces `genai.GenerativeModel`. Answers quote the start of the question after
+    `latency` seconds; streamed answers spread the same latency over their fragments,
+    and batched prompts get one JSON answer per numbered question.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self.prompt_chars = 0
+
+    def __call__(self, model_name: str, **kwargs) -> "FakeLLM":
+        return self
+
+    @staticmethod
+    def _answer(question: str) -> str:
+        return f"Based on the provided clauses, the answer to '{question[:60]}' is stated in the document."
+
+    async def generate_content_async(self, prompt: str, generation_config=None, stream: bool = False, **kwargs):
+        self.calls += 1
+        self.prompt_chars += len(prompt)
+        if "--- USER QUESTIONS ---" in prompt:
+            # Batched prompt: one numbered question per line, answered as JSON
+            numbered = prompt.rsplit("--- USER QUESTIONS ---", 1)[-1].split("--- ANSWERS (JSON) ---", 1)[0].strip()
+            answers = []
+            for line in numbered.splitlines():
+                number, question = line.split(". ", 1)
+                answers.append({"id": int(number), "answer": self._answer(question)})
+            await asyncio.sleep(self.latency)
+            return _FakeResponse(json.dumps({"answers": answers}))
+        question = prompt.rsplit("--- USER QUESTION ---", 1)[-1].split("--- ANSWER ---", 1)[0].strip()
+        answer = self._answer(question)
+        if stream:
+            return _FakeStream([word + " " for word in answer.split(" ")], self.latency)
+        await asyncio.sleep(self.latency)
+        return _FakeResponse(answer)
+
+
+def install_fakes(embedding_dimension: int, embed_latency: float, llm_latency: float):
+    """Patches the Gemini client module in place and returns (embedder, llm)."""
+    import google.generativeai as genai
+
+    embedder = FakeEmbedder(embedding_dimension, embed_latency)
+    llm = FakeLLM(llm_latency)
+    genai.embed_content_async = embedder.embed_content_async
+    genai.GenerativeModel = llm
+    return embedder, llm
@@ -0,0 +1,350 @@
+# benchmarks/run.py
+"""
+Offline benchmark of the ingestion and question-answering paths.
+
+Gemini is replaced by the deterministic fakes in benchmarks/fakes.py, the vector
+store by the local backend and Postgres by a SQLite file, all under a temporary
+directory, so no network access or credentials are needed. Run from server/:
+
+    python -m benchmarks.run                  # full run, compared to benchmarks/baseline.json
+    python -m benchmarks.run --quick          # smaller documents and fewer requests
+    python -m benchmarks.run --save-baseline  # store this run as the new baseline
+
+Each scenario reports per-stage p50/p95/p99 latency in milliseconds, and the load
+scenarios report throughput in requests per second. The startup scenarios time the
+import of main.py in a fresh interpreter and the app's lifespan startup.
+"""
+import argparse
+import asyncio
+import base64
+import functools
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from benchmarks.documents import FORMATS, generate_questions, make_document
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+# A latency this much higher (or a throughput this much lower) than the baseline is reported as a regression
+REGRESSION_THRESHOLD = 0.2
+
+FULL_SETTINGS = {
+    "pages": [5, 50, 200],
+    "extraction_repeats": 5,
+    "import_repeats": 5,
+    "concurrency": [1, 4, 16, 32],
+    "requests_per_client": 8,
+    "questions_per_request": 5,
+}
+QUICK_SETTINGS = {
+    "pages": [2, 20],
+    "extraction_repeats": 2,
+    "import_repeats": 2,
+    "concurrency": [1, 4],
+    "requests_per_client": 3,
+    "questions_per_request": 3,
+}
+
+
+def _configure_environment(workdir: str):
+    """Points the services at local stand-ins. Must run before the server modules are imported."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["VECTOR_STORE_BACKEND"] = "local"
+    os.environ["LOCAL_INDEX_DIR"] = os.path.join(workdir, "local_index")
+    os.environ["LEXICAL_INDEX_DIR"] = os.path.join(workdir, "lexical_index")
+    os.environ["CHUNK_STORE_DIR"] = os.path.join(workdir, "chunk_store")
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("PINECONE_API_KEY", "benchmark")
+    # Measure the code rather than the quota: the scheduler's budgets never bind unless set explicitly
+    for budget in ("EMBEDDING_REQUESTS_PER_MINUTE", "EMBEDDING_TOKENS_PER_MINUTE",
+                   "GENERATION_REQUESTS_PER_MINUTE", "GENERATION_TOKENS_PER_MINUTE"):
+        os.environ.setdefault(budget, "100000000")
+
+
+class StageTimer:
+    """Collects latency samples, in seconds, per stage."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def record(self, stage: str, seconds: float):
+        self.samples[stage].append(seconds)
+
+    def reset(self):
+        self.samples = defaultdict(list)
+
+    def wrap_async(self, stage: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+
+    def wrap_sync(self, stage: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for stage, samples in sorted(self.samples.items()):
+            millis = np.asarray(samples) * 1000
+            result[stage] = {
+                "count": len(samples),
+                "p50": float(np.percentile(millis, 50)),
+                "p95": float(np.percentile(millis, 95)),
+                "p99": float(np.percentile(millis, 99)),
+            }
+        return result
+
+
+def _instrument(timer: StageTimer):
+    """Times the stages of the request path by wrapping the functions main.py calls."""
+    import main
+
+    main.get_embeddings = timer.wrap_async("embed_questions", main.get_embeddings)
+    main.get_relevant_matches = timer.wrap_async("retrieve", main.get_relevant_matches)
+    main.assemble_context = timer.wrap_sync("assemble_context", main.assemble_context)
+    main.get_answer_from_llm = timer.wrap_async("generate", main.get_answer_from_llm)
+    main.process_document_content = timer.wrap_async("extract", main.process_document_content)
+    main.upsert_document_chunks = timer.wrap_async("index", main.upsert_document_chunks)
+
+
+async def _bench_extraction(settings: dict, timer: StageTimer) -> Dict[str, dict]:
+    """Extraction and chunking through document_processor, per format and size."""
+    from document_processor import process_document_content
+
+    results = {}
+    for file_format in FORMATS:
+        for pages in settings["pages"]:
+            content = make_document(file_format, pages, seed=pages)
+            filename = f"bench.{file_format}"
+            await process_document_content(content, filename)  # warm up the worker processes
+            timer.reset()
+            timed = timer.wrap_async("extract", process_document_content)
+            for _ in range(settings["extraction_repeats"]):
+                chunks = await timed(content, filename)
+            results[f"extract/{file_format}/{pages}p"] = {
+                "stages": timer.summary(),
+                "bytes": len(content),
+                "chunks": len(chunks),
+            }
+    return results
+
+
+def _run_payload(content: bytes, filename: str, questions: List[str]) -> dict:
+    return {
+        "questions": questions,
+        "filename": filename,
+        "file_content_base64": base64.b64encode(content).decode(),
+    }
+
+
+async def _post_run(client, payload: dict, timer: StageTimer):
+    start = time.perf_counter()
+    response = await client.post("/hackrx/run", json=payload)
+    timer.record("request", time.perf_counter() - start)
+    response.raise_for_status()
+    return response.json()
+
+
+async def _bench_cold_runs(client, settings: dict, timer: StageTimer) -> Dict[str, dict]:
+    """The first /hackrx/run for a new document: extraction, indexing and answering."""
+    results = {}
+    for format_number, file_format in enumerate(FORMATS):
+        for pages in settings["pages"]:
+            # A seed no other document uses, so nothing is served from the embedding store
+            content = make_document(file_format, pages, seed=10_000 + 1_000 * format_number + pages)
+            questions = generate_questions(settings["questions_per_request"], seed=pages)
+            timer.reset()
+            await _post_run(client, _run_payload(content, f"cold-{pages}.{file_format}", questions), timer)
+            results[f"cold_run/{file_format}/{pages}p"] = {"stages": timer.summary(), "bytes": len(content)}
+    return results
+
+
+async def _bench_load(client, settings: dict, timer: StageTimer) -> Dict[str, dict]:
+    """Concurrent /hackrx/run requests against an indexed document, with distinct questions."""
+    pages = settings["pages"][len(settings["pages"]) // 2]
+    content = make_document("pdf", pages, seed=20_000)
+    filename = f"load-{pages}.pdf"
+    await _post_run(client, _run_payload(content, filename, ["Warm-up question?"]), timer)
+
+    results = {}
+    request_number = 0
+    for concurrency in settings["concurrency"]:
+        payloads = []
+        for _ in range(concurrency * settings["requests_per_client"]):
+            request_number += 1
+            # Numbered questions never hit the answer cache
+            questions = [f"{q} (request {request_number})" for q in generate_questions(settings["questions_per_request"], seed=request_number)]
+            payloads.append(_run_payload(content, filename, questions))
+
+        async def client_loop(mine: List[dict]):
+            for payload in mine:
+                await _post_run(client, payload, timer)
+
+        timer.reset()
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(payloads[i::concurrency]) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        results[f"load/pdf/{pages}p/c{concurrency}"] = {
+            "stages": timer.summary(),
+            "throughput_rps": len(payloads) / elapsed,
+        }
+    return results
+
+
+def _bench_import(repeats: int) -> Dict[str, dict]:
+    """Time to import main.py in a fresh interpreter, as paid by every worker boot and cold start."""
+    timer = StageTimer()
+    server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", code], cwd=server_dir, capture_output=True, text=True, check=True)
+        timer.record("import_main", float(output.stdout.strip().splitlines()[-1]))
+    return {"startup/import": {"stages": timer.summary()}}
+
+
+async def run_benchmarks(settings: dict, embed_latency: float, llm_latency: float) -> dict:
+    import httpx
+
+    import config
+    import models
+    from database import get_engine
+    from benchmarks.fakes import install_fakes
+
+    embedder, llm = install_fakes(config.EMBEDDING_DIMENSION, embed_latency, llm_latency)
+    models.Base.metadata.create_all(bind=get_engine())
+
+    import main
+
+    timer = StageTimer()
+    _instrument(timer)
+    results = {}
+    # The ASGI transport does not run the app's lifespan, so it is entered here
+    start = time.perf_counter()
+    async with main.app.router.lifespan_context(main.app):
+        timer.record("lifespan_startup", time.perf_counter() - start)
+        results["startup/lifespan"] = {"stages": timer.summary()}
+        results.update(await _bench_extraction(settings, timer))
+        transport = httpx.ASGITransport(app=main.app)
+        headers = {"Authorization": f"Bearer {config.BEARER_TOKEN}"}
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", headers=headers, timeout=None) as client:
+            results.update(await _bench_cold_runs(client, settings, timer))
+            results.update(await _bench_load(client, settings, timer))
+
+    return {
+        "settings": settings,
+        "fakes": {"embed_latency": embed_latency, "llm_latency": llm_latency,
+                  "embed_calls": embedder.calls, "llm_calls": llm.calls},
+        "python": sys.version.split()[0],
+        "scenarios": results,
+    }
+
+
+def _fingerprint(run: dict) -> str:
+    """Identifies the workload, so a run is only compared to a baseline of the same workload."""
+    workload = {"settings": run["settings"], "latency": [run["fakes"]["embed_latency"], run["fakes"]["llm_latency"]]}
+    return hashlib.sha256(json.dumps(workload, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def format_report(run: dict, baseline: Optional[dict]) -> Tuple[str, List[str]]:
+    """Returns the report text and the list of regressions against the baseline."""
+    if baseline is not None and _fingerprint(baseline) != _fingerprint(run):
+        baseline_note = "baseline skipped: it was recorded with different settings"
+        baseline = None
+    else:
+        baseline_note = "no baseline" if baseline is None else "compared to baseline (p95 and throughput)"
+
+    lines = [f"Offline benchmark ({baseline_note})", ""]
+    lines.append(f"{'scenario':<28} {'stage':<18} {'n':>5} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'vs base':>9}")
+    regressions = []
+    for name, scenario in run["scenarios"].items():
+        base_scenario = (baseline or {}).get("scenarios", {}).get(name, {})
+        for stage, stats in scenario["stages"].items():
+            change = ""
+            base_stats = base_scenario.get("stages", {}).get(stage)
+            if base_stats and base_stats["p95"] > 0:
+                ratio = stats["p95"] / base_stats["p95"]
+                change = f"{ratio - 1:+.0%}"
+                if ratio > 1 + REGRESSION_THRESHOLD:
+                    regressions.append(f"{name} {stage}: p95 {base_stats['p95']:.1f} -> {stats['p95']:.1f} ms")
+            lines.append(
+                f"{name:<28} {stage:<18} {stats['count']:>5} {stats['p50']:>10.1f} {stats['p95']:>10.1f} {stats['p99']:>10.1f} {change:>9}"
+            )
+        if "throughput_rps" in scenario:
+            change = ""
+            base_throughput = base_scenario.get("throughput_rps")
+            if base_throughput:
+                ratio = scenario["throughput_rps"] / base_throughput
+                change = f"{ratio - 1:+.0%}"
+                if ratio < 1 - REGRESSION_THRESHOLD:
+                    regressions.append(f"{name} throughput: {base_throughput:.2f} -> {scenario['throughput_rps']:.2f} req/s")
+            lines.append(f"{name:<28} {'throughput req/s':<18} {'':>5} {scenario['throughput_rps']:>10.2f} {'':>10} {'':>10} {change:>9}")
+
+    fakes = run["fakes"]
+    lines += ["", f"Fake Gemini calls: {fakes['embed_calls']} embedding, {fakes['llm_calls']} generation."]
+    if regressions:
+        lines += ["", f"Regressions (more than {REGRESSION_THRESHOLD:.0%} worse than the baseline):"]
+        lines += [f"  {regression}" for regression in regressions]
+    return "\n".join(lines), regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark with local fakes for Gemini, Pinecone and Postgres.")
+    parser.add_argument("--quick", action="store_true", help="smaller documents and fewer requests")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per fake embedding call")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="seconds per fake generation call")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--json", help="also write the raw results to this file")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 if any stage regressed")
+    args = parser.parse_args()
+
+    settings = QUICK_SETTINGS if args.quick else FULL_SETTINGS
+    workdir = tempfile.mkdtemp(prefix="docquery-bench-")
+    try:
+        _configure_environment(workdir)
+        import_results = _bench_import(settings["import_repeats"])
+        run = asyncio.run(run_benchmarks(settings, args.embed_latency, args.llm_latency))
+        run["scenarios"] = {**import_results, **run["scenarios"]}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report, regressions = format_report(run, baseline)
+    print(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(run, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}.")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
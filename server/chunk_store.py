@@ -0,0 +1,138 @@
+# chunk_store.py
+import asyncio
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import config
+from lru import LRUCache
+
+# File layout: header, compression dictionary, per-chunk start offsets (int64) and pages
+# (int32, -1 when unknown), record offsets into the data section (uint64, count + 1 of
+# them), then the data section of independently compressed chunk texts.
+_MAGIC = b"DQC1"
+_HEADER = struct.Struct("<4sII")
+# Preset dictionary shared by all chunks of a document, sampled from its own text; it
+# lets each chunk be compressed on its own without losing most of the compression ratio
+_DICTIONARY_BYTES = 16 * 1024
+_NO_PAGE = -1
+
+
+class ChunkStoreMissingError(LookupError):
+    """
+    Raised when the chunk texts of a namespace are neither in a chunk store on this host nor
+    kept in the vector metadata, so its matches cannot be turned into clauses.
+    """
+
+
+def _dictionary(texts: List[str]) -> bytes:
+    step = max(1, len(texts) // 64)
+    return "".join(texts[::step]).encode()[:_DICTIONARY_BYTES]
+
+
+class ChunkStore:
+    """
+    The chunks of one document namespace in a single compressed file, read through mmap.
+    Positions are chunk indexes, as in the `{namespace}-{i}` vector ids.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, dictionary_length = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"Not a chunk store file: {path}")
+        offset = _HEADER.size
+        self._dictionary = self._map[offset:offset + dictionary_length]
+        offset += dictionary_length
+        # The small per-chunk tables are copied out, so no view keeps the mapping from being closed
+        self.starts = np.frombuffer(self._map, dtype=np.int64, count=self.count, offset=offset).copy()
+        offset += 8 * self.count
+        self.pages = np.frombuffer(self._map, dtype=np.int32, count=self.count, offset=offset).copy()
+        offset += 4 * self.count
+        self._offsets = np.frombuffer(self._map, dtype=np.uint64, count=self.count + 1, offset=offset).copy()
+        self._data_start = offset + 8 * (self.count + 1)
+
+    @staticmethod
+    def write(path: str, chunks: List[Dict]):
+        texts = [chunk["text"] for chunk in chunks]
+        dictionary = _dictionary(texts)
+        records = []
+        for text in texts:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15, zdict=dictionary)
+            records.append(compressor.compress(text.encode()) + compressor.flush())
+        offsets = np.zeros(len(records) + 1, dtype=np.uint64)
+        offsets[1:] = np.cumsum([len(record) for record in records])
+        starts = np.array([chunk["start"] for chunk in chunks], dtype=np.int64)
+        pages = np.array([chunk.get("page", _NO_PAGE) for chunk in chunks], dtype=np.int32)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Written to a temp file and moved into place, so open readers keep the old version
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or ".", suffix=".tmp", delete=False) as f:
+            f.write(_HEADER.pack(_MAGIC, len(chunks), len(dictionary)))
+            f.write(dictionary)
+            f.write(starts.tobytes())
+            f.write(pages.tobytes())
+            f.write(offsets.tobytes())
+            for record in records:
+                f.write(record)
+        os.replace(f.name, path)
+
+    def close(self):
+        self._map.close()
+
+    def read(self, positions: List[int]) -> Dict[int, Dict]:
+        """Chunk metadata ("text", "start" and, when known, "page") by position; unknown positions are left out."""
+        chunks = {}
+        for position in sorted(set(positions)):
+            if not 0 <= position < self.count:
+                continue
+            begin = self._data_start + int(self._offsets[position])
+            end = self._data_start + int(self._offsets[position + 1])
+            decompressor = zlib.decompressobj(-15, zdict=self._dictionary)
+            chunk = {"text": decompressor.decompress(self._map[begin:end]).decode(), "start": int(self.starts[position])}
+            if self.pages[position] != _NO_PAGE:
+                chunk["page"] = int(self.pages[position])
+            chunks[position] = chunk
+        return chunks
+
+
+_opened: LRUCache[ChunkStore] = LRUCache(config.MAX_OPEN_NAMESPACES, on_close=ChunkStore.close)
+
+
+def _path(namespace: str) -> str:
+    return os.path.join(config.CHUNK_STORE_DIR, f"{namespace}.chunks")
+
+
+async def write_chunks(namespace: str, chunks: List[Dict]):
+    """Stores the chunks of a namespace, replacing any previous version."""
+    await asyncio.to_thread(ChunkStore.write, _path(namespace), chunks)
+    # Stores are read on the event loop, so closing the old one here never cuts a read short
+    _opened.pop(namespace)
+
+
+async def delete_chunks(namespace: str):
+    """Removes the chunk store of a namespace, if there is one on this host."""
+    _opened.pop(namespace)
+    try:
+        os.remove(_path(namespace))
+    except FileNotFoundError:
+        pass
+
+
+def get_chunk_store(namespace: str) -> Optional[ChunkStore]:
+    """
+    Returns the namespace's chunk store, or None if it was not written on this host
+    (e.g. the document was ingested by another host or before the store existed).
+    The store may be closed once the caller awaits, so it should be read right away.
+    """
+    store = _opened.get(namespace)
+    if store is None and os.path.exists(_path(namespace)):
+        store = ChunkStore(_path(namespace))
+        _opened.put(namespace, store)
+    return store
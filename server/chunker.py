@@ -0,0 +1,113 @@
+# chunker.py
+import bisect
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import config
+
+# Places to end a chunk, in order of preference: paragraph break, line break, space.
+# A window with none of them is cut at the size limit.
+SEPARATORS = ("\n\n", "\n", " ")
+_NON_SPACE = re.compile(r"\S")
+
+
+def _cut(buffer: str, begin: int, floor: int, size: int) -> Tuple[int, str]:
+    """
+    End of the chunk starting at `begin`, and the separator it ends on: the last preferred
+    separator after `floor` within the window ("" when the window is cut at the size limit).
+    """
+    limit = begin + size
+    floor = max(floor, begin + size // 4)
+    for separator in SEPARATORS:
+        end = buffer.rfind(separator, floor, limit)
+        if end != -1:
+            return end, separator
+    return limit, ""
+
+
+def _next_begin(buffer: str, begin: int, end: int, separator: str, overlap: int) -> int:
+    """
+    Start of the chunk after [begin, end), which ended on `separator`: it repeats the whole
+    pieces between `separator`s (or words, after a cut at the size limit) that fit in the
+    last `overlap` characters of the chunk. So a chunk ending on a paragraph break only
+    repeats short paragraphs, and mostly none, as the recursive splitter this replaced did.
+    """
+    if overlap <= 0:
+        return end
+    separator = separator or " "
+    found = buffer.find(separator, max(begin + 1, end - overlap), end)
+    return found + len(separator) if found != -1 else end
+
+
+def iter_chunks(pages: Iterable[str], first_page: Optional[int] = None,
+                chunk_size: Optional[int] = None, chunk_overlap: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Splits text arriving page by page into chunks of at most `chunk_size` characters
+    (config.CHUNK_SIZE). A chunk ends at its window's last paragraph break, else line
+    break, else space, so chunks follow the document's structure, and repeats the whole
+    pieces of the one before that fit in `chunk_overlap` (config.CHUNK_OVERLAP) characters:
+    words within a paragraph, but only short paragraphs across a paragraph break.
+
+    Yields dicts with the stripped "text" and the "start" offset of that text in the
+    concatenated pages, plus the 1-based "page" it starts on when `first_page` (the
+    number of the first page) is given. Only the unfinished end of the previous page is
+    kept with the current one, so memory stays near one page.
+    """
+    size = chunk_size or config.CHUNK_SIZE
+    overlap = config.CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap
+    buffer = ""
+    # Offset of buffer[0] in the concatenated pages
+    buffer_start = 0
+    # Offsets and numbers of the pages overlapping the buffer
+    page_starts: List[int] = []
+    page_numbers: List[int] = []
+    # Next chunk start, and end of the last chunk, as buffer positions
+    begin, last_end = 0, 0
+
+    def make_chunk(start: int, end: int) -> Optional[Dict]:
+        raw = buffer[start:end]
+        text = raw.strip()
+        if not text:
+            return None
+        offset = buffer_start + start + len(raw) - len(raw.lstrip())
+        chunk = {"text": text, "start": offset}
+        if first_page is not None:
+            chunk["page"] = page_numbers[bisect.bisect_right(page_starts, offset) - 1]
+        return chunk
+
+    for number, page in enumerate(pages, first_page or 1):
+        # Drop the text that is already chunked before appending the page
+        buffer_start += begin
+        last_end -= begin
+        buffer = buffer[begin:] + page
+        begin = 0
+        page_starts.append(buffer_start + len(buffer) - len(page))
+        page_numbers.append(number)
+        while len(page_starts) > 1 and page_starts[1] <= buffer_start:
+            del page_starts[0], page_numbers[0]
+
+        while len(buffer) - begin > size:
+            # Each chunk must end past the first character not in the previous chunk, or it
+            # would only repeat that chunk's text (e.g. by cutting inside the break it ended on)
+            match = _NON_SPACE.search(buffer, last_end)
+            floor = match.start() if match else len(buffer)
+            if floor >= begin + size:
+                # Nothing new within the window, only whitespace: start after it
+                begin = last_end = floor
+                continue
+            end, separator = _cut(buffer, begin, floor, size)
+            chunk = make_chunk(begin, end)
+            if chunk:
+                yield chunk
+            begin, last_end = _next_begin(buffer, begin, end, separator, overlap), end
+
+    # The rest, unless it only repeats the end of the last chunk
+    if buffer[max(last_end, begin):].strip():
+        chunk = make_chunk(begin, len(buffer))
+        if chunk:
+            yield chunk
+
+
+def chunk_text(text: str) -> List[Dict]:
+    """Chunks a document without pages (see iter_chunks)."""
+    return list(iter_chunks([text]))
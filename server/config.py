@@ -11,6 +11,12 @@ BEARER_TOKEN = "af215d20c2561423c20b7ccdfbb4dbc6fe7c5bb9bc869dae38917c8de16368ca
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 # Gemini model for generating text embeddings
 EMBEDDING_MODEL = "models/embedding-001"
+# Maximum number of texts sent in a single embedding request
+EMBEDDING_BATCH_SIZE = 100
+# Maximum total characters per embedding request, to stay under the API payload limit
+EMBEDDING_BATCH_MAX_CHARS = 200000
+# Embedding requests in flight at once during ingestion
+EMBEDDING_MAX_CONCURRENT_BATCHES = 4
 # Gemini model for generating conversational answers
 GENERATION_MODEL = "gemini-1.5-flash-latest"
 
@@ -18,5 +24,167 @@ GENERATION_MODEL = "gemini-1.5-flash-latest"
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = "hackrx-gemini-index"
 
+# --- Vector Store Configuration ---
+# Vectors per upsert request and upsert requests in flight at once during ingestion
+UPSERT_BATCH_SIZE = 100
+UPSERT_MAX_CONCURRENT = 4
+# "pinecone" for the hosted index, "local" for the in-process memory-mapped index
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone")
+# Dimension of the vectors produced by EMBEDDING_MODEL
+EMBEDDING_DIMENSION = 768
+# Directory holding one sub-directory per namespace for the local backend
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "local_index")
+# Namespaces with at least this many vectors get an IVF partition in the local backend
+LOCAL_IVF_MIN_VECTORS = 20000
+# Number of IVF partitions scanned per query
+LOCAL_IVF_NPROBE = 8
+# The IVF partition is retrained once the vectors appended after it exceed this fraction of those in it
+LOCAL_IVF_RETRAIN_GROWTH = 0.25
+
 # --- System Configuration ---
-TOP_K_CLAUSES =12
\ No newline at end of file
+# Most clauses retrieved per question; fewer are returned when the scores fall off or the candidates repeat each other
+TOP_K_CLAUSES =6
+# Fewest clauses retrieved per question, whatever their scores
+MIN_CLAUSES = 2
+# Candidates taken from each of the vector and BM25 rankings before the cutoff, fusion and MMR re-selection
+RETRIEVAL_CANDIDATES = 20
+# Vector candidates below this cosine similarity to the question are dropped
+RETRIEVAL_MIN_SIMILARITY = 0.3
+# Vector candidates more than this far below the best cosine similarity are dropped
+RETRIEVAL_MAX_SCORE_DROP = 0.15
+# BM25 candidates scoring below this fraction of the best BM25 score are dropped
+LEXICAL_MIN_RELATIVE_SCORE = 0.3
+# Weight of redundancy against relevance in maximal-marginal-relevance re-selection (0 disables diversity)
+MMR_DIVERSITY = 0.3
+# Candidates at least this similar to an already selected clause are treated as duplicates
+MMR_DUPLICATE_SIMILARITY = 0.95
+# Reciprocal-rank fusion constant
+RRF_K = 60
+# Directory holding the per-namespace BM25 indexes
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "lexical_index")
+# Directory holding the compressed chunk texts of each namespace, resolved locally at query time
+CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR", "chunk_store")
+# Also keep chunk texts in the vector metadata, so documents stay answerable on hosts without
+# their chunk store (ingested by another host, or a wiped disk). Disable only on a single host
+# with persistent storage, to keep vector metadata small.
+VECTOR_METADATA_TEXT = os.getenv("VECTOR_METADATA_TEXT", "true").lower() == "true"
+# Namespaces whose chunk store, BM25 index and local vectors stay open per worker process;
+# the least recently used are closed beyond this
+MAX_OPEN_NAMESPACES = int(os.getenv("MAX_OPEN_NAMESPACES", "128"))
+# Approximate prompt token budget for the context clauses of one question
+CONTEXT_TOKEN_BUDGET = 1500
+# Characters per token used to estimate prompt size
+CHARS_PER_TOKEN = 4
+# Maximum number of questions answered concurrently within a single request
+MAX_CONCURRENT_QUESTIONS = 5
+
+# --- Batched Generation ---
+# Answer questions with overlapping clauses in one generation call (not used for streamed answers)
+BATCHED_GENERATION = os.getenv("BATCHED_GENERATION", "false").lower() == "true"
+# A question joins a batch when at least this fraction of its clauses is already in the batch's context
+BATCH_MIN_CLAUSE_OVERLAP = 0.5
+# Most questions answered by one generation call
+BATCH_MAX_QUESTIONS = 8
+# Most distinct clauses retrieved for the questions of one batch
+BATCH_MAX_CLAUSES = 12
+# Approximate prompt token budget for the shared context clauses of one batch
+BATCH_CONTEXT_TOKEN_BUDGET = 3000
+
+# --- Corpus Queries ---
+# Most documents one corpus query (POST /corpus/query) may search
+CORPUS_MAX_DOCUMENTS = 100
+# Documents searched concurrently by one corpus query
+CORPUS_MAX_CONCURRENT_RETRIEVALS = 8
+# Most clauses kept across all documents of a corpus query
+CORPUS_TOP_K_CLAUSES = 10
+# Approximate prompt token budget for the context clauses of a corpus query
+CORPUS_CONTEXT_TOKEN_BUDGET = 2500
+
+# --- Database ---
+DATABASE_URL = os.getenv("DATABASE_URL")
+# Connection pool sizing, per engine and per worker process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = 30
+# Seconds after which pooled connections are replaced (serverless Postgres drops idle ones)
+DB_POOL_RECYCLE = 300
+# Query logs are written in bulk once this many rows are buffered, or after this many milliseconds
+QUERY_LOG_BATCH_SIZE = 100
+QUERY_LOG_FLUSH_INTERVAL_MS = 500
+
+# --- Retries ---
+# Attempts (including the first) and full-jitter exponential backoff bounds, in seconds, for transient API errors
+RETRY_MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+# --- Gemini Rate Limits ---
+# Per-model quotas the Gemini scheduler stays within; set these to the project's limits
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "1500"))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", "1000000"))
+GENERATION_REQUESTS_PER_MINUTE = int(os.getenv("GENERATION_REQUESTS_PER_MINUTE", "1000"))
+GENERATION_TOKENS_PER_MINUTE = int(os.getenv("GENERATION_TOKENS_PER_MINUTE", "1000000"))
+# Share of each budget that ingestion leaves free for query-time calls
+GEMINI_QUERY_RESERVE = 0.2
+# Output tokens budgeted per answer when admitting a generation call
+GENERATION_OUTPUT_TOKENS_ESTIMATE = 300
+
+# --- Answer Cache ---
+# In-memory tier; the queries table is the second, persistent tier
+ANSWER_CACHE_MAX_ENTRIES = 10000
+ANSWER_CACHE_MAX_BYTES = 32 * 1024 * 1024
+ANSWER_CACHE_TTL_SECONDS = 3600
+
+# --- Document Extraction ---
+# Worker processes used for text extraction and chunking
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "2"))
+# Maximum number of documents being extracted (or waiting for a worker) at once
+EXTRACTION_MAX_PENDING = 8
+# Seconds a request waits for an extraction slot before being rejected
+EXTRACTION_QUEUE_TIMEOUT = 30
+# PDFs at least this large are split into page ranges extracted in parallel
+PDF_SHARD_MIN_BYTES = 2 * 1024 * 1024
+# Number of pages per extraction shard
+PDF_PAGES_PER_SHARD = 25
+# Largest chunk in characters, and how many characters of the previous chunk each chunk repeats at most
+CHUNK_SIZE = 400
+CHUNK_OVERLAP = 150
+
+# --- Ingestion ---
+# Seconds after which another worker's unfinished ingestion claim is considered abandoned
+INGESTION_CLAIM_TIMEOUT = 600
+# Seconds between checks while waiting for another worker's ingestion
+INGESTION_CLAIM_POLL_INTERVAL = 1.0
+# Background ingestion jobs (POST /documents): concurrent jobs per worker process,
+# jobs allowed to wait for a slot, and minimum seconds between progress updates of a job
+INGESTION_JOB_WORKERS = int(os.getenv("INGESTION_JOB_WORKERS", "2"))
+INGESTION_JOB_MAX_PENDING = 32
+INGESTION_JOB_PROGRESS_INTERVAL = 1.0
+# Seconds a document that its URL no longer serves is kept for the requests already using it,
+# before it is deleted with its index (unless another URL or an upload still refers to it)
+RETIRED_DOCUMENT_GRACE_SECONDS = 300
+
+# --- Startup ---
+# Open database connections, the vector index and the extraction workers when a worker
+# process starts, instead of on its first request
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
+
+# --- Uploads ---
+# Uploaded files larger than this are spooled to a temp file instead of kept in memory
+UPLOAD_SPOOL_THRESHOLD = 1024 * 1024
+# Largest file accepted by the streaming upload endpoint
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+# Largest non-file form field (e.g. a question) accepted by the upload endpoint
+MAX_UPLOAD_FIELD_BYTES = 64 * 1024
+
+# --- Downloads ---
+# Largest document accepted from a URL; larger downloads are aborted while streaming
+MAX_DOWNLOAD_BYTES = 100 * 1024 * 1024
+# Seconds to wait for a connection and between received chunks of a download
+DOWNLOAD_TIMEOUT = 30
+# Connections the pooled HTTP client keeps open across downloads, per worker process
+DOWNLOAD_MAX_CONNECTIONS = 20
+# Downloaded documents, stored by content checksum, with the ETag and Last-Modified of each URL
+DOWNLOAD_CACHE_DIR = os.getenv("DOWNLOAD_CACHE_DIR", "download_cache")
+# The least recently used downloads are removed once the cache grows beyond this size
+DOWNLOAD_CACHE_MAX_BYTES = int(os.getenv("DOWNLOAD_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
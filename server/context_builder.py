@@ -0,0 +1,120 @@
+# context_builder.py
+from typing import Dict, List, Optional, Tuple
+
+import config
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for prompt budgeting, without a tokenizer round trip."""
+    return (len(text) + config.CHARS_PER_TOKEN - 1) // config.CHARS_PER_TOKEN
+
+
+def _label(text: str, source: Optional[str], page: Optional[int]) -> str:
+    """Prefixes a clause with the document and page it comes from, when known."""
+    if source is not None and page is not None:
+        return f"[{source}, Page {page}] {text}"
+    if source is not None:
+        return f"[{source}] {text}"
+    if page is not None:
+        return f"[Page {page}] {text}"
+    return text
+
+
+def assemble_context(matches: List[Dict], token_budget: Optional[int] = None) -> Tuple[List[str], int]:
+    """
+    Turns retrieved matches (best first) into the context clauses sent to the LLM.
+    Chunks with known offsets that overlap or touch are merged into one contiguous
+    span, so the chunker's overlap is only sent once; exact duplicate texts are dropped.
+    Spans are then added in relevance order (a span ranks as its best chunk) until
+    `token_budget` is reached; a span that does not fit is skipped in favour of smaller ones.
+    Spans of chunks with a page number are labelled with the page they start on, so
+    answers can cite it. Matches from several documents carry a "source" label (such as
+    "Document 12"), which keeps their spans apart and is added to their clause labels.
+    Returns the clauses and the estimated number of prompt tokens saved compared to
+    joining all matched chunks verbatim.
+    """
+    if token_budget is None:
+        token_budget = config.CONTEXT_TOKEN_BUDGET
+
+    # Each span is [source, start, end, text, rank, page]; chunks indexed without offsets cannot be merged
+    spans: List[list] = []
+    loose: List[Tuple[int, str]] = []
+    seen_texts = set()
+    for rank, match in enumerate(matches):
+        text = match['metadata']['text']
+        source = match.get('source')
+        if (source, text) in seen_texts:
+            continue
+        seen_texts.add((source, text))
+        start = match['metadata'].get('start')
+        if start is None:
+            loose.append((rank, _label(text, source, None)))
+        else:
+            spans.append([source or "", int(start), int(start) + len(text), text, rank, match['metadata'].get('page')])
+
+    merged: List[list] = []
+    for span in sorted(spans):
+        last = merged[-1] if merged else None
+        if last is not None and span[0] == last[0] and span[1] <= last[2]:
+            if span[2] > last[2]:
+                last[3] += span[3][last[2] - span[1]:]
+                last[2] = span[2]
+            last[4] = min(last[4], span[4])
+        else:
+            merged.append(span)
+
+    labelled = [(span[4], _label(span[3], span[0] or None, span[5])) for span in merged]
+    candidates = sorted(labelled + loose)
+    clauses, used_tokens = [], 0
+    for _, text in candidates:
+        tokens = estimate_tokens(text)
+        if used_tokens + tokens > token_budget:
+            continue
+        clauses.append(text)
+        used_tokens += tokens
+
+    verbatim_tokens = estimate_tokens("\n\n".join(match['metadata']['text'] for match in matches))
+    return clauses, max(0, verbatim_tokens - estimate_tokens("\n\n".join(clauses)))
+
+
+def group_by_overlap(match_ids: List[List[str]], min_overlap: float, max_questions: int, max_clauses: int) -> List[List[int]]:
+    """
+    Groups questions (given as the ids of their retrieved matches) for batched answering.
+    Each question, in order, joins the group already holding the largest fraction of its
+    matches, if that fraction is at least `min_overlap` and the group stays within
+    `max_questions` questions and `max_clauses` distinct matches; otherwise it starts a
+    new group. Returns lists of question indexes.
+    """
+    groups: List[List[int]] = []
+    group_ids: List[set] = []
+    for index, ids in enumerate(match_ids):
+        ids = set(ids)
+        best, best_overlap = None, min_overlap
+        for g, union in enumerate(group_ids):
+            if not ids or len(groups[g]) >= max_questions or len(union | ids) > max_clauses:
+                continue
+            overlap = len(ids & union) / len(ids)
+            if overlap >= best_overlap:
+                best, best_overlap = g, overlap
+        if best is None:
+            groups.append([index])
+            group_ids.append(ids)
+        else:
+            groups[best].append(index)
+            group_ids[best] |= ids
+    return groups
+
+
+def merge_matches(match_lists: List[List[Dict]]) -> List[Dict]:
+    """
+    Combines the matches of several questions into one ranking for a shared context:
+    every question's best match first, then every question's second best, and so on,
+    keeping the first occurrence of each id.
+    """
+    merged, seen = [], set()
+    for rank in range(max((len(matches) for matches in match_lists), default=0)):
+        for matches in match_lists:
+            if rank < len(matches) and matches[rank]['id'] not in seen:
+                seen.add(matches[rank]['id'])
+                merged.append(matches[rank])
+    return merged
@@ -1,31 +1,236 @@
 # crud.py
+import uuid
+from datetime import timedelta
+from sqlalchemy import delete, exists, false, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
 import models
 
 def get_document_by_url(db: Session, url: str):
-    """Retrieve a document from the database by its URL."""
-    return db.query(models.Document).filter(models.Document.url == url).first()
+    """Retrieve the document a URL currently serves."""
+    return db.query(models.Document).join(models.DocumentURL, models.DocumentURL.document_id == models.Document.id).filter(
+        models.DocumentURL.url == url
+    ).first()
 
 def get_document_by_checksum(db: Session, checksum: str):
     """Retrieve a document from the database by its checksum."""
     return db.query(models.Document).filter(models.Document.checksum == checksum).first()
 
-def create_document(db: Session, url: str | None, checksum: str | None):
+def create_document(db: Session, url: str | None, checksum: str | None, chunk_hashes: list[str] | None = None):
     """Add a new document record to the database."""
-    db_document = models.Document(url=url, checksum=checksum)
+    db_document = models.Document(url=url, checksum=checksum, chunk_hashes=chunk_hashes)
     db.add(db_document)
     db.commit()
     db.refresh(db_document)
     return db_document
 
-def create_query(db: Session, document_id: int, question: str, answer: str):
-    """Log a question and its answer to the database."""
-    db_query = models.Query(
-        question=question, 
-        answer=answer, 
-        document_id=document_id
+async def find_document(db: AsyncSession, url: str | None = None, checksum: str | None = None):
+    """
+    Retrieve a document by its checksum when one is given, else by the URL that serves it
+    (through document_urls), in a single indexed query. A URL's content may have changed
+    since, so a checksum never falls back to the URL.
+    """
+    if checksum:
+        statement = select(models.Document).where(models.Document.checksum == checksum)
+    elif url:
+        statement = select(models.Document).join(
+            models.DocumentURL, models.DocumentURL.document_id == models.Document.id
+        ).where(models.DocumentURL.url == url)
+    else:
+        return None
+    result = await db.execute(statement.limit(1))
+    return result.scalars().first()
+
+async def get_documents(db: AsyncSession, document_ids: list[int]) -> list[models.Document]:
+    """Retrieve the documents with the given ids, in id order; unknown ids are left out."""
+    result = await db.execute(
+        select(models.Document).where(models.Document.id.in_(document_ids)).order_by(models.Document.id)
+    )
+    return list(result.scalars())
+
+async def get_collection(db: AsyncSession, name: str):
+    """Retrieve a collection by name."""
+    result = await db.execute(select(models.Collection).where(models.Collection.name == name))
+    return result.scalars().first()
+
+async def get_collection_documents(db: AsyncSession, collection: models.Collection) -> list[models.Document]:
+    """Retrieve the documents of a collection, in id order."""
+    result = await db.execute(
+        select(models.Document)
+        .join(models.collection_documents, models.collection_documents.c.document_id == models.Document.id)
+        .where(models.collection_documents.c.collection_id == collection.id)
+        .order_by(models.Document.id)
+    )
+    return list(result.scalars())
+
+async def set_collection_documents(db: AsyncSession, name: str, document_ids: list[int]):
+    """Create the collection if it is new and replace its documents with the given ones."""
+    collection = await get_collection(db, name)
+    if collection is None:
+        collection = models.Collection(name=name)
+        db.add(collection)
+        await db.flush()
+    await db.execute(delete(models.collection_documents).where(models.collection_documents.c.collection_id == collection.id))
+    if document_ids:
+        await db.execute(insert(models.collection_documents), [
+            {"collection_id": collection.id, "document_id": document_id} for document_id in document_ids
+        ])
+    await db.commit()
+    await db.refresh(collection)
+    return collection
+
+def _dialect_insert(db):
+    """The INSERT construct of the session's dialect, which supports ON CONFLICT."""
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+async def set_document_url(db: AsyncSession, url: str, db_document: models.Document):
+    """Record that a URL serves a document, replacing the document it served before."""
+    statement = _dialect_insert(db)(models.DocumentURL).values(url=url, document_id=db_document.id)
+    statement = statement.on_conflict_do_update(
+        index_elements=["url"], set_={"document_id": db_document.id, "updated_at": func.now()}
+    )
+    await db.execute(statement)
+    await db.commit()
+
+async def mark_document_uploaded(db: AsyncSession, db_document: models.Document):
+    """Record that an upload resolved to a document."""
+    await db.execute(update(models.Document).where(models.Document.id == db_document.id).values(uploaded=True))
+    await db.commit()
+    db_document.uploaded = True
+
+async def retire_document(db: AsyncSession, db_document: models.Document, replacement_id: int) -> bool:
+    """
+    Delete a document that no URL serves any more and no upload resolved to, moving its
+    collection memberships to its replacement. Its logged queries and ingestion jobs are
+    kept, no longer linked to a document. Returns False, changing nothing, when the
+    document is still referenced.
+    """
+    members = models.collection_documents
+    await db.execute(delete(members).where(
+        members.c.document_id == db_document.id,
+        members.c.collection_id.in_(select(members.c.collection_id).where(members.c.document_id == replacement_id))
+    ))
+    await db.execute(update(members).where(members.c.document_id == db_document.id).values(document_id=replacement_id))
+    await db.execute(update(models.Query).where(models.Query.document_id == db_document.id).values(document_id=None))
+    await db.execute(update(models.IngestionJob).where(models.IngestionJob.document_id == db_document.id).values(document_id=None))
+    # The reference check is part of the delete, so a URL pointed at the document meanwhile keeps it
+    result = await db.execute(delete(models.Document).where(
+        models.Document.id == db_document.id,
+        models.Document.uploaded == false(),
+        ~exists().where(models.DocumentURL.document_id == db_document.id)
+    ))
+    if result.rowcount == 0:
+        await db.rollback()
+        return False
+    await db.commit()
+    return True
+
+async def create_queries(db: AsyncSession, rows: list[dict]):
+    """Log many questions and answers with one bulk insert. Each row holds models.Query column values."""
+    if not rows:
+        return
+    await db.execute(insert(models.Query), rows)
+    await db.commit()
+
+async def get_logged_answers(db: AsyncSession, db_document: models.Document, question_hashes: list[str], model: str, prompt_version: str) -> dict[str, str]:
+    """Return answers logged since the document was last indexed, keyed by question hash."""
+    result = await db.execute(
+        select(models.Query.question_hash, models.Query.answer).where(
+            models.Query.document_id == db_document.id,
+            models.Query.created_at >= db_document.indexed_at,
+            models.Query.question_hash.in_(question_hashes),
+            models.Query.model == model,
+            models.Query.prompt_version == prompt_version
+        )
+    )
+    return {row.question_hash: row.answer for row in result}
+
+async def create_ingestion_job(db: AsyncSession, job_id: str, source: str, checksum: str | None, status: str = "queued", document_id: int | None = None):
+    """Record a new background ingestion job."""
+    db_job = models.IngestionJob(id=job_id, source=source, checksum=checksum, status=status, document_id=document_id, chunks_indexed=0)
+    db.add(db_job)
+    await db.commit()
+    await db.refresh(db_job)
+    return db_job
+
+async def get_ingestion_job(db: AsyncSession, job_id: str):
+    """Retrieve a background ingestion job by its id."""
+    return await db.get(models.IngestionJob, job_id)
+
+async def update_ingestion_job(db: AsyncSession, job_id: str, **values):
+    """Update the status or progress columns of a background ingestion job."""
+    await db.execute(
+        update(models.IngestionJob).where(models.IngestionJob.id == job_id).values(updated_at=func.now(), **values)
+    )
+    await db.commit()
+
+async def fail_ingestion_jobs(db: AsyncSession, job_ids: list[str], error: str):
+    """Mark unfinished background ingestion jobs as failed."""
+    if not job_ids:
+        return
+    await db.execute(
+        update(models.IngestionJob).where(
+            models.IngestionJob.id.in_(job_ids),
+            models.IngestionJob.status.in_(["queued", "running"])
+        ).values(status="failed", stage=None, error=error, updated_at=func.now())
     )
-    db.add(db_query)
+    await db.commit()
+
+def _database_time_ago(db: Session, seconds: int):
+    """The time `seconds` ago by the database's clock, which all workers share whatever their own clocks say."""
+    if db.bind.dialect.name == "sqlite":
+        return func.datetime("now", f"-{seconds} seconds")
+    return func.now() - timedelta(seconds=seconds)
+
+def claim_ingestion(db: Session, namespace: str, stale_after_seconds: int) -> str | None:
+    """
+    Try to claim the right to ingest a document namespace. Returns the claim's token, to be
+    passed to release_ingestion, or None if another worker holds the claim. Claims older
+    than stale_after_seconds are taken over.
+    """
+    db.query(models.IngestionClaim).filter(
+        models.IngestionClaim.namespace == namespace,
+        models.IngestionClaim.claimed_at < _database_time_ago(db, stale_after_seconds)
+    ).delete(synchronize_session=False)
+    token = uuid.uuid4().hex
+    db.add(models.IngestionClaim(namespace=namespace, token=token))
+    try:
+        db.commit()
+        return token
+    except IntegrityError:
+        db.rollback()
+        return None
+
+def release_ingestion(db: Session, token: str):
+    """
+    Release an ingestion claim taken with claim_ingestion. A claim that was taken over
+    as stale is gone already, and the new holder's claim is left alone.
+    """
+    db.query(models.IngestionClaim).filter(models.IngestionClaim.token == token).delete(synchronize_session=False)
     db.commit()
-    db.refresh(db_query)
-    return db_query
\ No newline at end of file
+
+def get_chunk_embeddings(db: Session, text_hashes: list[str], model: str, task_type: str) -> dict[str, bytes]:
+    """Return stored embeddings for the given chunk hashes, keyed by hash."""
+    rows = db.query(models.ChunkEmbedding.text_hash, models.ChunkEmbedding.embedding).filter(
+        models.ChunkEmbedding.text_hash.in_(text_hashes),
+        models.ChunkEmbedding.model == model,
+        models.ChunkEmbedding.task_type == task_type
+    ).all()
+    return {row.text_hash: row.embedding for row in rows}
+
+def save_chunk_embeddings(db: Session, embeddings: dict[str, bytes], model: str, task_type: str):
+    """Store chunk embeddings, ignoring any that another worker stored first."""
+    if not embeddings:
+        return
+    statement = _dialect_insert(db)(models.ChunkEmbedding).values([
+        {"text_hash": text_hash, "model": model, "task_type": task_type, "embedding": embedding}
+        for text_hash, embedding in embeddings.items()
+    ]).on_conflict_do_nothing(index_elements=["text_hash", "model", "task_type"])
+    db.execute(statement)
+    db.commit()
\ No newline at end of file
@@ -1,25 +1,123 @@
 # database.py
-from sqlalchemy import create_engine
+import asyncio
+import time
+from typing import Optional
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-import os
-from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
+import config
+import metrics
 
-# Get the database URL from the environment
-SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
+def _pool_options(url) -> dict:
+    # SQLite (used for local runs) does not take the pool sizing options
+    if url.get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+    }
 
-if not SQLALCHEMY_DATABASE_URL:
-    raise ValueError("❌ DATABASE_URL environment variable not found. Please check your .env file.")
+def _async_database_url(url):
+    """
+    Maps DATABASE_URL to its asyncio driver. asyncpg does not understand libpq's
+    `sslmode` / `channel_binding` query options, so sslmode is passed as its `ssl` argument.
+    """
+    connect_args = {}
+    backend = url.get_backend_name()
+    if backend == "postgresql":
+        query = dict(url.query)
+        sslmode = query.pop("sslmode", None)
+        query.pop("channel_binding", None)
+        if sslmode and sslmode != "disable":
+            connect_args["ssl"] = sslmode
+        url = url.set(drivername="postgresql+asyncpg", query=query)
+    elif backend == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url, connect_args
 
-# Add pool_pre_ping=True to the engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    pool_pre_ping=True
-)
+def _time_queries(sync_engine):
+    """Records every statement's execution time as the db_query stage."""
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_times", []).append(time.perf_counter())
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        metrics.record_stage("db_query", time.perf_counter() - conn.info["query_start_times"].pop())
 
-Base = declarative_base()
\ No newline at end of file
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        # A failed statement never reaches after_cursor_execute
+        if context.connection is not None and context.connection.info.get("query_start_times"):
+            context.connection.info["query_start_times"].pop()
+
+# The session factories are bound to their engines by init_db(), which runs in each
+# worker process after forking, so no connection pool is ever shared across a fork.
+# The synchronous engine serves ingestion and migrations; request handlers use the async engine
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+AsyncSessionLocal = async_sessionmaker(class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+
+def get_engine() -> Engine:
+    """Returns the synchronous engine, creating it and binding SessionLocal on first use."""
+    global _engine
+    if _engine is None:
+        if not config.DATABASE_URL:
+            raise ValueError("❌ DATABASE_URL environment variable not found. Please check your .env file.")
+        _engine = create_engine(
+            config.DATABASE_URL,
+            pool_pre_ping=True,
+            **_pool_options(make_url(config.DATABASE_URL))
+        )
+        _time_queries(_engine)
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+def get_async_engine() -> AsyncEngine:
+    """Returns the asyncio engine, creating it and binding AsyncSessionLocal on first use."""
+    global _async_engine
+    if _async_engine is None:
+        if not config.DATABASE_URL:
+            raise ValueError("❌ DATABASE_URL environment variable not found. Please check your .env file.")
+        url = make_url(config.DATABASE_URL)
+        async_url, connect_args = _async_database_url(url)
+        _async_engine = create_async_engine(
+            async_url,
+            pool_pre_ping=True,
+            connect_args=connect_args,
+            **_pool_options(url)
+        )
+        _time_queries(_async_engine.sync_engine)
+        AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
+
+def init_db():
+    """Creates both engines; sessions can be opened from then on."""
+    get_engine()
+    get_async_engine()
+
+async def warm_up_db():
+    """Opens the first pooled connection of each engine ahead of the first request."""
+    def connect_sync():
+        with get_engine().connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+    async with get_async_engine().connect() as connection:
+        await connection.execute(text("SELECT 1"))
+    await asyncio.to_thread(connect_sync)
+
+async def dispose_db():
+    """Closes the pooled connections of both engines."""
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
+
+Base = declarative_base()
@@ -0,0 +1,48 @@
+# diversity.py
+from typing import List
+
+import numpy as np
+
+
+def adaptive_cutoff(scores: np.ndarray, min_score: float, max_drop: float, min_keep: int) -> np.ndarray:
+    """
+    Boolean mask of the scores worth keeping: those at least `min_score` and within
+    `max_drop` of the best score, so a question with one clear answer keeps few
+    candidates and a broad one keeps many. The `min_keep` best are always kept.
+    """
+    keep = (scores >= min_score) & (scores >= scores.max(initial=-np.inf) - max_drop)
+    if min_keep > 0 and len(scores):
+        keep[np.argsort(-scores, kind="stable")[:min_keep]] = True
+    return keep
+
+
+def select_mmr(relevance: np.ndarray, vectors: np.ndarray, min_selected: int, max_selected: int, diversity: float, duplicate_similarity: float) -> List[int]:
+    """
+    Maximal marginal relevance: repeatedly picks the candidate maximising
+    (1 - diversity) * relevance - diversity * (max cosine similarity to those already picked).
+    Once `min_selected` are picked, candidates at least `duplicate_similarity` similar to a
+    picked one are no longer considered, so selection can stop early. Rows of `vectors` that
+    are all zeros (no vector known) are never considered redundant. Returns candidate positions in selection order.
+    """
+    count = len(relevance)
+    if not count:
+        return []
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+    similarity = unit @ unit.T
+
+    redundancy = np.zeros(count, dtype=similarity.dtype)
+    unselected = np.ones(count, dtype=bool)
+    selected: List[int] = []
+    while len(selected) < max_selected:
+        available = unselected
+        if len(selected) >= min_selected:
+            available = unselected & (redundancy < duplicate_similarity)
+        if not available.any():
+            break
+        marginal = np.where(available, (1 - diversity) * relevance - diversity * redundancy, -np.inf)
+        best = int(np.argmax(marginal))
+        selected.append(best)
+        unselected[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
@@ -1,20 +1,85 @@
-import requests
+import asyncio
+import importlib
 import io
-import fitz  # PyMuPDF
-import docx
-from typing import List
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 import email
-from extract_msg import Message
+import config
+import metrics
+from chunker import chunk_text, iter_chunks
+
+class ExtractionQueueFullError(RuntimeError):
+    """Raised when too many documents are already waiting for extraction."""
+
+# Extraction and chunking are CPU-bound and run in a worker process pool, created
+# lazily so that each gunicorn worker builds its own pool after forking.
+_executor: Optional[ProcessPoolExecutor] = None
+# Bounds the number of documents held in memory for extraction at any one time
+_extraction_slots = asyncio.Semaphore(config.EXTRACTION_MAX_PENDING)
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=config.EXTRACTION_WORKERS)
+    return _executor
+
+async def _run_in_pool(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+
+# Modules of the format-specific parsers, imported by the extraction functions below
+_PARSER_MODULES = ("docx", "extract_msg", "fitz")
+
+def _import_parsers():
+    """Runs in a worker process: loads the parsers ahead of the first document."""
+    for module in _PARSER_MODULES:
+        importlib.import_module(module)
+
+async def warm_up_extraction_pool():
+    """Starts the extraction worker processes and loads the parsers in them."""
+    await asyncio.gather(*(_run_in_pool(_import_parsers) for _ in range(config.EXTRACTION_WORKERS)))
+
+# The format-specific parsers are imported inside the functions that use them. Those only
+# run in the extraction worker processes, so the server process never imports the parsers.
+
+def _chunk_pdf(content: bytes) -> List[Dict]:
+    """Chunks PDF file content page by page, with page numbers."""
+    import fitz  # PyMuPDF
 
-def _extract_text_from_pdf(content: bytes) -> str:
-    """Extracts text from PDF file content."""
     with fitz.open(stream=content, filetype="pdf") as doc:
-        text = "".join(page.get_text() for page in doc)
-    return text
+        return list(iter_chunks((page.get_text() for page in doc), first_page=1))
+
+def _count_pdf_pages(path: str) -> int:
+    """Returns the number of pages of a PDF file on disk."""
+    import fitz
+
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+def _chunk_pdf_pages(path: str, start: int, stop: int) -> Tuple[List[Dict], int]:
+    """
+    Chunks pages [start, stop) of a PDF file on disk. Chunk offsets are relative to the
+    first page of the range; returns the chunks and the length of the range's text.
+    """
+    import fitz
+
+    length = 0
+    with fitz.open(path) as doc:
+        def page_texts():
+            nonlocal length
+            for i in range(start, stop):
+                text = doc[i].get_text()
+                length += len(text)
+                yield text
+        chunks = list(iter_chunks(page_texts(), first_page=start + 1))
+    return chunks, length
 
 def _extract_text_from_docx(content: bytes) -> str:
     """Extracts text from DOCX file content."""
+    import docx
+
     doc = docx.Document(io.BytesIO(content))
     text = "\n".join([para.text for para in doc.paragraphs])
     return text
@@ -36,53 +101,119 @@ def _extract_text_from_email(content: bytes) -> str:
 
 def _extract_text_from_msg(content: bytes) -> str:
     """Extracts text from Outlook .msg files."""
+    from extract_msg import Message
+
     msg = Message(io.BytesIO(content))
     return f"From: {msg.sender}\nTo: {msg.to}\nSubject: {msg.subject}\nDate: {msg.date}\n\n{msg.body}"
 
-def get_text_chunks(text: str) -> List[str]:
-    """Splits a long text into smaller, semantically coherent chunks."""
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=400,
-        chunk_overlap=150,
-        length_function=len
-    )
-    chunks = text_splitter.split_text(text)
-    return chunks
-
-async def process_document_content(content: bytes, filename: str) -> List[str]:
-    """
-    Core function to extract text from raw file content based on filename
-    and split it into chunks.
-    """
-    raw_text = ""
+def _extract_text(content: bytes, filename: str) -> str:
+    """Extracts raw text from file content based on its filename."""
     filename_lower = filename.lower()
 
     # FIX: Changed from .endswith() to 'in' to handle URLs with query parameters
-    if '.pdf' in filename_lower:
-        raw_text = _extract_text_from_pdf(content)
-    elif '.docx' in filename_lower or '.doc' in filename_lower:
-        raw_text = _extract_text_from_docx(content)
+    if '.docx' in filename_lower or '.doc' in filename_lower:
+        return _extract_text_from_docx(content)
     elif '.eml' in filename_lower:
-        raw_text = _extract_text_from_email(content)
+        return _extract_text_from_email(content)
     elif '.msg' in filename_lower:
-        raw_text = _extract_text_from_msg(content)
+        return _extract_text_from_msg(content)
     else:
         raise ValueError(f"Unsupported file type: {filename}")
 
-    if not raw_text:
+def _extract_and_chunk(content: bytes, filename: str) -> List[Dict]:
+    """
+    Runs in a worker process: extracts text and splits it into chunks. PDFs are chunked
+    page by page, so their chunks also record the page they start on.
+    """
+    if '.pdf' in filename.lower():
+        chunks = _chunk_pdf(content)
+    else:
+        chunks = chunk_text(_extract_text(content, filename))
+    if not chunks:
          raise ValueError("Could not extract text from the document.")
+    return chunks
+
+def _extract_and_chunk_file(path: str, filename: str) -> List[Dict]:
+    """Runs in a worker process: extracts and chunks a non-PDF document on disk."""
+    with open(path, "rb") as f:
+        content = f.read()
+    return _extract_and_chunk(content, filename)
 
-    return get_text_chunks(raw_text)
+def _write_temp_file(content: bytes) -> str:
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(content)
+        return f.name
+
+async def _extract_pdf_file(path: str) -> List[Dict]:
+    """
+    Extracts and chunks a PDF on disk by splitting it into page ranges that are
+    processed in parallel by the pool, then shifts each range's chunk offsets by the
+    text length of the ranges before it. Chunks do not span two ranges. Workers open
+    the file by path, so PyMuPDF reads pages on demand and the document is never
+    pickled across processes.
+    """
+    page_count = await _run_in_pool(_count_pdf_pages, path)
+    shard_size = config.PDF_PAGES_PER_SHARD
+    shards = await asyncio.gather(*(
+        _run_in_pool(_chunk_pdf_pages, path, start, min(start + shard_size, page_count))
+        for start in range(0, page_count, shard_size)
+    ))
+
+    chunks, offset = [], 0
+    for shard_chunks, length in shards:
+        for chunk in shard_chunks:
+            chunk["start"] += offset
+        chunks.extend(shard_chunks)
+        offset += length
+    if not chunks:
+         raise ValueError("Could not extract text from the document.")
+    return chunks
 
-async def process_document_from_url(url: str) -> List[str]:
+@asynccontextmanager
+async def _extraction_slot():
     """
-    Wrapper function to download a document from a web URL, then process its content.
+    Holds one of the config.EXTRACTION_MAX_PENDING extraction slots. Waits up to
+    config.EXTRACTION_QUEUE_TIMEOUT seconds before raising ExtractionQueueFullError.
     """
-    print(f"INFO: Downloading document from web URL: {url}")
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        content = response.content
-        return await process_document_content(content, url)
-    except requests.exceptions.RequestException as e:
-        raise ValueError(f"Failed to download document from URL: {url}. Error: {e}")
\ No newline at end of file
+        with metrics.stage("extract_queue_wait"):
+            await asyncio.wait_for(_extraction_slots.acquire(), timeout=config.EXTRACTION_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise ExtractionQueueFullError("Too many documents are being processed. Please retry shortly.")
+    try:
+        yield
+    finally:
+        _extraction_slots.release()
+
+async def process_document_content(content: bytes, filename: str) -> List[Dict]:
+    """
+    Core function to extract text from raw file content based on filename
+    and split it into chunks. The work runs in the extraction process pool.
+    """
+    async with _extraction_slot():
+        with metrics.stage("extract"):
+            if '.pdf' in filename.lower() and len(content) >= config.PDF_SHARD_MIN_BYTES:
+                # Large PDFs are sharded by page; the workers share the PDF through a temp file
+                path = await asyncio.to_thread(_write_temp_file, content)
+                try:
+                    chunks = await _extract_pdf_file(path)
+                finally:
+                    os.remove(path)
+            else:
+                chunks = await _run_in_pool(_extract_and_chunk, content, filename)
+    metrics.DOCUMENT_CHUNKS.observe(len(chunks))
+    return chunks
+
+async def process_document_file(path: str, filename: str) -> List[Dict]:
+    """
+    Same as process_document_content, for a document that is already on disk
+    (e.g. a spooled upload). The file is read by the workers, not by this process.
+    """
+    async with _extraction_slot():
+        with metrics.stage("extract"):
+            if '.pdf' in filename.lower():
+                chunks = await _extract_pdf_file(path)
+            else:
+                chunks = await _run_in_pool(_extract_and_chunk_file, path, filename)
+    metrics.DOCUMENT_CHUNKS.observe(len(chunks))
+    return chunks
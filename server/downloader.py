@@ -0,0 +1,207 @@
+# downloader.py
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+import config
+import metrics
+
+# Files used within this many seconds are never evicted, so a download is not removed while it is extracted
+_EVICTION_GRACE_SECONDS = 600
+_SUFFIX_PATTERN = re.compile(r"^\.[A-Za-z0-9]{1,8}$")
+
+
+class DownloadError(ValueError):
+    """Raised when a document cannot be downloaded, or is larger than config.MAX_DOWNLOAD_BYTES."""
+
+
+class Download:
+    """A downloaded document: its file in the download cache and the SHA-256 of its content."""
+
+    def __init__(self, path: str, checksum: str, not_modified: bool):
+        self.path = path
+        self.checksum = checksum
+        # True when the server answered 304 and the cached copy was used
+        self.not_modified = not_modified
+
+
+class DownloadCache:
+    """
+    Content-addressed document files under `root`, named by SHA-256 (plus the URL's file
+    extension, which the extractors rely on), and for each URL a small JSON record under
+    `root/urls` with the checksum, ETag and Last-Modified of its last download.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def _url_record_path(self, url: str) -> str:
+        return os.path.join(self.root, "urls", hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def content_path(self, checksum: str, suffix: str) -> str:
+        return os.path.join(self.root, checksum + suffix)
+
+    def lookup(self, url: str) -> Optional[Dict]:
+        """The record of the URL's last download, if its content is still cached."""
+        try:
+            with open(self._url_record_path(url)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(record.get("path", "")):
+            return None
+        return record
+
+    def new_temp_file(self):
+        os.makedirs(self.root, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=self.root, prefix=".partial-", delete=False)
+
+    def store(self, url: str, temp_path: str, checksum: str, suffix: str, etag: Optional[str], last_modified: Optional[str]) -> str:
+        """Moves a finished download into place and records the URL's validators. Returns the file path."""
+        path = self.content_path(checksum, suffix)
+        os.replace(temp_path, path)
+        self.record(url, path, checksum, etag, last_modified)
+        return path
+
+    def record(self, url: str, path: str, checksum: str, etag: Optional[str], last_modified: Optional[str]):
+        record_path = self._url_record_path(url)
+        os.makedirs(os.path.dirname(record_path), exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(record_path), suffix=".tmp", delete=False) as f:
+            json.dump({"path": path, "checksum": checksum, "etag": etag, "last_modified": last_modified}, f)
+        os.replace(f.name, record_path)
+
+    def touch(self, path: str):
+        """Marks a cached file as recently used."""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Removes the least recently used files until the cache fits within max_bytes."""
+        entries, total = [], 0
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        cutoff = time.time() - _EVICTION_GRACE_SECONDS
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes or mtime > cutoff:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+download_cache = DownloadCache(config.DOWNLOAD_CACHE_DIR, config.DOWNLOAD_CACHE_MAX_BYTES)
+
+# Created lazily, so that each gunicorn worker opens its own connection pool after forking
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config.DOWNLOAD_TIMEOUT),
+            limits=httpx.Limits(max_connections=config.DOWNLOAD_MAX_CONNECTIONS, max_keepalive_connections=config.DOWNLOAD_MAX_CONNECTIONS),
+            follow_redirects=True,
+        )
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _url_suffix(url: str) -> str:
+    suffix = os.path.splitext(urlparse(url).path)[1]
+    return suffix.lower() if _SUFFIX_PATTERN.match(suffix) else ""
+
+
+# Downloads running in this process, keyed by URL
+_downloads_in_flight: Dict[str, asyncio.Task] = {}
+
+
+async def download_document(url: str) -> Download:
+    """
+    Downloads a document into the download cache through the pooled HTTP client, hashing it
+    as it streams; bodies over config.MAX_DOWNLOAD_BYTES are aborted. When the cache holds an
+    earlier download of the URL, the request is conditional (If-None-Match / If-Modified-Since)
+    and a 304 returns the cached file without transferring it again. Concurrent calls for the
+    same URL share one download.
+    """
+    download = _downloads_in_flight.get(url)
+    if download is None:
+        download = asyncio.create_task(_download(url))
+        _downloads_in_flight[url] = download
+        download.add_done_callback(lambda _: _downloads_in_flight.pop(url, None))
+    else:
+        print(f"INFO: Document at {url[:50]} is already being downloaded. Waiting for it.")
+        metrics.DOWNLOADS.inc(result="shared")
+    # Shielded, so a caller that gives up does not cancel the download for the others
+    return await asyncio.shield(download)
+
+
+async def _download(url: str) -> Download:
+    cached = download_cache.lookup(url)
+    headers = {}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    print(f"INFO: Downloading document from web URL: {url}")
+    with metrics.stage("download"):
+        try:
+            async with get_http_client().stream("GET", url, headers=headers) as response:
+                if response.status_code == 304 and cached:
+                    download_cache.touch(cached["path"])
+                    metrics.DOWNLOADS.inc(result="not_modified")
+                    return Download(cached["path"], cached["checksum"], not_modified=True)
+                response.raise_for_status()
+                declared_size = int(response.headers.get("content-length") or 0)
+                if declared_size > config.MAX_DOWNLOAD_BYTES:
+                    raise DownloadError(f"Document exceeds the maximum download size of {config.MAX_DOWNLOAD_BYTES} bytes: {url}")
+
+                sha256, size = hashlib.sha256(), 0
+                temp_file = download_cache.new_temp_file()
+                try:
+                    with temp_file:
+                        async for data in response.aiter_bytes(64 * 1024):
+                            size += len(data)
+                            if size > config.MAX_DOWNLOAD_BYTES:
+                                raise DownloadError(f"Document exceeds the maximum download size of {config.MAX_DOWNLOAD_BYTES} bytes: {url}")
+                            sha256.update(data)
+                            temp_file.write(data)
+                    checksum = sha256.hexdigest()
+                    path = download_cache.store(
+                        url, temp_file.name, checksum, _url_suffix(url),
+                        response.headers.get("etag"), response.headers.get("last-modified")
+                    )
+                except BaseException:
+                    if os.path.exists(temp_file.name):
+                        os.remove(temp_file.name)
+                    raise
+        except httpx.HTTPError as e:
+            raise DownloadError(f"Failed to download document from URL: {url}. Error: {e}") from e
+
+    metrics.DOWNLOADS.inc(result="fetched")
+    await asyncio.to_thread(download_cache.evict)
+    return Download(path, checksum, not_modified=False)
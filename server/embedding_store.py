@@ -0,0 +1,137 @@
+# embedding_store.py
+import asyncio
+import hashlib
+from typing import AsyncIterator, Dict, List, Tuple
+
+import numpy as np
+
+import config
+import crud
+import metrics
+from database import SessionLocal
+from gemini_client import get_genai
+from context_builder import estimate_tokens
+from gemini_scheduler import Priority, embedding_scheduler
+from retry import is_payload_too_large
+
+
+class EmbeddingResponseError(RuntimeError):
+    """Raised when the embedding API does not return one embedding per text sent."""
+
+
+def chunk_hash(text: str) -> str:
+    """Content address of a chunk: the SHA-256 of its text."""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _load_embeddings(text_hashes: List[str], task_type: str) -> Dict[str, List[float]]:
+    db = SessionLocal()
+    try:
+        found = {}
+        # Keep the IN clause to a reasonable size for large documents
+        for i in range(0, len(text_hashes), 1000):
+            stored = crud.get_chunk_embeddings(db, text_hashes[i:i+1000], config.EMBEDDING_MODEL, task_type)
+            found.update({h: np.frombuffer(blob, dtype=np.float32).tolist() for h, blob in stored.items()})
+        return found
+    finally:
+        db.close()
+
+
+def _save_embeddings(embeddings: Dict[str, List[float]], task_type: str):
+    db = SessionLocal()
+    try:
+        blobs = {h: np.asarray(values, dtype=np.float32).tobytes() for h, values in embeddings.items()}
+        crud.save_chunk_embeddings(db, blobs, config.EMBEDDING_MODEL, task_type)
+    finally:
+        db.close()
+
+
+# Largest batch the embedding API has accepted; lowered when it rejects a payload as too large
+_batch_limit = config.EMBEDDING_BATCH_SIZE
+
+
+def _plan_batches(items: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+    """Packs (hash, text) items into batches bounded by count and total characters."""
+    batches, batch, batch_chars = [], [], 0
+    for item in items:
+        if batch and (len(batch) >= _batch_limit or batch_chars + len(item[1]) > config.EMBEDDING_BATCH_MAX_CHARS):
+            batches.append(batch)
+            batch, batch_chars = [], 0
+        batch.append(item)
+        batch_chars += len(item[1])
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def _embed_batch(texts: List[str], task_type: str) -> List[List[float]]:
+    """
+    Embeds one batch at ingestion priority, so it waits behind query-time Gemini calls and
+    retries rate limits and transient errors. If the API rejects the payload as too large,
+    the batch is split in half and the smaller size is used for later batches.
+    """
+    global _batch_limit
+    try:
+        with metrics.stage("embed_chunks"):
+            response = await embedding_scheduler.call(
+                lambda: get_genai().embed_content_async(model=config.EMBEDDING_MODEL, content=texts, task_type=task_type),
+                Priority.INGESTION, tokens=sum(map(estimate_tokens, texts)), description="embedding batch"
+            )
+    except Exception as e:
+        if len(texts) < 2 or not is_payload_too_large(e):
+            raise
+        middle = len(texts) // 2
+        _batch_limit = max(1, min(_batch_limit, middle))
+        print(f"WARNING: Embedding batch of {len(texts)} was too large, lowering the batch size to {_batch_limit}.")
+        return await _embed_batch(texts[:middle], task_type) + await _embed_batch(texts[middle:], task_type)
+    embeddings = response['embedding']
+    # Embeddings are matched to texts by position, so a short response must not be zipped silently
+    if len(embeddings) != len(texts):
+        raise EmbeddingResponseError(f"The embedding API returned {len(embeddings)} embeddings for a batch of {len(texts)} texts.")
+    return embeddings
+
+
+async def iter_chunk_embeddings(chunks: List[str], task_type: str = "RETRIEVAL_DOCUMENT") -> AsyncIterator[Dict[int, List[float]]]:
+    """
+    Embeds chunks through the persistent embedding store, keyed by
+    (sha256 of the chunk text, config.EMBEDDING_MODEL, task_type), yielding
+    {position: embedding} groups as soon as they are ready: stored embeddings first,
+    then each Gemini batch as it completes. Only chunks that have never been embedded
+    are sent to Gemini, with up to config.EMBEDDING_MAX_CONCURRENT_BATCHES requests in flight.
+    """
+    hashes = [chunk_hash(chunk) for chunk in chunks]
+    positions_by_hash: Dict[str, List[int]] = {}
+    for i, h in enumerate(hashes):
+        positions_by_hash.setdefault(h, []).append(i)
+
+    with metrics.stage("embedding_store_load"):
+        stored = await asyncio.to_thread(_load_embeddings, list(positions_by_hash), task_type)
+    if stored:
+        yield {i: stored[h] for i, h in enumerate(hashes) if h in stored}
+
+    # Duplicate chunks are embedded once
+    missing = [(h, chunks[positions[0]]) for h, positions in positions_by_hash.items() if h not in stored]
+    slots = asyncio.Semaphore(config.EMBEDDING_MAX_CONCURRENT_BATCHES)
+
+    async def embed(batch: List[Tuple[str, str]]) -> Dict[str, List[float]]:
+        async with slots:
+            embeddings = await _embed_batch([text for _, text in batch], task_type)
+        fresh = {h: values for (h, _), values in zip(batch, embeddings)}
+        with metrics.stage("embedding_store_save"):
+            await asyncio.to_thread(_save_embeddings, fresh, task_type)
+        return fresh
+
+    tasks = [asyncio.create_task(embed(batch)) for batch in _plan_batches(missing)]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            fresh = await completed
+            yield {i: values for h, values in fresh.items() for i in positions_by_hash[h]}
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    misses = sum(len(positions_by_hash[h]) for h, _ in missing)
+    metrics.EMBEDDING_STORE_CHUNKS.inc(len(chunks) - misses, result="hit")
+    metrics.EMBEDDING_STORE_CHUNKS.inc(misses, result="miss")
+    print(f"INFO: Embedding store hits: {len(chunks) - misses}/{len(chunks)} chunks.")
+
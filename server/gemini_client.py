@@ -0,0 +1,16 @@
+# gemini_client.py
+from functools import lru_cache
+
+import config
+
+
+@lru_cache(maxsize=None)
+def get_genai():
+    """
+    Returns the Gemini SDK module, importing and configuring it on first use.
+    The SDK is slow to import, so this happens once per worker process, after forking.
+    """
+    import google.generativeai as genai
+
+    genai.configure(api_key=config.GOOGLE_API_KEY)
+    return genai
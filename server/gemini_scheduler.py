@@ -0,0 +1,164 @@
+# gemini_scheduler.py
+import asyncio
+import heapq
+import itertools
+import time
+from enum import IntEnum
+from typing import Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+import config
+import metrics
+from retry import backoff_delay, is_rate_limited, is_transient_error, retry_after_seconds
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    """Lower values are admitted first."""
+    QUERY = 0
+    INGESTION = 1
+
+
+class GeminiUnavailableError(RuntimeError):
+    """Raised when a Gemini call still fails after its retries, e.g. because the quota is exhausted."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Holds up to `per_minute` units and refills continuously at `per_minute * scale` units per minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.scale = 1.0
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity * self.scale / 60)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (an amount above capacity waits for a full bucket)."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / (self.capacity * self.scale))
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+
+class GeminiScheduler:
+    """
+    Admits calls to one Gemini model within its requests-per-minute and tokens-per-minute
+    budgets. Waiting calls are admitted by priority, then in arrival order, and ingestion
+    calls leave `query_reserve` of each budget free for query-time calls.
+
+    A 429 pauses the model for the Retry-After the API asked for (or a backoff) and halves
+    the refill rate; each later success restores 5% of it, so the rate settles just below
+    the quota the project actually has.
+    """
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int, query_reserve: float):
+        self.name = name
+        self.query_reserve = query_reserve
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._waiters: List[Tuple[int, int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._paused_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _set_scale(self, scale: float):
+        self._requests.scale = self._tokens.scale = scale
+
+    def _wait_time(self, priority: int, tokens: int, now: float) -> float:
+        if now < self._paused_until:
+            return self._paused_until - now
+        request_cost, token_cost = 1, tokens
+        if priority > Priority.QUERY:
+            request_cost += self._requests.capacity * self.query_reserve
+            token_cost += self._tokens.capacity * self.query_reserve
+        return max(self._requests.wait_time(request_cost, now), self._tokens.wait_time(token_cost, now))
+
+    def _dispatch(self):
+        self._timer = None
+        while self._waiters:
+            priority, _, tokens, future = self._waiters[0]
+            if future.done():  # the caller was cancelled
+                heapq.heappop(self._waiters)
+                continue
+            wait = self._wait_time(priority, tokens, time.monotonic())
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            future.set_result(None)
+
+    async def acquire(self, priority: Priority, tokens: int):
+        """Waits until a call of `tokens` estimated tokens fits within the budgets."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._order), tokens, future))
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+        start = time.perf_counter()
+        await future
+        metrics.record_stage(f"{self.name}_queue_wait", time.perf_counter() - start)
+
+    def _on_rate_limited(self, retry_after: Optional[float], attempt: int):
+        pause = retry_after if retry_after is not None else backoff_delay(attempt) + config.RETRY_BASE_DELAY
+        self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        self._set_scale(max(0.05, self._requests.scale / 2))
+        metrics.GEMINI_RATE_LIMITED.inc(model=self.name)
+        print(f"WARNING: Gemini {self.name} rate limited; pausing {pause:.1f}s at {self._requests.scale:.0%} of the configured rate.")
+
+    def _on_success(self):
+        if self._requests.scale < 1.0:
+            self._set_scale(min(1.0, self._requests.scale + 0.05))
+
+    async def call(self, operation: Callable[[], Awaitable[T]], priority: Priority, tokens: int, description: str) -> T:
+        """
+        Awaits `operation()` once admitted, retrying rate limits and transient errors up to
+        config.RETRY_MAX_ATTEMPTS times. Raises GeminiUnavailableError when those retries
+        run out; other errors are raised immediately.
+        """
+        for attempt in range(config.RETRY_MAX_ATTEMPTS):
+            await self.acquire(priority, tokens)
+            try:
+                result = await operation()
+            except Exception as e:
+                retry_after = None
+                if is_rate_limited(e):
+                    retry_after = retry_after_seconds(e)
+                    self._on_rate_limited(retry_after, attempt)
+                elif not is_transient_error(e):
+                    raise
+                if attempt == config.RETRY_MAX_ATTEMPTS - 1:
+                    raise GeminiUnavailableError(f"Gemini {description} failed after {attempt + 1} attempts: {e}", retry_after) from e
+                if not is_rate_limited(e):
+                    delay = backoff_delay(attempt)
+                    print(f"WARNING: Transient error on {description} (attempt {attempt + 1}), retrying in {delay:.2f}s. Error: {e}")
+                    await asyncio.sleep(delay)
+                # Rate-limited calls wait for the pause in acquire(), along with everyone else
+                continue
+            self._on_success()
+            return result
+
+
+embedding_scheduler = GeminiScheduler(
+    "embedding",
+    requests_per_minute=config.EMBEDDING_REQUESTS_PER_MINUTE,
+    tokens_per_minute=config.EMBEDDING_TOKENS_PER_MINUTE,
+    query_reserve=config.GEMINI_QUERY_RESERVE,
+)
+generation_scheduler = GeminiScheduler(
+    "generation",
+    requests_per_minute=config.GENERATION_REQUESTS_PER_MINUTE,
+    tokens_per_minute=config.GENERATION_TOKENS_PER_MINUTE,
+    query_reserve=config.GEMINI_QUERY_RESERVE,
+)
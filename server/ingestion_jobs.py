@@ -0,0 +1,75 @@
+# ingestion_jobs.py
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable, List, Set
+
+import config
+import metrics
+
+
+class IngestionQueueFullError(RuntimeError):
+    """Raised when too many background ingestion jobs are already waiting."""
+
+
+class IngestionWorkerPool:
+    """
+    Runs background ingestion jobs in this process: up to `workers` jobs at once,
+    with at most `max_pending` more waiting for a slot. Workers start on first use.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._tasks: List[asyncio.Task] = []
+        self._running: Set[str] = set()
+
+    def submit(self, job_id: str, run: Callable[[], Awaitable[None]]):
+        """Queues a job; never blocks. Raises IngestionQueueFullError when the queue is full."""
+        try:
+            self._queue.put_nowait((job_id, run))
+        except asyncio.QueueFull:
+            raise IngestionQueueFullError("Too many documents are waiting to be ingested. Please retry shortly.")
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def _work(self):
+        while True:
+            job_id, run = await self._queue.get()
+            self._running.add(job_id)
+            start = time.perf_counter()
+            # Each job is traced on its own, under its job id, like a request
+            with metrics.detached_trace(job_id):
+                try:
+                    await run()
+                except Exception as e:
+                    # Jobs record their own failures; this only keeps the worker alive
+                    print(f"ERROR: Ingestion job {job_id} failed. Error: {e}")
+                finally:
+                    self._running.discard(job_id)
+                    self._queue.task_done()
+                    print(json.dumps({
+                        "event": "ingestion_job",
+                        "request_id": job_id,
+                        "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                        "stages": metrics.current_trace_summary(),
+                    }))
+
+    async def stop(self) -> List[str]:
+        """Stops the workers and returns the ids of the jobs that were queued or running."""
+        unfinished = list(self._running)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._running.clear()
+        while not self._queue.empty():
+            job_id, _ = self._queue.get_nowait()
+            unfinished.append(job_id)
+        return unfinished
+
+
+ingestion_workers = IngestionWorkerPool(
+    workers=config.INGESTION_JOB_WORKERS,
+    max_pending=config.INGESTION_JOB_MAX_PENDING,
+)
@@ -0,0 +1,132 @@
+# lexical_index.py
+import math
+import os
+import re
+import shutil
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config
+from lru import LRUCache
+
+# Keeps clause numbers such as "4.2" or "2.1-a" together with their separators
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[./\-][a-z0-9]+)*")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over one document's chunks, with array-backed postings:
+    the postings of term t are `doc_ids[offsets[t]:offsets[t+1]]` (chunk positions)
+    and the matching `term_freqs`. Chunk texts are not kept; hits are resolved through
+    the chunk store like vector matches.
+    """
+
+    def __init__(self, terms: Dict[str, int], offsets: np.ndarray, doc_ids: np.ndarray,
+                 term_freqs: np.ndarray, doc_lengths: np.ndarray):
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+
+    @classmethod
+    def build(cls, chunks: List[Dict]) -> "LexicalIndex":
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = np.zeros(len(chunks), dtype=np.float32)
+        for position, chunk in enumerate(chunks):
+            tokens = tokenize(chunk["text"])
+            doc_lengths[position] = len(tokens)
+            for term, count in Counter(tokens).items():
+                postings.setdefault(term, []).append((position, count))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        term_freqs = np.empty(offsets[-1], dtype=np.float32)
+        for t, term in enumerate(terms):
+            entries = np.asarray(postings[term])
+            doc_ids[offsets[t]:offsets[t + 1]] = entries[:, 0]
+            term_freqs[offsets[t]:offsets[t + 1]] = entries[:, 1]
+        return cls({term: t for t, term in enumerate(terms)}, offsets, doc_ids, term_freqs, doc_lengths)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """Returns up to top_k (chunk position, BM25 score) pairs, best first."""
+        n_docs = len(self.doc_lengths)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / max(self.avg_length, 1.0))
+        for term in set(tokenize(query)):
+            t = self.terms.get(term)
+            if t is None:
+                continue
+            docs = self.doc_ids[self.offsets[t]:self.offsets[t + 1]]
+            tf = self.term_freqs[self.offsets[t]:self.offsets[t + 1]]
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            # Each chunk appears once per term's postings, so fancy-index addition is safe
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + length_norm[docs])
+
+        hits = np.flatnonzero(scores)
+        if not len(hits):
+            return []
+        k = min(top_k, len(hits))
+        best = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        best = best[np.argsort(-scores[best])]
+        return [(int(p), float(scores[p])) for p in best]
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        terms = sorted(self.terms, key=self.terms.get)
+        np.savez(
+            os.path.join(path, "bm25.npz"),
+            terms=np.array(terms, dtype=str), offsets=self.offsets, doc_ids=self.doc_ids,
+            term_freqs=self.term_freqs, doc_lengths=self.doc_lengths
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with np.load(os.path.join(path, "bm25.npz")) as data:
+            terms = {str(term): t for t, term in enumerate(data["terms"])}
+            arrays = data["offsets"], data["doc_ids"], data["term_freqs"], data["doc_lengths"]
+        return cls(terms, *arrays)
+
+
+_loaded: LRUCache[LexicalIndex] = LRUCache(config.MAX_OPEN_NAMESPACES)
+
+
+def _path(namespace: str) -> str:
+    return os.path.join(config.LEXICAL_INDEX_DIR, namespace)
+
+
+def build_lexical_index(namespace: str, chunks: List[Dict]):
+    """Builds and stores the BM25 index of a namespace, replacing any previous one."""
+    index = LexicalIndex.build(chunks)
+    index.save(_path(namespace))
+    _loaded.put(namespace, index)
+
+
+def delete_lexical_index(namespace: str):
+    """Removes the BM25 index of a namespace, if there is one on this host."""
+    _loaded.pop(namespace)
+    shutil.rmtree(_path(namespace), ignore_errors=True)
+
+
+def get_lexical_index(namespace: str) -> Optional[LexicalIndex]:
+    """
+    Returns the namespace's BM25 index, or None if it was not built on this host
+    (e.g. the document was ingested by another host or before hybrid retrieval existed).
+    """
+    index = _loaded.get(namespace)
+    if index is None and os.path.exists(os.path.join(_path(namespace), "bm25.npz")):
+        index = LexicalIndex.load(_path(namespace))
+        _loaded.put(namespace, index)
+    return index
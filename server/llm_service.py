@@ -1,39 +1,154 @@
 # llm_service.py
-from typing import List
-import google.generativeai as genai
+import hashlib
+import json
+from typing import Callable, List, Optional
 import config
+import metrics
+from context_builder import estimate_tokens
+from gemini_client import get_genai
+from gemini_scheduler import Priority, generation_scheduler
 
-# Configure the Gemini client
-genai.configure(api_key=config.GOOGLE_API_KEY)
+GENERATION_ERROR_ANSWER = "There was an error while generating the answer. Please try again."
 
-async def get_answer_from_llm(question: str, context_clauses: List[str]) -> str:
+# Gemini models work well with a single, detailed prompt.
+PROMPT_TEMPLATE = (
+    "You are an intelligent assistant specializing in document analysis for insurance, legal, and HR domains. "
+    "Your task is to answer the user's question based *only* on the provided context clauses from the document. "
+    "Provide a clear, direct, and concise answer. If the context does not contain the information needed to "
+    "answer the question, explicitly state that the information is not available in the provided context.\n\n"
+    "--- CONTEXT CLAUSES ---\n{context}\n\n"
+    "--- USER QUESTION ---\n{question}\n\n"
+    "--- ANSWER ---\n"
+)
+# Several questions sharing one context, answered as JSON so the answers can be split apart again
+BATCH_PROMPT_TEMPLATE = (
+    "You are an intelligent assistant specializing in document analysis for insurance, legal, and HR domains. "
+    "Your task is to answer each of the user's numbered questions based *only* on the provided context clauses "
+    "from the document. Answer every question independently with a clear, direct, and concise answer. If the "
+    "context does not contain the information needed to answer a question, explicitly state that the information "
+    "is not available in the provided context.\n\n"
+    "Respond with JSON only, in the form "
+    '{{"answers": [{{"id": <question number>, "answer": "<answer>"}}]}}, with one entry per question.\n\n'
+    "--- CONTEXT CLAUSES ---\n{context}\n\n"
+    "--- USER QUESTIONS ---\n{questions}\n\n"
+    "--- ANSWERS (JSON) ---\n"
+)
+# One question over clauses from several documents, each labelled with the document it comes from
+CORPUS_PROMPT_TEMPLATE = (
+    "You are an intelligent assistant specializing in document analysis for insurance, legal, and HR domains. "
+    "Your task is to answer the user's question based *only* on the provided context clauses, which come from "
+    "several documents. Each clause starts with a label such as [Document 12, Page 3] naming its source. "
+    "Provide a clear, direct, and concise answer, and cite the label of every clause you rely on in square "
+    "brackets after the statement it supports. Where documents differ, say which document states what. If the "
+    "context does not contain the information needed to answer the question, explicitly state that the "
+    "information is not available in the provided documents.\n\n"
+    "--- CONTEXT CLAUSES ---\n{context}\n\n"
+    "--- USER QUESTION ---\n{question}\n\n"
+    "--- ANSWER ---\n"
+)
+# Changes whenever a prompt template does, so answers cached for an older prompt are not reused
+PROMPT_VERSION = hashlib.sha256((PROMPT_TEMPLATE + BATCH_PROMPT_TEMPLATE).encode()).hexdigest()[:12]
+
+NO_CONTEXT_ANSWER = "I could not find relevant information in the document to answer this question."
+CORPUS_NO_CONTEXT_ANSWER = "I could not find relevant information in the documents to answer this question."
+
+
+class BatchAnswerError(ValueError):
+    """Raised when a batched response cannot be split into one answer per question."""
+
+def _count_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        metrics.LLM_TOKENS.inc(getattr(usage, "prompt_token_count", 0) or 0, kind="prompt")
+        metrics.LLM_TOKENS.inc(getattr(usage, "candidates_token_count", 0) or 0, kind="completion")
+
+async def get_answer_from_llm(question: str, context_clauses: List[str],
+                              on_delta: Optional[Callable[[str], None]] = None, prompt_template: str = PROMPT_TEMPLATE) -> str:
     """
     Generates an answer to a question using the Gemini model, based on provided context.
+    When `on_delta` is given, the answer is generated with Gemini's streaming API and
+    `on_delta` is called with each text fragment as it arrives.
+    The call goes through the generation scheduler at query priority; errors are raised,
+    as GeminiUnavailableError once rate-limit and transient-error retries run out.
     """
     if not context_clauses:
-        return "I could not find relevant information in the document to answer this question."
+        return NO_CONTEXT_ANSWER
 
     context = "\n\n".join(context_clauses)
-    
-    # Gemini models work well with a single, detailed prompt.
-    prompt = (
-        "You are an intelligent assistant specializing in document analysis for insurance, legal, and HR domains. "
-        "Your task is to answer the user's question based *only* on the provided context clauses from the document. "
-        "Provide a clear, direct, and concise answer. If the context does not contain the information needed to "
-        "answer the question, explicitly state that the information is not available in the provided context.\n\n"
-        f"--- CONTEXT CLAUSES ---\n{context}\n\n"
-        f"--- USER QUESTION ---\n{question}\n\n"
-        "--- ANSWER ---\n"
-    )
+    prompt = prompt_template.format(context=context, question=question)
 
+    genai = get_genai()
+    model = genai.GenerativeModel(config.GENERATION_MODEL)
+    generation_config = genai.types.GenerationConfig(temperature=0.0)
+    tokens = estimate_tokens(prompt) + config.GENERATION_OUTPUT_TOKENS_ESTIMATE
+    with metrics.stage("generate"):
+        # Only the request itself is retried: once fragments have been streamed, a retry would repeat them
+        response = await generation_scheduler.call(
+            lambda: model.generate_content_async(prompt, generation_config=generation_config, stream=on_delta is not None),
+            Priority.QUERY, tokens=tokens, description="answer generation"
+        )
+        if on_delta is None:
+            _count_tokens(response)
+            return response.text.strip()
+
+        fragments, chunk = [], None
+        async for chunk in response:
+            fragments.append(chunk.text)
+            on_delta(chunk.text)
+        # A streamed response reports its token usage on the last chunk
+        _count_tokens(chunk)
+        return "".join(fragments).strip()
+
+async def get_corpus_answer_from_llm(question: str, context_clauses: List[str]) -> str:
+    """
+    Answers one question from clauses of several documents (labelled by context_builder
+    with their document), citing the document of each clause it relies on.
+    """
+    if not context_clauses:
+        return CORPUS_NO_CONTEXT_ANSWER
+    return await get_answer_from_llm(question, context_clauses, prompt_template=CORPUS_PROMPT_TEMPLATE)
+
+def parse_batch_answers(text: str, count: int) -> List[str]:
+    """
+    Splits a batched JSON response into the answers to questions 1..count, in order.
+    Raises BatchAnswerError when it is not valid JSON or any answer is missing or empty.
+    """
+    text = text.strip()
+    # Tolerate a Markdown code fence around the JSON
+    if text.startswith("```"):
+        text = text.split("\n", 1)[-1].rsplit("```", 1)[0]
     try:
-        model = genai.GenerativeModel(config.GENERATION_MODEL)
-        response = await model.generate_content_async(
-            prompt,
-            generation_config=genai.types.GenerationConfig(temperature=0.0)
+        entries = json.loads(text)["answers"]
+        answers = {int(entry["id"]): str(entry["answer"]).strip() for entry in entries}
+    except (ValueError, TypeError, KeyError) as e:
+        raise BatchAnswerError(f"Unparseable batched response: {e}") from e
+    missing = [number for number in range(1, count + 1) if not answers.get(number)]
+    if missing:
+        raise BatchAnswerError(f"Batched response has no answer for questions {missing}")
+    return [answers[number] for number in range(1, count + 1)]
+
+async def get_answers_from_llm(questions: List[str], context_clauses: List[str]) -> List[str]:
+    """
+    Answers several questions against one shared context in a single generation call,
+    returning the answers in question order. Raises BatchAnswerError when the response
+    cannot be parsed, so the caller can fall back to get_answer_from_llm per question;
+    other errors are raised as in get_answer_from_llm.
+    """
+    if not context_clauses:
+        return [NO_CONTEXT_ANSWER] * len(questions)
+
+    context = "\n\n".join(context_clauses)
+    numbered = "\n".join(f"{number}. {question}" for number, question in enumerate(questions, 1))
+    prompt = BATCH_PROMPT_TEMPLATE.format(context=context, questions=numbered)
+
+    genai = get_genai()
+    model = genai.GenerativeModel(config.GENERATION_MODEL)
+    generation_config = genai.types.GenerationConfig(temperature=0.0, response_mime_type="application/json")
+    tokens = estimate_tokens(prompt) + config.GENERATION_OUTPUT_TOKENS_ESTIMATE * len(questions)
+    with metrics.stage("generate_batch"):
+        response = await generation_scheduler.call(
+            lambda: model.generate_content_async(prompt, generation_config=generation_config),
+            Priority.QUERY, tokens=tokens, description="batched answer generation"
         )
-        return response.text.strip()
-    
-    except Exception as e:
-        print(f"Error calling Gemini API: {e}")
-        return "There was an error while generating the answer. Please try again."
\ No newline at end of file
+    _count_tokens(response)
+    return parse_batch_answers(response.text, len(questions))
@@ -0,0 +1,58 @@
+# lru.py
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, List, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """
+    Thread-safe mapping holding at most `max_entries` values, evicting the least recently
+    used. Values that are evicted, replaced or popped are passed to `on_close`, so that
+    caches of open files release their descriptors instead of holding them until exit.
+    """
+
+    def __init__(self, max_entries: int, on_close: Optional[Callable[[V], None]] = None):
+        self.max_entries = max_entries
+        self.on_close = on_close
+        self._entries: "OrderedDict[Hashable, V]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: V):
+        closed: List[V] = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None and previous is not value:
+                closed.append(previous)
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                closed.append(self._entries.popitem(last=False)[1])
+        self._close(closed)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            value = self._entries.pop(key, None)
+        self._close([value] if value is not None else [])
+
+    def clear(self):
+        with self._lock:
+            closed = list(self._entries.values())
+            self._entries.clear()
+        self._close(closed)
+
+    def _close(self, values: List[V]):
+        if self.on_close is None:
+            return
+        for value in values:
+            self.on_close(value)
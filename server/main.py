@@ -1,49 +1,95 @@
 # main.py
+import asyncio
 import base64
 import hashlib
+import json
+import math
 import os
-from fastapi import FastAPI, HTTPException, Security, Depends
+import time
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, HTTPException, Request, Security, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi.security import APIKeyHeader
 
 import config
 import crud
+import metrics
 import models
-from database import SessionLocal, engine
-from document_processor import process_document_content, process_document_from_url
-from vector_service import upsert_document_chunks, get_relevant_clauses
-from llm_service import get_answer_from_llm
+from database import AsyncSessionLocal, SessionLocal, dispose_db, init_db, warm_up_db
+from document_processor import ExtractionQueueFullError, process_document_content, process_document_file, warm_up_extraction_pool
+from downloader import DownloadError, close_http_client, download_document
+from gemini_client import get_genai
+from vector_store import get_vector_store
+from vector_service import ProgressCallback, delete_document_index, get_corpus_matches, get_document_namespace, upsert_document_chunks, get_embedding, get_embeddings, get_relevant_matches
+from context_builder import assemble_context, estimate_tokens, group_by_overlap, merge_matches
+from llm_service import GENERATION_ERROR_ANSWER, PROMPT_VERSION, get_answer_from_llm, get_answers_from_llm, get_corpus_answer_from_llm
+from gemini_scheduler import GeminiUnavailableError
+from chunk_store import ChunkStoreMissingError
+from answer_cache import answer_cache, question_hash
+from uploads import SpooledUpload, UploadError, parse_upload
+from query_log import query_log_writer
+from ingestion_jobs import IngestionQueueFullError, ingestion_workers
 
 #models.Base.metadata.create_all(bind=engine)
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-app = FastAPI(
-    title="Intelligent Query–Retrieval System",
-    description="An LLM-powered system with efficient file uploads.",
-    version="2.0.0"
-)
+async def _warm_up():
+    """Opens database connections, the vector index and the extraction workers before the first request."""
+    start = time.perf_counter()
+    await asyncio.gather(warm_up_db(), get_vector_store().warm_up(), warm_up_extraction_pool())
+    print(f"INFO: Warmed up in {time.perf_counter() - start:.2f}s.")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients are created here rather than at import, so that each gunicorn worker builds
+    # its own after forking and importing this module stays cheap
+    init_db()
+    get_genai()
+    get_vector_store()
+    if config.WARMUP_ON_STARTUP:
+        await _warm_up()
+    yield
+    unfinished_jobs = await ingestion_workers.stop()
+    if unfinished_jobs:
+        async with AsyncSessionLocal() as db:
+            await crud.fail_ingestion_jobs(db, unfinished_jobs, "The server shut down before the job finished. Please resubmit the document.")
+    # Superseded documents still in their grace period are left in place, no longer served by their URL
+    for task in list(_retirements):
+        task.cancel()
+    # Write any buffered query logs before the worker exits
+    await query_log_writer.stop()
+    await close_http_client()
+    await dispose_db()
+
+router = APIRouter()
 
 # --- Middleware and Security (remains the same) ---
 origins = ["http://localhost:3000", "http://localhost:5173", "http://localhost:8080" , "https://docuquery-client.onrender.com"]
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 api_key_header = APIKeyHeader(name="Authorization", auto_error=False)
 
-@app.get("/debug-config")
+async def queue_full_handler(request, exc: Exception):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "10"})
+
+async def gemini_unavailable_handler(request, exc: GeminiUnavailableError):
+    retry_after = math.ceil(exc.retry_after) if exc.retry_after else 10
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(retry_after)})
+
+async def download_error_handler(request, exc: DownloadError):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+async def chunk_store_missing_handler(request, exc: ChunkStoreMissingError):
+    return JSONResponse(status_code=500, content={"detail": str(exc)})
+
+@router.get("/debug-config")
 def debug_config():
     """
     A temporary endpoint to check the live server's configuration.
@@ -56,6 +102,11 @@ def debug_config():
         "bearer_token_is_set": os.getenv("BEARER_TOKEN") is not None
     }
 
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Latency histograms and counters of this worker process, in the Prometheus text format."""
+    return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
+
 async def verify_token(token: str = Security(api_key_header)):
     if not token or token.replace("Bearer ", "") != config.BEARER_TOKEN:
         raise HTTPException(status_code=403, detail="Invalid or missing Authorization token")
@@ -66,17 +117,469 @@ class HackRxRequest(BaseModel):
     document_url: Optional[str] = None
     filename: Optional[str] = None
     file_content_base64: Optional[str] = None
+    # Re-download a known document_url; changed content replaces the indexed version
+    refresh: bool = False
+
+class HackRxStreamRequest(HackRxRequest):
+    # Also stream answer text fragments from Gemini as they are generated
+    stream_tokens: bool = False
 
 class HackRxResponse(BaseModel):
     answers: List[str]
 
-# --- Single Unified Endpoint ---
-@app.post("/hackrx/run", response_model=HackRxResponse, summary="Process Document via JSON (URL or Base64 File)")
-async def run_submission_json(
-    request: HackRxRequest,
-    _=Security(verify_token),
-    db: Session = Depends(get_db)
-):
+class DocumentJobRequest(BaseModel):
+    document_url: Optional[str] = None
+    filename: Optional[str] = None
+    file_content_base64: Optional[str] = None
+
+class DocumentJobResponse(BaseModel):
+    job_id: str
+    status: str
+    stage: Optional[str] = None
+    chunks_total: Optional[int] = None
+    chunks_indexed: int = 0
+    # Fraction of the document's chunks indexed so far
+    progress: float = 0.0
+    document_id: Optional[int] = None
+    error: Optional[str] = None
+
+class CollectionRequest(BaseModel):
+    document_ids: List[int]
+
+class CollectionResponse(BaseModel):
+    name: str
+    document_ids: List[int]
+
+class CorpusQueryRequest(BaseModel):
+    question: str
+    # The documents to search: either their ids or the name of a collection
+    document_ids: Optional[List[int]] = None
+    collection: Optional[str] = None
+
+class CorpusSource(BaseModel):
+    # Label the answer cites the clause by, e.g. "Document 12"
+    label: str
+    document_id: int
+    # URL or filename of the document
+    document: Optional[str] = None
+    page: Optional[int] = None
+    # Cosine similarity of the clause to the question
+    score: float
+
+class CorpusQueryResponse(BaseModel):
+    answer: str
+    # The clauses retrieved across the documents, best first
+    sources: List[CorpusSource]
+
+# --- Question Pipeline ---
+# Called with (question index, text fragment) as answer tokens are generated
+DeltaCallback = Callable[[int, str], None]
+# Errors that fail the whole request instead of one question's answer, since every question would hit them
+_REQUEST_ERRORS = (GeminiUnavailableError, ChunkStoreMissingError)
+
+async def _embed_questions(questions: List[str]) -> List[Optional[List[float]]]:
+    """
+    Embeds all questions in one batched call. If that fails for a reason other than
+    Gemini being unavailable, returns None for each question so they are embedded one by one.
+    """
+    try:
+        return await get_embeddings(questions, task_type="RETRIEVAL_QUERY")
+    except GeminiUnavailableError:
+        raise
+    except Exception as e:
+        print(f"WARNING: Batched question embedding failed, embedding individually. Error: {e}")
+        return [None] * len(questions)
+
+async def _iter_answers(doc_identifier: str, questions: List[str], checksum: Optional[str] = None,
+                        on_delta: Optional[DeltaCallback] = None) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Answers all questions against an already-indexed document, yielding
+    (question index, answer) pairs as each answer completes.
+    The questions are embedded in one batched call, then retrieval and generation
+    run concurrently (bounded by config.MAX_CONCURRENT_QUESTIONS). A failure on one
+    question only affects that question's answer, except _REQUEST_ERRORS: when Gemini is
+    out of quota or the document's chunk texts are missing, the whole request fails,
+    rather than answering with errors.
+    With config.BATCHED_GENERATION, unstreamed questions are answered in batches instead.
+    """
+    question_embeddings = await _embed_questions(questions)
+    if config.BATCHED_GENERATION and on_delta is None and len(questions) > 1:
+        async for item in _iter_answers_batched(doc_identifier, questions, question_embeddings, checksum):
+            yield item
+        return
+
+    semaphore = asyncio.Semaphore(config.MAX_CONCURRENT_QUESTIONS)
+    tokens_saved = 0
+
+    async def answer_question(index: int, question: str, embedding: Optional[List[float]]) -> Tuple[int, str]:
+        nonlocal tokens_saved
+        async with semaphore:
+            try:
+                if embedding is None:
+                    embedding = await get_embedding(question, task_type="RETRIEVAL_QUERY")
+                matches = await get_relevant_matches(doc_identifier, embedding, checksum=checksum, question=question)
+                relevant_clauses, saved = assemble_context(matches)
+                tokens_saved += saved
+                on_question_delta = (lambda text: on_delta(index, text)) if on_delta else None
+                return index, await get_answer_from_llm(question, relevant_clauses, on_delta=on_question_delta)
+            except _REQUEST_ERRORS:
+                raise
+            except Exception as e:
+                print(f"ERROR: Failed to answer question '{question[:50]}'. Error: {e}")
+                return index, GENERATION_ERROR_ANSWER
+
+    tasks = [
+        asyncio.create_task(answer_question(i, question, embedding))
+        for i, (question, embedding) in enumerate(zip(questions, question_embeddings))
+    ]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            yield await completed
+    finally:
+        for task in tasks:
+            task.cancel()
+    metrics.CONTEXT_TOKENS_SAVED.inc(tokens_saved)
+    print(f"INFO: Context assembly saved ~{tokens_saved} prompt tokens across {len(questions)} questions.")
+
+async def _iter_answers_batched(doc_identifier: str, questions: List[str], question_embeddings: List[Optional[List[float]]],
+                                checksum: Optional[str] = None) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Batched variant of _iter_answers: retrieves the clauses of every question first, groups
+    questions whose clauses overlap (see context_builder.group_by_overlap) and answers each
+    group of several questions with one generation call that sends the shared context once.
+    A group whose JSON response cannot be parsed is answered one question at a time.
+    """
+    semaphore = asyncio.Semaphore(config.MAX_CONCURRENT_QUESTIONS)
+    tokens_saved = 0
+
+    async def retrieve(question: str, embedding: Optional[List[float]]) -> List[Dict]:
+        async with semaphore:
+            if embedding is None:
+                embedding = await get_embedding(question, task_type="RETRIEVAL_QUERY")
+            return await get_relevant_matches(doc_identifier, embedding, checksum=checksum, question=question)
+
+    retrieved = await asyncio.gather(
+        *(retrieve(question, embedding) for question, embedding in zip(questions, question_embeddings)),
+        return_exceptions=True
+    )
+    matches_by_question: Dict[int, List[Dict]] = {}
+    for i, result in enumerate(retrieved):
+        if isinstance(result, _REQUEST_ERRORS):
+            raise result
+        if isinstance(result, Exception):
+            print(f"ERROR: Failed to answer question '{questions[i][:50]}'. Error: {result}")
+            yield i, GENERATION_ERROR_ANSWER
+        else:
+            matches_by_question[i] = result
+
+    indexes = list(matches_by_question)
+    groups = [
+        [indexes[j] for j in group]
+        for group in group_by_overlap(
+            [[match['id'] for match in matches_by_question[i]] for i in indexes],
+            config.BATCH_MIN_CLAUSE_OVERLAP, config.BATCH_MAX_QUESTIONS, config.BATCH_MAX_CLAUSES
+        )
+    ]
+
+    async def answer_single(index: int) -> Tuple[int, str]:
+        nonlocal tokens_saved
+        try:
+            relevant_clauses, saved = assemble_context(matches_by_question[index])
+            tokens_saved += saved
+            return index, await get_answer_from_llm(questions[index], relevant_clauses)
+        except _REQUEST_ERRORS:
+            raise
+        except Exception as e:
+            print(f"ERROR: Failed to answer question '{questions[index][:50]}'. Error: {e}")
+            return index, GENERATION_ERROR_ANSWER
+
+    async def answer_group(group: List[int]) -> List[Tuple[int, str]]:
+        nonlocal tokens_saved
+        async with semaphore:
+            if len(group) > 1:
+                clauses, _ = assemble_context(merge_matches([matches_by_question[i] for i in group]), config.BATCH_CONTEXT_TOKEN_BUDGET)
+                try:
+                    answers = await get_answers_from_llm([questions[i] for i in group], clauses)
+                except GeminiUnavailableError:
+                    raise
+                except Exception as e:
+                    print(f"WARNING: Batched answering of {len(group)} questions failed, answering individually. Error: {e}")
+                else:
+                    # Compared to sending each question its own context
+                    single_tokens = sum(
+                        estimate_tokens("\n\n".join(assemble_context(matches_by_question[i])[0])) for i in group
+                    )
+                    tokens_saved += max(0, single_tokens - estimate_tokens("\n\n".join(clauses)))
+                    return list(zip(group, answers))
+            return list(await asyncio.gather(*(answer_single(i) for i in group)))
+
+    tasks = [asyncio.create_task(answer_group(group)) for group in groups]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            for item in await completed:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+    metrics.CONTEXT_TOKENS_SAVED.inc(tokens_saved)
+    print(f"INFO: Answered {len(indexes)} questions with {len(groups)} generation groups; "
+          f"context assembly saved ~{tokens_saved} prompt tokens.")
+
+async def _iter_answers_cached(db: AsyncSession, db_document: models.Document, doc_identifier: str, questions: List[str],
+                               checksum: Optional[str] = None, on_delta: Optional[DeltaCallback] = None) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Same as _iter_answers, but serves repeated questions from the answer cache first:
+    the in-memory LRU, then answers already logged in the queries table for the same
+    document content, model and prompt version. Cached answers are yielded immediately;
+    only misses reach Gemini.
+    """
+    cache_keys = [
+        (question_hash(q), db_document.id, db_document.indexed_at, config.GENERATION_MODEL, PROMPT_VERSION)
+        for q in questions
+    ]
+    answers = [answer_cache.get(key) for key in cache_keys]
+    memory_hits = sum(answer is not None for answer in answers)
+
+    missing_hashes = list({key[0] for key, answer in zip(cache_keys, answers) if answer is None})
+    if missing_hashes:
+        with metrics.stage("answer_cache_lookup"):
+            logged = await crud.get_logged_answers(db, db_document, missing_hashes, config.GENERATION_MODEL, PROMPT_VERSION)
+        for i, key in enumerate(cache_keys):
+            if answers[i] is None and key[0] in logged:
+                answers[i] = logged[key[0]]
+                answer_cache.put(key, answers[i])
+
+    # Questions that normalize to the same text are only answered once
+    misses: Dict[str, List[int]] = {}
+    for i, key in enumerate(cache_keys):
+        if answers[i] is None:
+            misses.setdefault(key[0], []).append(i)
+    miss_count = sum(map(len, misses.values()))
+    metrics.ANSWER_CACHE_LOOKUPS.inc(memory_hits, result="memory")
+    metrics.ANSWER_CACHE_LOOKUPS.inc(len(questions) - memory_hits - miss_count, result="database")
+    metrics.ANSWER_CACHE_LOOKUPS.inc(miss_count, result="miss")
+    print(f"INFO: Answer cache hits: {len(questions) - miss_count}/{len(questions)}.")
+
+    for i, answer in enumerate(answers):
+        if answer is not None:
+            yield i, answer
+
+    if misses:
+        positions = list(misses.values())
+        # Token deltas are reported against the first position asking each question
+        miss_delta = (lambda j, text: on_delta(positions[j][0], text)) if on_delta else None
+        async for j, answer in _iter_answers(doc_identifier, [questions[p[0]] for p in positions], checksum=checksum, on_delta=miss_delta):
+            if answer != GENERATION_ERROR_ANSWER:
+                answer_cache.put(cache_keys[positions[j][0]], answer)
+            for i in positions[j]:
+                yield i, answer
+
+async def _answer_questions_cached(db: AsyncSession, db_document: models.Document, doc_identifier: str, questions: List[str], checksum: Optional[str] = None) -> List[str]:
+    """Answers questions through the answer cache and returns the answers in question order."""
+    answers = [None] * len(questions)
+    async for i, answer in _iter_answers_cached(db, db_document, doc_identifier, questions, checksum=checksum):
+        answers[i] = answer
+    return answers
+
+def _log_answers(document_id: int, questions: List[str], answers: List[str]):
+    """
+    Queues each question and answer for the background bulk writer, with the cache key
+    for answers that may be reused. Does not wait for the database.
+    """
+    rows = []
+    for question, answer in zip(questions, answers):
+        cacheable = answer != GENERATION_ERROR_ANSWER
+        rows.append({
+            "document_id": document_id,
+            "question": question,
+            "answer": answer,
+            "question_hash": question_hash(question) if cacheable else None,
+            "model": config.GENERATION_MODEL if cacheable else None,
+            "prompt_version": PROMPT_VERSION if cacheable else None,
+        })
+    query_log_writer.add(rows)
+
+# --- Ingestion ---
+# Ingestions running in this process, keyed by document namespace
+_ingestions_in_flight: Dict[str, asyncio.Task] = {}
+# Retirements of superseded documents waiting for their grace period in this process
+_retirements: Set[asyncio.Task] = set()
+
+def _find_document(db: Session, doc_identifier: str, checksum: Optional[str]) -> Optional[models.Document]:
+    if checksum:
+        return crud.get_document_by_checksum(db, checksum=checksum)
+    return crud.get_document_by_url(db, url=doc_identifier)
+
+async def _ingest_document(doc_identifier: str, checksum: Optional[str], extract: Callable[[], Awaitable[List[Dict]]],
+                           on_progress: Optional[ProgressCallback] = None) -> int:
+    """
+    Indexes a document and records it, returning its id. An ingestion claim row makes
+    sure only one worker ingests a given namespace; the others wait for its document row.
+    Uses its own synchronous session, driven from worker threads, so it can outlive the
+    request that started it without blocking the event loop.
+    """
+    namespace = get_document_namespace(doc_identifier, checksum)
+    db = SessionLocal()
+    try:
+        claim_token = await asyncio.to_thread(crud.claim_ingestion, db, namespace, config.INGESTION_CLAIM_TIMEOUT)
+        while claim_token is None:
+            await asyncio.sleep(config.INGESTION_CLAIM_POLL_INTERVAL)
+            db_document = await asyncio.to_thread(_find_document, db, doc_identifier, checksum)
+            if db_document:
+                metrics.INGESTION_DEDUPS.inc(reason="claimed")
+                return db_document.id
+            claim_token = await asyncio.to_thread(crud.claim_ingestion, db, namespace, config.INGESTION_CLAIM_TIMEOUT)
+
+        try:
+            # The previous claim holder may have finished just before we claimed
+            db_document = await asyncio.to_thread(_find_document, db, doc_identifier, checksum)
+            if not db_document:
+                with metrics.stage("ingest"):
+                    chunks = await extract()
+                    chunk_hashes = await upsert_document_chunks(doc_identifier, chunks, checksum=checksum, on_progress=on_progress)
+                    db_document = await asyncio.to_thread(
+                        crud.create_document, db, url=doc_identifier, checksum=checksum, chunk_hashes=chunk_hashes
+                    )
+                metrics.INGESTIONS.inc()
+            else:
+                metrics.INGESTION_DEDUPS.inc(reason="claimed")
+            return db_document.id
+        finally:
+            await asyncio.to_thread(crud.release_ingestion, db, claim_token)
+    finally:
+        db.close()
+
+async def _get_or_ingest_document(db: AsyncSession, doc_identifier: str, checksum: Optional[str], extract: Callable[[], Awaitable[List[Dict]]],
+                                  on_progress: Optional[ProgressCallback] = None, cleanup: Callable[[], None] = lambda: None) -> models.Document:
+    """
+    Returns the document for a URL (or file checksum, when given), indexing it first if it is new.
+    Concurrent requests for the same document share a single ingestion; `extract` is only
+    awaited by the request that performs it and returns the document's chunks, and only
+    that request's `on_progress` is told about indexing progress.
+    `cleanup` releases what `extract` reads (e.g. a spooled upload). It runs once `extract`
+    can no longer be called: when the ingestion that uses it finishes, which may be after
+    this request was cancelled, or on return when no ingestion used it.
+    """
+    namespace = get_document_namespace(doc_identifier, checksum)
+    ingesting = False
+    try:
+        while True:
+            db_document = await crud.find_document(db, url=doc_identifier, checksum=checksum)
+            if db_document:
+                print(f"INFO: Document found in cache. Skipping ingestion.")
+                metrics.INGESTION_DEDUPS.inc(reason="indexed")
+                return db_document
+
+            ingestion = _ingestions_in_flight.get(namespace)
+            if ingestion is None:
+                print(f"INFO: New document. Processing and indexing (Namespace: {namespace[:10]}...).")
+                ingestion = asyncio.create_task(_ingest_document(doc_identifier, checksum, extract, on_progress=on_progress))
+                _ingestions_in_flight[namespace] = ingestion
+                ingestion.add_done_callback(lambda _: _ingestions_in_flight.pop(namespace, None))
+                ingestion.add_done_callback(lambda _: cleanup())
+                ingesting = True
+                return await db.get(models.Document, await asyncio.shield(ingestion))
+
+            print(f"INFO: Document is already being ingested. Waiting for it (Namespace: {namespace[:10]}...).")
+            metrics.INGESTION_DEDUPS.inc(reason="in_flight")
+            try:
+                return await db.get(models.Document, await asyncio.shield(ingestion))
+            except Exception as e:
+                # The other request's ingestion failed; try again with our own content
+                print(f"WARNING: Shared ingestion failed, retrying. Error: {e}")
+    finally:
+        if not ingesting:
+            cleanup()
+
+async def _get_or_ingest_upload(db: AsyncSession, filename: str, checksum: str, extract: Callable[[], Awaitable[List[Dict]]],
+                                on_progress: Optional[ProgressCallback] = None, cleanup: Callable[[], None] = lambda: None) -> models.Document:
+    """
+    _get_or_ingest_document for an uploaded file, recording that an upload resolved to the
+    document so that it is kept when a URL that served the same content changes.
+    """
+    db_document = await _get_or_ingest_document(db, filename, checksum, extract, on_progress=on_progress, cleanup=cleanup)
+    if not db_document.uploaded:
+        await crud.mark_document_uploaded(db, db_document)
+    return db_document
+
+async def _get_or_ingest_url_document(db: AsyncSession, url: str, refresh: bool = False,
+                                      wrap_extract: Optional[Callable[[Callable[[], Awaitable[List[Dict]]]], Callable[[], Awaitable[List[Dict]]]]] = None,
+                                      on_progress: Optional[ProgressCallback] = None) -> models.Document:
+    """
+    Returns the document for a URL. A URL that is already indexed is used as is, unless
+    `refresh` is set. Otherwise the URL is downloaded into the download cache (conditionally,
+    when the cache holds an earlier copy) and the document is keyed by the checksum of its
+    content: content already indexed under another URL or as an upload, such as a rotated
+    signed URL, reuses that document, and changed content is indexed as a new one. Either way
+    the URL is recorded as serving that document, so it is not downloaded again. When a
+    refresh finds new content, the URL's previous document is retired.
+    `wrap_extract` may wrap the extract callable passed to _get_or_ingest_document.
+    """
+    previous = await crud.find_document(db, url=url)
+    if previous and not refresh:
+        print(f"INFO: Document found in cache. Skipping ingestion.")
+        metrics.INGESTION_DEDUPS.inc(reason="indexed")
+        return previous
+
+    download = await download_document(url)
+    if download.not_modified:
+        print(f"INFO: Document at {url[:50]} is unchanged since it was downloaded.")
+
+    async def extract() -> List[Dict]:
+        return await process_document_file(download.path, url)
+
+    db_document = await _get_or_ingest_document(
+        db, url, download.checksum, wrap_extract(extract) if wrap_extract else extract, on_progress=on_progress
+    )
+    if previous is None or previous.id != db_document.id:
+        await crud.set_document_url(db, url, db_document)
+    if previous and previous.id != db_document.id:
+        print(f"INFO: Content at {url[:50]} changed. Document ID {db_document.id} replaces {previous.id}.")
+        task = asyncio.create_task(_retire_document(previous.id, db_document.id))
+        _retirements.add(task)
+        task.add_done_callback(_retirements.discard)
+    return db_document
+
+async def _retire_document(document_id: int, replacement_id: int):
+    """
+    Deletes a document that its URL no longer serves, and its index, in favour of
+    `replacement_id`, after config.RETIRED_DOCUMENT_GRACE_SECONDS so that requests already
+    using it can finish. A document another URL still serves, or that an upload resolved
+    to, is kept. The namespace's ingestion claim is held meanwhile, so that content
+    re-ingested just after the row is gone does not lose its new index.
+    """
+    await asyncio.sleep(config.RETIRED_DOCUMENT_GRACE_SECONDS)
+    try:
+        async with AsyncSessionLocal() as db:
+            previous = await db.get(models.Document, document_id)
+            if previous is None:
+                return
+            source, checksum = previous.url, previous.checksum
+            namespace = get_document_namespace(source, checksum)
+            claims = SessionLocal()
+            try:
+                claim_token = await asyncio.to_thread(crud.claim_ingestion, claims, namespace, config.INGESTION_CLAIM_TIMEOUT)
+                if claim_token is None:
+                    print(f"INFO: Document ID {document_id} is being re-ingested; it is not retired.")
+                    return
+                try:
+                    if not await crud.retire_document(db, previous, replacement_id):
+                        print(f"INFO: Document ID {document_id} is still served by another URL or was uploaded; it is kept.")
+                        return
+                    print(f"INFO: Retired Document ID {document_id} in favour of {replacement_id}.")
+                    await delete_document_index(source, checksum)
+                finally:
+                    await asyncio.to_thread(crud.release_ingestion, claims, claim_token)
+            finally:
+                claims.close()
+    except Exception as e:
+        print(f"WARNING: Failed to retire superseded Document ID {document_id}. Error: {e}")
+
+async def _resolve_document(db: AsyncSession, request: HackRxRequest) -> Tuple[models.Document, str, Optional[str]]:
+    """
+    Validates a JSON request and returns its (document, doc_identifier, checksum),
+    ingesting or refreshing the document as needed.
+    """
     # --- 1. Validate Input ---
     is_url_provided = request.document_url is not None
     is_file_provided = request.file_content_base64 is not None and request.filename is not None
@@ -89,7 +592,6 @@ async def run_submission_json(
          raise HTTPException(status_code=400, detail="Questions are required.")
 
     # --- 2. Process Request ---
-    answers = []
     if is_file_provided:
         # --- Handle Base64 File Upload ---
         try:
@@ -99,39 +601,396 @@ async def run_submission_json(
             raise HTTPException(status_code=400, detail="Invalid Base64 string.")
 
         doc_identifier = request.filename
-        db_document = crud.get_document_by_checksum(db, checksum=checksum)
+        db_document = await _get_or_ingest_upload(
+            db, doc_identifier, checksum,
+            extract=lambda: process_document_content(content_bytes, doc_identifier)
+        )
+        return db_document, doc_identifier, checksum
 
-        if not db_document:
-            print(f"INFO: New Base64 file. Processing and indexing (Checksum: {checksum[:10]}...).")
-            chunks = await process_document_content(content_bytes, doc_identifier)
-            await upsert_document_chunks(doc_identifier, chunks, checksum=checksum)
-            db_document = crud.create_document(db, url=doc_identifier, checksum=checksum)
-        else:
-            print(f"INFO: File found in cache. Skipping ingestion.")
-        
-        for question in request.questions:
-            relevant_clauses = await get_relevant_clauses(doc_identifier, question, checksum=checksum)
-            answer = await get_answer_from_llm(question, relevant_clauses)
-            answers.append(answer)
-            crud.create_query(db, document_id=db_document.id, question=question, answer=answer)
-
-    else: # if is_url_provided:
-        # --- Handle URL ---
-        doc_identifier = request.document_url
-        db_document = crud.get_document_by_url(db, url=doc_identifier)
-
-        if not db_document:
-            print(f"INFO: New URL. Processing and indexing: {doc_identifier}")
-            chunks = await process_document_from_url(doc_identifier)
-            await upsert_document_chunks(doc_identifier, chunks)
-            db_document = crud.create_document(db, url=doc_identifier, checksum=None)
-        else:
-            print(f"INFO: URL found in cache. Skipping ingestion.")
-        
-        for question in request.questions:
-            relevant_clauses = await get_relevant_clauses(doc_identifier, question)
-            answer = await get_answer_from_llm(question, relevant_clauses)
-            answers.append(answer)
-            crud.create_query(db, document_id=db_document.id, question=question, answer=answer)
-
-    return HackRxResponse(answers=answers)
\ No newline at end of file
+    # --- Handle URL ---
+    # The document may have been indexed under another URL, so its own identifiers locate its namespace
+    db_document = await _get_or_ingest_url_document(db, request.document_url, refresh=request.refresh)
+    return db_document, db_document.url, db_document.checksum
+
+def _upload_extractor(file: SpooledUpload) -> Callable[[], Awaitable[List[Dict]]]:
+    """Returns an extract callable for a streamed upload, reading it from disk if it was spooled."""
+    async def extract_upload() -> List[Dict]:
+        if file.path:
+            return await process_document_file(file.path, file.filename)
+        return await process_document_content(file.content, file.filename)
+    return extract_upload
+
+# --- Background Ingestion Jobs ---
+def _job_response(job: models.IngestionJob) -> DocumentJobResponse:
+    if job.status == "succeeded":
+        progress = 1.0
+    elif job.chunks_total:
+        progress = job.chunks_indexed / job.chunks_total
+    else:
+        progress = 0.0
+    return DocumentJobResponse(
+        job_id=job.id, status=job.status, stage=job.stage, chunks_total=job.chunks_total,
+        chunks_indexed=job.chunks_indexed, progress=progress, document_id=job.document_id, error=job.error
+    )
+
+async def _run_ingestion_job(job_id: str, doc_identifier: str, checksum: Optional[str],
+                             extract: Optional[Callable[[], Awaitable[List[Dict]]]], cleanup: Callable[[], None]):
+    """
+    Ingests a document for a background job, recording the job's stage and progress.
+    Without `extract`, `doc_identifier` is a URL to download first.
+    Progress writes are throttled to one per config.INGESTION_JOB_PROGRESS_INTERVAL seconds.
+    """
+    last_progress_write = 0.0
+
+    async def update_job(**values):
+        async with AsyncSessionLocal() as db:
+            await crud.update_ingestion_job(db, job_id, **values)
+
+    def counting(extract: Callable[[], Awaitable[List[Dict]]]) -> Callable[[], Awaitable[List[Dict]]]:
+        async def extract_and_count() -> List[Dict]:
+            await update_job(stage="extracting")
+            chunks = await extract()
+            await update_job(stage="indexing", chunks_total=len(chunks))
+            return chunks
+        return extract_and_count
+
+    async def on_progress(indexed: int, total: int):
+        nonlocal last_progress_write
+        now = time.monotonic()
+        if indexed < total and now - last_progress_write < config.INGESTION_JOB_PROGRESS_INTERVAL:
+            return
+        last_progress_write = now
+        try:
+            await update_job(chunks_indexed=indexed)
+        except Exception as e:
+            # A missed progress update must not fail the ingestion
+            print(f"WARNING: Failed to record progress of ingestion job {job_id}. Error: {e}")
+
+    try:
+        async with AsyncSessionLocal() as db:
+            if extract is None:
+                await update_job(status="running", stage="downloading")
+                db_document = await _get_or_ingest_url_document(db, doc_identifier, wrap_extract=counting, on_progress=on_progress)
+            else:
+                await update_job(status="running")
+                db_document = await _get_or_ingest_upload(db, doc_identifier, checksum, counting(extract), on_progress=on_progress)
+            chunk_count = len(db_document.chunk_hashes or [])
+        await update_job(status="succeeded", stage=None, chunks_total=chunk_count, chunks_indexed=chunk_count, document_id=db_document.id)
+        print(f"INFO: Ingestion job {job_id} finished (Document ID: {db_document.id}).")
+    except Exception as e:
+        print(f"ERROR: Ingestion job {job_id} failed. Error: {e}")
+        await update_job(status="failed", stage=None, error=str(e))
+    finally:
+        cleanup()
+
+async def _submit_ingestion_job(db: AsyncSession, doc_identifier: str, checksum: Optional[str],
+                                extract: Optional[Callable[[], Awaitable[List[Dict]]]], cleanup: Callable[[], None] = lambda: None) -> models.IngestionJob:
+    """
+    Records an ingestion job and queues it on the worker pool. A document that is already
+    indexed gets a job that has already succeeded, so clients can poll it the same way.
+    Without `extract`, `doc_identifier` is a URL that the job downloads.
+    """
+    job_id = uuid.uuid4().hex
+    db_document = await crud.find_document(db, url=doc_identifier, checksum=checksum)
+    if db_document:
+        metrics.INGESTION_DEDUPS.inc(reason="indexed")
+        cleanup()
+        if extract is not None and not db_document.uploaded:
+            await crud.mark_document_uploaded(db, db_document)
+        return await crud.create_ingestion_job(db, job_id, doc_identifier, checksum, status="succeeded", document_id=db_document.id)
+
+    job = await crud.create_ingestion_job(db, job_id, doc_identifier, checksum)
+    try:
+        ingestion_workers.submit(job_id, lambda: _run_ingestion_job(job_id, doc_identifier, checksum, extract, cleanup))
+    except IngestionQueueFullError as e:
+        cleanup()
+        await crud.update_ingestion_job(db, job_id, status="failed", error=str(e))
+        raise
+    print(f"INFO: Queued ingestion job {job_id} for {doc_identifier[:50]}.")
+    return job
+
+@router.post("/documents", response_model=DocumentJobResponse, status_code=202, summary="Ingest a Document in the Background")
+async def create_document_job(
+    request: Request,
+    _=Security(verify_token),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Starts ingesting a document without waiting for it, and returns a job to poll with
+    GET /documents/{job_id}. Accepts the JSON body of /hackrx/run without questions
+    (`document_url`, or `filename` with `file_content_base64`), or a multipart/form-data
+    body with a `file` part and an optional `checksum` field, as for /hackrx/upload.
+    """
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        async def is_known_checksum(checksum: str) -> bool:
+            return await crud.find_document(db, checksum=checksum) is not None
+        try:
+            upload = await parse_upload(request, is_known_checksum)
+        except UploadError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        file = upload.file
+        if file is None:
+            raise HTTPException(status_code=400, detail="A 'file' part must be provided.")
+        job = await _submit_ingestion_job(db, file.filename, file.checksum, _upload_extractor(file), cleanup=file.cleanup)
+        return _job_response(job)
+
+    try:
+        body = DocumentJobRequest(**await request.json())
+    except Exception:
+        raise HTTPException(status_code=400, detail="Expected a JSON body or a multipart/form-data upload.")
+
+    is_url_provided = body.document_url is not None
+    is_file_provided = body.file_content_base64 is not None and body.filename is not None
+    if is_url_provided == is_file_provided:
+        raise HTTPException(status_code=400, detail="Provide either 'document_url' or 'file_content_base64' with 'filename'.")
+
+    if is_file_provided:
+        try:
+            content_bytes = base64.b64decode(body.file_content_base64)
+        except (base64.binascii.Error, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid Base64 string.")
+        checksum = hashlib.sha256(content_bytes).hexdigest()
+        job = await _submit_ingestion_job(
+            db, body.filename, checksum,
+            extract=lambda: process_document_content(content_bytes, body.filename)
+        )
+    else:
+        job = await _submit_ingestion_job(db, body.document_url, None, extract=None)
+    return _job_response(job)
+
+@router.get("/documents/{job_id}", response_model=DocumentJobResponse, summary="Get the Status of a Background Ingestion")
+async def get_document_job(
+    job_id: str,
+    _=Security(verify_token),
+    db: AsyncSession = Depends(get_db)
+):
+    job = await crud.get_ingestion_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found.")
+    return _job_response(job)
+
+# --- Collections and Corpus Queries ---
+async def _get_documents_or_404(db: AsyncSession, document_ids: List[int]) -> List[models.Document]:
+    if len(set(document_ids)) > config.CORPUS_MAX_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"At most {config.CORPUS_MAX_DOCUMENTS} documents can be searched at once.")
+    documents = await crud.get_documents(db, sorted(set(document_ids)))
+    missing = sorted(set(document_ids) - {document.id for document in documents})
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Unknown document ids: {missing}")
+    return documents
+
+@router.put("/collections/{name}", response_model=CollectionResponse, summary="Create or Replace a Collection of Documents")
+async def put_collection(
+    name: str,
+    request: CollectionRequest,
+    _=Security(verify_token),
+    db: AsyncSession = Depends(get_db)
+):
+    """Names a set of already-indexed documents (by id), so corpus queries can target them together."""
+    documents = await _get_documents_or_404(db, request.document_ids)
+    document_ids = [document.id for document in documents]
+    await crud.set_collection_documents(db, name, document_ids)
+    return CollectionResponse(name=name, document_ids=document_ids)
+
+@router.get("/collections/{name}", response_model=CollectionResponse, summary="Get a Collection of Documents")
+async def get_collection(
+    name: str,
+    _=Security(verify_token),
+    db: AsyncSession = Depends(get_db)
+):
+    collection = await crud.get_collection(db, name)
+    if collection is None:
+        raise HTTPException(status_code=404, detail="Collection not found.")
+    documents = await crud.get_collection_documents(db, collection)
+    return CollectionResponse(name=name, document_ids=[document.id for document in documents])
+
+async def _resolve_corpus(db: AsyncSession, request: CorpusQueryRequest) -> List[models.Document]:
+    """Validates a corpus query and returns the documents it searches."""
+    if (request.document_ids is None) == (request.collection is None):
+        raise HTTPException(status_code=400, detail="Provide either 'document_ids' or 'collection'.")
+    if request.document_ids is not None:
+        documents = await _get_documents_or_404(db, request.document_ids)
+    else:
+        collection = await crud.get_collection(db, request.collection)
+        if collection is None:
+            raise HTTPException(status_code=404, detail="Collection not found.")
+        documents = await crud.get_collection_documents(db, collection)
+    if not documents:
+        raise HTTPException(status_code=400, detail="No documents to search.")
+    return documents
+
+@router.post("/corpus/query", response_model=CorpusQueryResponse, summary="Answer a Question Across Several Documents")
+async def run_corpus_query(
+    request: CorpusQueryRequest,
+    _=Security(verify_token),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Answers one question from several indexed documents, given as `document_ids` or as the
+    name of a `collection`. The question is embedded once and every document is searched
+    concurrently; the best clauses across all of them are answered from in a single
+    generation call, and the answer cites the document (and page) of the clauses it uses.
+    """
+    documents = await _resolve_corpus(db, request)
+    embedding = await get_embedding(request.question, task_type="RETRIEVAL_QUERY")
+    # Documents are located by their own identifiers, as in _resolve_document for URLs
+    matches = await get_corpus_matches(
+        [(document.url, document.checksum) for document in documents], embedding, question=request.question
+    )
+    for match in matches:
+        match["source"] = f"Document {documents[match['document']].id}"
+    clauses, _ = assemble_context(matches, config.CORPUS_CONTEXT_TOKEN_BUDGET)
+    answer = await get_corpus_answer_from_llm(request.question, clauses)
+    print(f"INFO: Answered a corpus query over {len(documents)} documents from {len(matches)} clauses "
+          f"in {len({match['document'] for match in matches})} of them.")
+
+    return CorpusQueryResponse(answer=answer, sources=[
+        CorpusSource(
+            label=match["source"], document_id=documents[match['document']].id, document=documents[match['document']].url,
+            page=match['metadata'].get('page'), score=match['similarity']
+        )
+        for match in matches
+    ])
+
+# --- Single Unified Endpoint ---
+@router.post("/hackrx/run", response_model=HackRxResponse, summary="Process Document via JSON (URL or Base64 File)")
+async def run_submission_json(
+    request: HackRxRequest,
+    _=Security(verify_token),
+    db: AsyncSession = Depends(get_db)
+):
+    db_document, doc_identifier, checksum = await _resolve_document(db, request)
+
+    answers = await _answer_questions_cached(db, db_document, doc_identifier, request.questions, checksum=checksum)
+    _log_answers(db_document.id, request.questions, answers)
+
+    return HackRxResponse(answers=answers)
+
+# --- Streaming Endpoint ---
+@router.post("/hackrx/run/stream", summary="Process Document via JSON, Streaming Each Answer as It Completes")
+async def run_submission_stream(
+    request: HackRxStreamRequest,
+    http_request: Request,
+    _=Security(verify_token),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Same input and ingestion as /hackrx/run, but answers are streamed as they complete.
+    Each event is a JSON object: {"index", "question", "answer"} once a question is answered,
+    and, with `stream_tokens`, {"index", "delta"} for each generated text fragment before that.
+    If Gemini becomes unavailable, or the document's chunk texts are missing, a final {"error", "retry_after"} event ends the stream.
+    Events are newline-delimited JSON, or Server-Sent Events when the client accepts text/event-stream.
+    """
+    db_document, doc_identifier, checksum = await _resolve_document(db, request)
+    document_id = db_document.id
+    questions = request.questions
+    use_sse = "text/event-stream" in http_request.headers.get("accept", "")
+
+    def encode(event: dict) -> str:
+        payload = json.dumps(event)
+        return f"data: {payload}\n\n" if use_sse else f"{payload}\n"
+
+    async def event_stream() -> AsyncIterator[str]:
+        # The request's session may already be closed once streaming starts, so use a fresh one
+        async with AsyncSessionLocal() as stream_db:
+            async for chunk in stream_answers(stream_db):
+                yield chunk
+
+    async def stream_answers(stream_db: AsyncSession) -> AsyncIterator[str]:
+        events: asyncio.Queue = asyncio.Queue()
+        on_delta = (lambda i, text: events.put_nowait({"index": i, "delta": text})) if request.stream_tokens else None
+        answers = [None] * len(questions)
+
+        async def produce():
+            try:
+                async for i, answer in _iter_answers_cached(stream_db, db_document, doc_identifier, questions, checksum=checksum, on_delta=on_delta):
+                    answers[i] = answer
+                    events.put_nowait({"index": i, "question": questions[i], "answer": answer})
+            except GeminiUnavailableError as e:
+                # The response has already started, so the failure is reported as a final event
+                events.put_nowait({"error": str(e), "retry_after": e.retry_after})
+            except ChunkStoreMissingError as e:
+                events.put_nowait({"error": str(e), "retry_after": None})
+            finally:
+                events.put_nowait(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while (event := await events.get()) is not None:
+                yield encode(event)
+            await producer
+        finally:
+            producer.cancel()
+
+        answered = [i for i, answer in enumerate(answers) if answer is not None]
+        _log_answers(document_id, [questions[i] for i in answered], [answers[i] for i in answered])
+
+    media_type = "text/event-stream" if use_sse else "application/x-ndjson"
+    return StreamingResponse(event_stream(), media_type=media_type)
+
+# --- Streaming Upload Endpoint ---
+@router.post("/hackrx/upload", response_model=HackRxResponse, summary="Process Document via Streaming Multipart Upload")
+async def run_submission_upload(
+    request: Request,
+    _=Security(verify_token),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Accepts a multipart/form-data body with one or more `questions` fields, a `file`
+    part and an optional `checksum` field (SHA-256 hex of the file). The file is hashed
+    while it streams in and spooled to disk above config.UPLOAD_SPOOL_THRESHOLD.
+    Sending `checksum` before the file lets an already-indexed file skip buffering entirely.
+    """
+    async def is_known_checksum(checksum: str) -> bool:
+        return await crud.find_document(db, checksum=checksum) is not None
+    try:
+        upload = await parse_upload(request, is_known_checksum)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    file = upload.file
+    questions = upload.fields.get("questions", [])
+    if file is None:
+        raise HTTPException(status_code=400, detail="A 'file' part must be provided.")
+    if not questions:
+        file.cleanup()
+        raise HTTPException(status_code=400, detail="Questions are required.")
+
+    # The spooled file is removed once the ingestion reading it is done, not when this
+    # request ends: a cancelled request leaves its shielded ingestion running
+    db_document = await _get_or_ingest_upload(db, file.filename, file.checksum, extract=_upload_extractor(file), cleanup=file.cleanup)
+
+    answers = await _answer_questions_cached(db, db_document, file.filename, questions, checksum=file.checksum)
+    _log_answers(db_document.id, questions, answers)
+
+    return HackRxResponse(answers=answers)
+
+# --- App Factory ---
+def create_app() -> FastAPI:
+    """
+    Builds the application. Clients are created by its lifespan, in the process that
+    serves requests, so the factory can be used with `gunicorn 'main:create_app()'`.
+    """
+    app = FastAPI(
+        title="Intelligent Query–Retrieval System",
+        description="An LLM-powered system with efficient file uploads.",
+        version="2.0.0",
+        lifespan=lifespan
+    )
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(metrics.RequestTracingMiddleware)
+    app.add_exception_handler(ExtractionQueueFullError, queue_full_handler)
+    app.add_exception_handler(IngestionQueueFullError, queue_full_handler)
+    app.add_exception_handler(GeminiUnavailableError, gemini_unavailable_handler)
+    app.add_exception_handler(DownloadError, download_error_handler)
+    app.add_exception_handler(ChunkStoreMissingError, chunk_store_missing_handler)
+    app.include_router(router)
+    return app
+
+app = create_app()
@@ -0,0 +1,232 @@
+# metrics.py
+import bisect
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from a cached answer up to a cold ingestion of a large document
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class _Metric:
+    """A metric family: one value (or set of histogram buckets) per combination of label values."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            values = list(self._values.items())
+        lines += [f"{self.name}{self._format_labels(key)} {value}" for key, value in values]
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Per label key: [count per bucket (the last is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+_registry: List[_Metric] = []
+
+
+def render_metrics() -> str:
+    """All metrics of this process in the Prometheus text exposition format."""
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+# --- Metrics ---
+REQUEST_SECONDS = Histogram("docquery_request_seconds", "HTTP request latency.", ("method", "route", "status"))
+STAGE_SECONDS = Histogram("docquery_stage_seconds", "Latency of each pipeline stage.", ("stage",))
+ANSWER_CACHE_LOOKUPS = Counter("docquery_answer_cache_lookups_total", "Answer cache lookups by result: memory, database or miss.", ("result",))
+EMBEDDING_STORE_CHUNKS = Counter("docquery_embedding_store_chunks_total", "Chunks looked up in the embedding store by result: hit or miss.", ("result",))
+INGESTION_DEDUPS = Counter(
+    "docquery_ingestion_dedups_total",
+    "Ingestions avoided: indexed (document already known), in_flight (joined an ingestion in this process) or claimed (another worker ingested it).",
+    ("reason",)
+)
+INGESTIONS = Counter("docquery_ingestions_total", "Document ingestions performed by this process.")
+DOWNLOADS = Counter("docquery_downloads_total", "Document downloads by result: fetched, not_modified (served from the download cache), or shared (joined a download in flight).", ("result",))
+CHUNKS_INDEXED = Counter("docquery_chunks_indexed_total", "Chunks upserted into the vector store.")
+DOCUMENT_CHUNKS = Histogram("docquery_document_chunks", "Chunks per extracted document.", buckets=(10, 50, 100, 250, 500, 1000, 2500, 5000, 10000))
+GEMINI_RATE_LIMITED = Counter("docquery_gemini_rate_limited_total", "Gemini calls rejected with 429, by model: embedding or generation.", ("model",))
+LLM_TOKENS = Counter("docquery_llm_tokens_total", "Gemini generation tokens by kind: prompt or completion.", ("kind",))
+CONTEXT_TOKENS_SAVED = Counter("docquery_context_tokens_saved_total", "Estimated prompt tokens saved by context assembly.")
+
+
+# --- Tracing ---
+class Trace:
+    """Stage timings of one request, for its structured log line."""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.stages: Dict[str, List[float]] = {}
+
+    def add(self, stage_name: str, seconds: float):
+        entry = self.stages.get(stage_name)
+        if entry is None:
+            self.stages[stage_name] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def summary(self) -> Dict[str, dict]:
+        return {name: {"count": count, "ms": round(seconds * 1000, 2)} for name, (count, seconds) in self.stages.items()}
+
+
+# Tasks inherit the trace of the request that created them, so concurrent work is attributed to it
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+def current_trace_summary() -> Dict[str, dict]:
+    trace = _current_trace.get()
+    return trace.summary() if trace else {}
+
+
+def record_stage(stage_name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage_name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage_name, seconds)
+
+
+@contextmanager
+def stage(stage_name: str):
+    """Times the enclosed block as one occurrence of a pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage_name, time.perf_counter() - start)
+
+
+@contextmanager
+def detached_trace(request_id: Optional[str] = None):
+    """
+    Runs the enclosed block under its own trace, or under none, instead of the trace of
+    the request that started it (e.g. for background jobs that outlive that request).
+    """
+    token = _current_trace.set(Trace(request_id) if request_id else None)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+
+
+class RequestTracingMiddleware:
+    """
+    ASGI middleware that gives each HTTP request a request ID (the client's X-Request-ID,
+    or a new one), returns it in the X-Request-ID response header, records the request
+    latency and writes one JSON log line per request with its stage timings. The line
+    is written when the response body is complete, so streamed responses are fully covered.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        trace = Trace(request_id or uuid.uuid4().hex)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", trace.request_id.encode())]
+            await send(message)
+
+        token = _current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            _current_trace.reset(token)
+            duration = time.perf_counter() - start
+            # The route template, e.g. /documents/{job_id}, keeps the label count bounded
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(duration, method=scope["method"], route=route, status=status)
+            print(json.dumps({
+                "event": "request",
+                "request_id": trace.request_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
+                "duration_ms": round(duration * 1000, 2),
+                "stages": trace.summary(),
+            }))
@@ -1,9 +1,17 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Boolean, Column, Integer, String, Text, DateTime, ForeignKey, Index, JSON, LargeBinary, Table, false
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
 
+# Documents belonging to each collection; a document can be in any number of collections
+collection_documents = Table(
+    "collection_documents",
+    Base.metadata,
+    Column("collection_id", Integer, ForeignKey("collections.id", ondelete="CASCADE"), primary_key=True),
+    Column("document_id", Integer, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True),
+)
+
 class Document(Base):
     __tablename__ = "documents"
 
@@ -13,9 +21,24 @@ class Document(Base):
     # Checksum is the new unique key for file content
     checksum = Column(String, unique=True, index=True, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Content hash and offset of each indexed chunk, by position
+    chunk_hashes = Column(JSON, nullable=True)
+    # When the indexed content last changed; answers logged before this are not reused
+    indexed_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Whether an upload resolved to this document, which is then never retired with a URL's old content
+    uploaded = Column(Boolean, nullable=False, default=False, server_default=false())
     
     queries = relationship("Query", back_populates="document")
 
+class DocumentURL(Base):
+    __tablename__ = "document_urls"
+
+    # The document each URL currently serves. Several URLs can serve one document (e.g. rotated
+    # signed URLs of the same file); a URL whose content changed is pointed at its new document
+    url = Column(String, primary_key=True)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 class Query(Base):
     __tablename__ = "queries"
     
@@ -24,5 +47,70 @@ class Query(Base):
     answer = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     document_id = Column(Integer, ForeignKey("documents.id"))
+    # Answer cache key: hash of the normalized question plus the model and prompt that produced the answer.
+    # Left empty for failed answers so they are never served from the cache.
+    question_hash = Column(String(64), nullable=True)
+    model = Column(String, nullable=True)
+    prompt_version = Column(String, nullable=True)
     
-    document = relationship("Document", back_populates="queries")
\ No newline at end of file
+    document = relationship("Document", back_populates="queries")
+
+    __table_args__ = (
+        Index("ix_queries_answer_cache", "document_id", "question_hash", "model", "prompt_version"),
+    )
+
+class IngestionClaim(Base):
+    __tablename__ = "ingestion_claims"
+
+    # One row per document namespace being ingested; the unique namespace acts as a lock across workers
+    id = Column(Integer, primary_key=True, index=True)
+    namespace = Column(String, unique=True, index=True, nullable=False)
+    # Random per claim, so a holder whose stale claim was taken over cannot release its successor's
+    token = Column(String(32), nullable=False)
+    claimed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    # A background ingestion started through POST /documents and polled through GET /documents/{id}
+    id = Column(String(32), primary_key=True)
+    # queued, running, succeeded or failed; while running, stage is downloading, extracting or indexing
+    status = Column(String, nullable=False)
+    stage = Column(String, nullable=True)
+    # URL or filename of the document, and the checksum for uploaded files
+    source = Column(String, nullable=False)
+    checksum = Column(String, nullable=True)
+    chunks_total = Column(Integer, nullable=True)
+    chunks_indexed = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+
+class ChunkEmbedding(Base):
+    __tablename__ = "chunk_embeddings"
+
+    # Embeddings are content-addressed so identical chunks are embedded once across documents and versions
+    id = Column(Integer, primary_key=True, index=True)
+    text_hash = Column(String(64), nullable=False)
+    model = Column(String, nullable=False)
+    task_type = Column(String, nullable=False)
+    # float32 vector bytes
+    embedding = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_chunk_embeddings_key", "text_hash", "model", "task_type", unique=True),
+    )
+
+class Collection(Base):
+    __tablename__ = "collections"
+
+    # A named set of documents that corpus queries (POST /corpus/query) can target as a whole
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    documents = relationship("Document", secondary=collection_documents)
@@ -0,0 +1,76 @@
+# query_log.py
+import asyncio
+from typing import List, Optional
+
+import config
+import crud
+import metrics
+from database import AsyncSessionLocal
+
+
+class QueryLogWriter:
+    """
+    Buffers query log rows and writes them off the request path, with one bulk
+    insert whenever `batch_size` rows are waiting or every `flush_interval_ms`.
+    """
+
+    def __init__(self, batch_size: int, flush_interval_ms: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._rows: List[dict] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def add(self, rows: List[dict]):
+        """Queues rows for writing; never blocks. Starts the writer on first use."""
+        self._rows.extend(rows)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        if len(self._rows) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        # The writer outlives the request that started it, so its writes are not part of that request's trace
+        with metrics.detached_trace():
+            await self._write_loop()
+
+    async def _write_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            if self._stopping:
+                return
+
+    async def flush(self):
+        while self._rows:
+            rows, self._rows = self._rows[:self.batch_size], self._rows[self.batch_size:]
+            try:
+                async with AsyncSessionLocal() as db:
+                    await crud.create_queries(db, rows)
+            except Exception as e:
+                # Logging must never fail a request; the rows are dropped
+                print(f"ERROR: Failed to write {len(rows)} query logs. Error: {e}")
+
+    async def stop(self):
+        """
+        Stops the background writer once it has written whatever is still buffered. The
+        writer is woken rather than cancelled, so an insert in progress is not abandoned
+        with its rows already taken off the buffer.
+        """
+        self._stopping = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+query_log_writer = QueryLogWriter(
+    batch_size=config.QUERY_LOG_BATCH_SIZE,
+    flush_interval_ms=config.QUERY_LOG_FLUSH_INTERVAL_MS,
+)
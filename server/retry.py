@@ -0,0 +1,79 @@
+# retry.py
+import asyncio
+import random
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import config
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying: rate limiting and transient server-side failures
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def _status_code(exc: BaseException):
+    # google.api_core exceptions expose `code`, the Pinecone client exposes `status`
+    for attribute in ("code", "status", "status_code"):
+        value = getattr(exc, attribute, None)
+        if isinstance(value, int):
+            return int(value)
+    return None
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """True for network errors, timeouts, rate limits and 5xx responses."""
+    if isinstance(exc, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    return _status_code(exc) in TRANSIENT_STATUS_CODES
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    """True when a provider rejected a request for exceeding a quota or rate limit."""
+    return _status_code(exc) == 429
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """
+    The wait a rate-limited provider asked for, if any: an HTTP Retry-After header,
+    or the RetryInfo detail that google.api_core errors carry.
+    """
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    for detail in getattr(exc, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return getattr(delay, "seconds", 0) + getattr(delay, "nanos", 0) / 1e9
+    return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff before retry number `attempt + 1`."""
+    return random.uniform(0, min(config.RETRY_MAX_DELAY, config.RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def is_payload_too_large(exc: BaseException) -> bool:
+    """True when a provider rejected a request because its payload was too big."""
+    status = _status_code(exc)
+    return status == 413 or (status == 400 and "payload" in str(exc).lower())
+
+
+async def retry_with_backoff(operation: Callable[[], Awaitable[T]], description: str = "request") -> T:
+    """
+    Awaits `operation()`, retrying transient failures up to config.RETRY_MAX_ATTEMPTS
+    times with full-jitter exponential backoff. Other errors are raised immediately.
+    """
+    for attempt in range(config.RETRY_MAX_ATTEMPTS):
+        try:
+            return await operation()
+        except Exception as e:
+            if attempt == config.RETRY_MAX_ATTEMPTS - 1 or not is_transient_error(e):
+                raise
+            delay = backoff_delay(attempt)
+            print(f"WARNING: Transient error on {description} (attempt {attempt + 1}), retrying in {delay:.2f}s. Error: {e}")
+            await asyncio.sleep(delay)
@@ -0,0 +1,106 @@
+# tests/test_batched_answers.py
+"""Run from server/ with `python -m pytest tests`."""
+import asyncio
+import json
+
+import pytest
+
+import llm_service
+from context_builder import group_by_overlap
+from llm_service import BatchAnswerError, get_answers_from_llm, parse_batch_answers
+
+
+def _response(*entries) -> str:
+    return json.dumps({"answers": [{"id": number, "answer": answer} for number, answer in entries]})
+
+
+def test_answers_are_returned_in_question_order():
+    text = _response((3, "Third."), (1, "First."), (2, "Second."))
+    assert parse_batch_answers(text, 3) == ["First.", "Second.", "Third."]
+
+
+def test_extra_answers_are_ignored():
+    text = _response((1, "First."), (2, "Second."), (3, "Not asked."))
+    assert parse_batch_answers(text, 2) == ["First.", "Second."]
+
+
+def test_code_fence_and_string_ids_are_tolerated():
+    text = "```json\n" + json.dumps({"answers": [{"id": "1", "answer": " First. "}]}) + "\n```"
+    assert parse_batch_answers(text, 1) == ["First."]
+
+
+@pytest.mark.parametrize("text", [
+    _response((1, "First.")),
+    _response((1, "First."), (2, "  ")),
+    _response((1, "First."), (3, "Third.")),
+])
+def test_missing_or_empty_answers_raise(text):
+    with pytest.raises(BatchAnswerError):
+        parse_batch_answers(text, 2)
+
+
+@pytest.mark.parametrize("text", [
+    "1. First.\n2. Second.",
+    json.dumps({"answer": "First."}),
+    json.dumps({"answers": [{"answer": "First."}]}),
+    json.dumps({"answers": [{"id": "one", "answer": "First."}]}),
+])
+def test_free_form_responses_raise(text):
+    with pytest.raises(BatchAnswerError):
+        parse_batch_answers(text, 1)
+
+
+class _FakeScheduler:
+    async def call(self, operation, priority, tokens, description):
+        return await operation()
+
+
+class _FakeGenai:
+    def __init__(self, text: str):
+        self.text = text
+        self.types = self
+
+    def GenerationConfig(self, **options):
+        return options
+
+    def GenerativeModel(self, name):
+        return self
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        return type("Response", (), {"text": self.text, "usage_metadata": None})()
+
+
+def test_unsplittable_response_raises_for_the_per_question_fallback(monkeypatch):
+    # The caller answers each question on its own when a batched call raises BatchAnswerError
+    monkeypatch.setattr(llm_service, "get_genai", lambda: _FakeGenai(_response((2, "Second."))))
+    monkeypatch.setattr(llm_service, "generation_scheduler", _FakeScheduler())
+    with pytest.raises(BatchAnswerError):
+        asyncio.run(get_answers_from_llm(["First?", "Second?"], ["Clause."]))
+
+
+def test_questions_sharing_enough_matches_are_grouped():
+    match_ids = [["a", "b"], ["a", "b"], ["a", "c"], ["x", "y"]]
+    assert group_by_overlap(match_ids, min_overlap=0.5, max_questions=8, max_clauses=12) == [[0, 1, 2], [3]]
+
+
+def test_overlap_below_the_threshold_starts_a_group():
+    match_ids = [["a", "b", "c"], ["a", "x", "y"]]
+    assert group_by_overlap(match_ids, min_overlap=0.5, max_questions=8, max_clauses=12) == [[0], [1]]
+    # Exactly at the threshold joins
+    assert group_by_overlap([["a", "b"], ["a", "x"]], min_overlap=0.5, max_questions=8, max_clauses=12) == [[0, 1]]
+
+
+def test_groups_stay_within_their_question_and_clause_limits():
+    same = [["a", "b"]] * 5
+    assert group_by_overlap(same, min_overlap=0.5, max_questions=2, max_clauses=12) == [[0, 1], [2, 3], [4]]
+    growing = [["a", "b"], ["a", "c"], ["a", "d"]]
+    assert group_by_overlap(growing, min_overlap=0.5, max_questions=8, max_clauses=3) == [[0, 1], [2]]
+
+
+def test_a_question_joins_the_group_it_overlaps_most():
+    match_ids = [["a", "b", "c", "d"], ["x", "y", "z", "w"], ["x", "y", "z", "a"]]
+    assert group_by_overlap(match_ids, min_overlap=0.25, max_questions=8, max_clauses=12) == [[0], [1, 2]]
+
+
+def test_questions_without_matches_are_never_grouped():
+    assert group_by_overlap([[], []], min_overlap=0.5, max_questions=8, max_clauses=12) == [[0], [1]]
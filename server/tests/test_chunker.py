@@ -0,0 +1,49 @@
+# tests/test_chunker.py
+"""Run from server/ with `python -m pytest tests`."""
+from benchmarks.documents import PARAGRAPHS_PER_PAGE, generate_paragraphs
+from chunker import chunk_text, iter_chunks
+
+
+def _pages(page_count: int):
+    paragraphs = generate_paragraphs(page_count * PARAGRAPHS_PER_PAGE, seed=7)
+    return [
+        "\n\n".join(paragraphs[start:start + PARAGRAPHS_PER_PAGE]) + "\n"
+        for start in range(0, len(paragraphs), PARAGRAPHS_PER_PAGE)
+    ]
+
+
+def test_no_chunk_repeats_its_predecessor():
+    chunks = list(iter_chunks(_pages(50), first_page=1))
+    assert chunks
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk["text"] not in previous["text"]
+
+
+def test_chunks_point_back_into_the_text():
+    pages = _pages(20)
+    text = "".join(pages)
+    for chunk in iter_chunks(pages, first_page=1, chunk_size=400, chunk_overlap=150):
+        assert len(chunk["text"]) <= 400
+        assert text[chunk["start"]:chunk["start"] + len(chunk["text"])] == chunk["text"]
+        assert sum(map(len, pages[:chunk["page"] - 1])) <= chunk["start"] < sum(map(len, pages[:chunk["page"]]))
+
+
+def test_long_whitespace_runs_do_not_repeat_chunks():
+    text = " ".join(f"word{i}" for i in range(100)) + " " * 1000 + "\n\n" + " ".join(f"other{i}" for i in range(100))
+    chunks = chunk_text(text)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk["text"] not in previous["text"]
+    assert chunks[-1]["text"].endswith("other99")
+
+
+def test_paragraph_breaks_repeat_only_short_paragraphs():
+    long_paragraphs = [" ".join(f"p{i}w{j}" for j in range(50)) for i in range(3)]
+    text = "\n\n".join([long_paragraphs[0], "Short heading", long_paragraphs[1], long_paragraphs[2]])
+    chunks = chunk_text(text)
+    assert chunks[0]["text"].startswith("p0w0")
+    # A chunk starting a paragraph after a break repeats nothing but the short heading
+    starts = [chunk["text"].split()[0] for chunk in chunks]
+    assert "p1w0" not in starts
+    assert "Short" in starts
+    assert "p2w0" in starts
+    assert sum(len(chunk["text"]) for chunk in chunks) < 1.3 * len(text)
@@ -0,0 +1,168 @@
+# tests/test_gemini_scheduler.py
+"""Run from server/ with `python -m pytest tests`."""
+import asyncio
+import selectors
+
+import pytest
+
+import gemini_scheduler
+from gemini_scheduler import GeminiScheduler, Priority
+
+
+# Least time that passes whenever the event loop polls; time comparisons allow for it
+_CLOCK_STEP = 1e-6
+
+
+def _approx(expected):
+    return pytest.approx(expected, abs=1e-3)
+
+
+class _VirtualClock:
+    """Stands in for the time module: time only moves when the event loop would sleep."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    perf_counter = monotonic
+
+
+def _run(clock: _VirtualClock, coroutine):
+    """Runs a coroutine on an event loop whose sleeps advance `clock` instead of waiting."""
+    class Selector(selectors.DefaultSelector):
+        def select(self, timeout=None):
+            events = super().select(0)
+            if not events:
+                if timeout is None:
+                    raise RuntimeError("Deadlock: nothing is scheduled and nothing can wake the loop")
+                # A real clock has always moved on by the time the loop polls again; without a
+                # minimum step, a wait too small to change the time would be retried forever
+                clock.now += max(timeout, _CLOCK_STEP)
+            return events
+
+    class Loop(asyncio.SelectorEventLoop):
+        def time(self):
+            return clock.now
+
+    loop = Loop(Selector())
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _VirtualClock:
+    clock = _VirtualClock()
+    monkeypatch.setattr(gemini_scheduler, "time", clock)
+    return clock
+
+
+class _RateLimited(Exception):
+    code = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__("429 Resource has been exhausted")
+        self.response = type("Response", (), {"headers": {"retry-after": str(retry_after)}})()
+
+
+def test_waiting_calls_are_admitted_by_priority_then_arrival(clock):
+    scheduler = GeminiScheduler("test", requests_per_minute=2, tokens_per_minute=10**9, query_reserve=0.0)
+    admitted = []
+
+    async def acquire(name, priority):
+        await scheduler.acquire(priority, tokens=1)
+        admitted.append(name)
+
+    async def main():
+        # Empty the request bucket, so the rest queue up
+        await scheduler.acquire(Priority.QUERY, tokens=1)
+        await scheduler.acquire(Priority.QUERY, tokens=1)
+        tasks = [asyncio.create_task(acquire(name, priority)) for name, priority in [
+            ("ingestion 1", Priority.INGESTION), ("ingestion 2", Priority.INGESTION),
+            ("query 1", Priority.QUERY), ("ingestion 3", Priority.INGESTION), ("query 2", Priority.QUERY),
+        ]]
+        await asyncio.gather(*tasks)
+
+    _run(clock, main())
+    assert admitted == ["query 1", "query 2", "ingestion 1", "ingestion 2", "ingestion 3"]
+    # One request refills every 30 seconds
+    assert clock.now == _approx(5 * 30)
+
+
+def test_ingestion_leaves_the_query_reserve_free(clock):
+    scheduler = GeminiScheduler("test", requests_per_minute=10, tokens_per_minute=10**9, query_reserve=0.2)
+    admitted = {}
+
+    async def acquire(name, priority):
+        await scheduler.acquire(priority, tokens=1)
+        admitted[name] = clock.now
+
+    async def main():
+        ingestions = [asyncio.create_task(acquire(f"ingestion {i}", Priority.INGESTION)) for i in range(9)]
+        await asyncio.sleep(0)
+        query = asyncio.create_task(acquire("query", Priority.QUERY))
+        await asyncio.gather(query, *ingestions)
+
+    _run(clock, main())
+    # Ingestion stops with 2 of the 10 requests left (the 20% reserve), which a query may still use
+    assert [admitted[f"ingestion {i}"] for i in range(8)] == _approx([0.0] * 8)
+    assert admitted["query"] == _approx(0.0)
+    # The next ingestion waits until the reserve is whole again above its own request:
+    # the query's request and one more, 12 seconds at 10 a minute
+    assert admitted["ingestion 8"] == _approx(12.0)
+
+
+def test_rate_limit_pauses_for_retry_after(clock):
+    scheduler = GeminiScheduler("test", requests_per_minute=60000, tokens_per_minute=10**9, query_reserve=0.0)
+    attempts = []
+
+    async def operation():
+        attempts.append(clock.now)
+        if len(attempts) == 1:
+            raise _RateLimited(retry_after=5)
+        return "answer"
+
+    async def other_call():
+        await asyncio.sleep(1)
+        await scheduler.acquire(Priority.QUERY, tokens=1)
+        return clock.now
+
+    async def main():
+        return await asyncio.gather(
+            scheduler.call(operation, Priority.QUERY, tokens=1, description="test"), other_call()
+        )
+
+    result, other_admitted = _run(clock, main())
+    assert result == "answer"
+    assert attempts == _approx([0.0, 5.0])
+    # The pause holds back every call to the model, not only the one that was rejected
+    assert other_admitted == _approx(5.0)
+
+
+def test_rate_limit_halves_the_rate_and_successes_restore_it(clock):
+    # One request per minute: each admission after the first waits for the bucket to refill
+    scheduler = GeminiScheduler("test", requests_per_minute=1, tokens_per_minute=10**9, query_reserve=0.0)
+    attempts = []
+
+    async def rate_limited_once():
+        attempts.append(clock.now)
+        if len(attempts) == 1:
+            raise _RateLimited(retry_after=5)
+
+    async def succeed():
+        attempts.append(clock.now)
+
+    async def main():
+        await scheduler.call(rate_limited_once, Priority.QUERY, tokens=1, description="test")
+        for _ in range(10):
+            await scheduler.call(succeed, Priority.QUERY, tokens=1, description="test")
+
+    _run(clock, main())
+    waits = [later - earlier for earlier, later in zip(attempts, attempts[1:])]
+    # Halved: the retry waits two minutes for its request, not one (nor only the 5 s pause)
+    assert waits[0] == _approx(120)
+    # Each success restores 5% of the rate, from 55% after the retry back up to 100%
+    assert waits[1:] == _approx([60 / (0.55 + 0.05 * i) for i in range(9)] + [60])
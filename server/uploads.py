@@ -0,0 +1,167 @@
+# uploads.py
+import hashlib
+import os
+import tempfile
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from fastapi import Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+import config
+
+
+class UploadError(ValueError):
+    """Raised when a multipart upload is malformed or too large."""
+
+
+class SpooledUpload:
+    """
+    The file part of an upload, hashed as it arrives. Data stays in memory up to
+    config.UPLOAD_SPOOL_THRESHOLD bytes and is spooled to a named temp file beyond
+    that, so the extraction workers can open it by path. When `discard` is set the
+    data is only hashed, never stored.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.size = 0
+        self.discard = False
+        self.path: Optional[str] = None
+        self._buffer = bytearray()
+        self._file = None
+        self._sha256 = hashlib.sha256()
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > config.MAX_UPLOAD_BYTES:
+            raise UploadError(f"File exceeds the maximum upload size of {config.MAX_UPLOAD_BYTES} bytes.")
+        self._sha256.update(data)
+        if self.discard:
+            return
+        if self._file is None and len(self._buffer) + len(data) > config.UPLOAD_SPOOL_THRESHOLD:
+            suffix = os.path.splitext(self.filename)[1]
+            self._file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+            self.path = self._file.name
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._buffer.extend(data)
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+
+    def cleanup(self):
+        self.finish()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    @property
+    def checksum(self) -> str:
+        return self._sha256.hexdigest()
+
+    @property
+    def content(self) -> bytes:
+        """The file bytes, when the upload was small enough to stay in memory."""
+        return bytes(self._buffer)
+
+
+class ParsedUpload:
+    def __init__(self):
+        self.fields: Dict[str, List[str]] = {}
+        self.file: Optional[SpooledUpload] = None
+
+
+async def parse_upload(request: Request, is_known_checksum: Callable[[str], Awaitable[bool]]) -> ParsedUpload:
+    """
+    Parses a multipart/form-data body as it streams in.
+    If a `checksum` field arrives before the file part and `is_known_checksum`
+    returns True for it, the file is hashed only to verify the claim and is not buffered.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Expected a multipart/form-data body with a boundary.")
+
+    # The parser callbacks are synchronous, so they only record events that are handled below
+    events = []
+    callbacks = {
+        "on_part_begin": lambda: events.append(("part_begin", b"")),
+        "on_part_data": lambda data, start, end: events.append(("part_data", data[start:end])),
+        "on_part_end": lambda: events.append(("part_end", b"")),
+        "on_header_field": lambda data, start, end: events.append(("header_field", data[start:end])),
+        "on_header_value": lambda data, start, end: events.append(("header_value", data[start:end])),
+        "on_header_end": lambda: events.append(("header_end", b"")),
+        "on_headers_finished": lambda: events.append(("headers_finished", b"")),
+    }
+    parser = MultipartParser(params[b"boundary"], callbacks)
+
+    parsed = ParsedUpload()
+    header_field, header_value = b"", b""
+    disposition = b""
+    field_name, field_value = None, bytearray()
+    current_file: Optional[SpooledUpload] = None
+
+    async def handle_events():
+        nonlocal header_field, header_value, disposition, field_name, field_value, current_file
+        for event, data in events:
+            if event == "part_begin":
+                header_field, header_value, disposition = b"", b"", b""
+                field_name, field_value, current_file = None, bytearray(), None
+            elif event == "header_field":
+                header_field += data
+            elif event == "header_value":
+                header_value += data
+            elif event == "header_end":
+                if header_field.lower() == b"content-disposition":
+                    disposition = header_value
+                header_field, header_value = b"", b""
+            elif event == "headers_finished":
+                _, options = parse_options_header(disposition)
+                field_name = options.get(b"name", b"").decode()
+                if b"filename" in options:
+                    if parsed.file is not None:
+                        raise UploadError("Only one file can be uploaded per request.")
+                    current_file = SpooledUpload(options[b"filename"].decode())
+                    claimed = parsed.fields.get("checksum")
+                    if claimed:
+                        current_file.discard = await is_known_checksum(claimed[0])
+                    parsed.file = current_file
+            elif event == "part_data":
+                if current_file is not None:
+                    current_file.write(data)
+                else:
+                    field_value.extend(data)
+                    if len(field_value) > config.MAX_UPLOAD_FIELD_BYTES:
+                        raise UploadError(f"Form field '{field_name}' is too large.")
+            elif event == "part_end":
+                if current_file is not None:
+                    current_file.finish()
+                elif field_name:
+                    parsed.fields.setdefault(field_name, []).append(field_value.decode())
+        events.clear()
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            await handle_events()
+        parser.finalize()
+        await handle_events()
+    except Exception as e:
+        if parsed.file is not None:
+            parsed.file.cleanup()
+        if isinstance(e, ValueError) and not isinstance(e, UploadError):
+            # python-multipart reports malformed bodies as ValueError subclasses
+            raise UploadError(f"Malformed multipart body: {e}")
+        raise
+
+    claimed = parsed.fields.get("checksum")
+    if parsed.file is not None and claimed and claimed[0] != parsed.file.checksum:
+        parsed.file.cleanup()
+        raise UploadError("The uploaded file does not match the provided checksum.")
+    return parsed
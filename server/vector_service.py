@@ -1,16 +1,24 @@
+import asyncio
 import hashlib
-from typing import List, Optional
-from pinecone import Pinecone, ServerlessSpec
-import google.generativeai as genai
+import heapq
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
 import config
+import metrics
+from context_builder import estimate_tokens
+from diversity import adaptive_cutoff, select_mmr
+from gemini_client import get_genai
+from gemini_scheduler import Priority, embedding_scheduler
+from vector_store import get_vector_store
+from embedding_store import chunk_hash, iter_chunk_embeddings
+from lexical_index import build_lexical_index, delete_lexical_index, get_lexical_index
+from chunk_store import ChunkStore, ChunkStoreMissingError, delete_chunks, get_chunk_store, write_chunks
+from retry import retry_with_backoff
 
-# Configure the Gemini client
-genai.configure(api_key=config.GOOGLE_API_KEY)
+# Awaited with (chunks indexed so far, chunks to index) after each upsert batch lands
+ProgressCallback = Callable[[int, int], Awaitable[None]]
 
-# Initialize Pinecone client
-pinecone_client = Pinecone(api_key=config.PINECONE_API_KEY)
-
-def _get_document_namespace(source: str, checksum: Optional[str] = None) -> str:
+def get_document_namespace(source: str, checksum: Optional[str] = None) -> str:
     """
     Creates a unique namespace from checksum (if available for files)
     or by hashing the source URL.
@@ -21,70 +29,270 @@ def _get_document_namespace(source: str, checksum: Optional[str] = None) -> str:
 
 async def get_embedding(text: str, task_type: str) -> List[float]:
     """
-    Generates an embedding for a given text using Google's model.
+    Generates an embedding for a given text using Google's model, at query priority.
     """
-    response = await genai.embed_content_async(
-        model=config.EMBEDDING_MODEL,
-        content=text,
-        task_type=task_type
-    )
+    with metrics.stage("embed_query"):
+        response = await embedding_scheduler.call(
+            lambda: get_genai().embed_content_async(
+                model=config.EMBEDDING_MODEL,
+                content=text,
+                task_type=task_type
+            ),
+            Priority.QUERY, tokens=estimate_tokens(text), description="query embedding"
+        )
     return response['embedding']
 
-async def upsert_document_chunks(source: str, chunks: List[str], checksum: Optional[str] = None):
-    """Embeds document chunks in batches and upserts them into the Pinecone index."""
-    index_name = config.PINECONE_INDEX_NAME
-    namespace = _get_document_namespace(source, checksum)
-
-    if index_name not in pinecone_client.list_indexes().names():
-        pinecone_client.create_index(
-            name=index_name,
-            dimension=768,
-            metric='cosine',
-            spec=ServerlessSpec(cloud='aws', region='us-east-1')
+async def get_embeddings(texts: List[str], task_type: str) -> List[List[float]]:
+    """
+    Generates embeddings for a batch of texts in a single API call, at query priority.
+    """
+    if not texts:
+        return []
+    with metrics.stage("embed_query"):
+        response = await embedding_scheduler.call(
+            lambda: get_genai().embed_content_async(
+                model=config.EMBEDDING_MODEL,
+                content=texts,
+                task_type=task_type
+            ),
+            Priority.QUERY, tokens=sum(map(estimate_tokens, texts)), description="query embedding"
         )
+    return response['embedding']
+
+def _chunk_fingerprint(chunk: Dict) -> str:
+    """Identifies a chunk's text and position in the document, as recorded in Document.chunk_hashes."""
+    return f"{chunk_hash(chunk['text'])}@{chunk['start']}"
+
+def _chunk_metadata(chunk: Dict) -> Dict:
+    # FIX: Removed the oversized 'doc_source' to prevent Pinecone metadata limit errors
+    # Texts are resolved from the local chunk store; the copy here is a fallback for hosts without it
+    metadata = {"start": chunk["start"]}
+    if config.VECTOR_METADATA_TEXT:
+        metadata["text"] = chunk["text"]
+    # Pinecone rejects null metadata values, so the page is only set for paged documents
+    if chunk.get("page") is not None:
+        metadata["page"] = chunk["page"]
+    return metadata
+
+def _build_vectors(namespace: str, positions: List[int], chunks: List[Dict], embeddings: List[List[float]]) -> List[dict]:
+    # Ids follow chunk order, so the neighbours of chunk i are {namespace}-{i-1} and {namespace}-{i+1}
+    return [
+        {
+            "id": f"{namespace}-{i}",
+            "values": embeddings[i],
+            "metadata": _chunk_metadata(chunks[i])
+        }
+        for i in positions
+    ]
+
+async def _index_chunks(namespace: str, chunks: List[Dict], positions: List[int], on_progress: Optional[ProgressCallback] = None):
+    """
+    Embeds the chunks at `positions` and upserts them, overlapping the two stages:
+    each upsert batch is sent as soon as its embeddings are ready, while later
+    embedding batches are still in flight. Up to config.UPSERT_MAX_CONCURRENT
+    upserts run at once, and transient failures are retried with backoff.
+    """
+    vector_store = get_vector_store()
+    upsert_slots = asyncio.Semaphore(config.UPSERT_MAX_CONCURRENT)
+    embeddings: Dict[int, List[float]] = {}
+    ready: List[int] = []
+    upserts: List[asyncio.Task] = []
+    indexed = 0
+
+    async def upsert_batch(batch_positions: List[int]):
+        nonlocal indexed
+        vectors = _build_vectors(namespace, batch_positions, chunks, embeddings)
+        async with upsert_slots:
+            with metrics.stage("vector_upsert"):
+                await retry_with_backoff(lambda: vector_store.upsert(namespace, vectors), description="vector upsert")
+        indexed += len(batch_positions)
+        metrics.CHUNKS_INDEXED.inc(len(batch_positions))
+        if on_progress:
+            await on_progress(indexed, len(positions))
+
+    try:
+        async for embedded in iter_chunk_embeddings([chunks[p]["text"] for p in positions]):
+            for j, values in embedded.items():
+                embeddings[positions[j]] = values
+                ready.append(positions[j])
+            while len(ready) >= config.UPSERT_BATCH_SIZE:
+                batch, ready = ready[:config.UPSERT_BATCH_SIZE], ready[config.UPSERT_BATCH_SIZE:]
+                upserts.append(asyncio.create_task(upsert_batch(batch)))
+        if ready:
+            upserts.append(asyncio.create_task(upsert_batch(ready)))
+        await asyncio.gather(*upserts)
+    except BaseException:
+        for task in upserts:
+            task.cancel()
+        raise
+
+async def upsert_document_chunks(source: str, chunks: List[Dict], checksum: Optional[str] = None,
+                                 on_progress: Optional[ProgressCallback] = None) -> List[str]:
+    """
+    Embeds document chunks through the embedding store and upserts them into the vector store.
+    Returns the chunk fingerprints, to be recorded with the document.
+
+    Documents are keyed by content checksum, so a URL whose content changed is indexed
+    in full under a new namespace rather than diffed into its old one. The embedding
+    store keeps what an incremental re-index saved: chunks that did not change are
+    found there by text hash and cost no embedding call, only their upsert.
+    """
+    namespace = get_document_namespace(source, checksum)
+    # Written first, so chunks are resolvable as soon as their vectors can be matched
+    with metrics.stage("chunk_store_write"):
+        await write_chunks(namespace, chunks)
+    await _index_chunks(namespace, chunks, list(range(len(chunks))), on_progress=on_progress)
+    await get_vector_store().finish_upserts(namespace)
+    with metrics.stage("lexical_index_build"):
+        await asyncio.to_thread(build_lexical_index, namespace, chunks)
     
-    index = pinecone_client.Index(index_name)
-    
-    # Process chunks in batches (e.g., 100 per API call) for efficiency
-    for i in range(0, len(chunks), 100):
-        batch_chunks = chunks[i:i+100]
-        
-        response = await genai.embed_content_async(
-            model=config.EMBEDDING_MODEL,
-            content=batch_chunks,
-            task_type="RETRIEVAL_DOCUMENT"
+    print(f"INFO: Successfully upserted {len(chunks)} chunks to the {config.VECTOR_STORE_BACKEND} vector store.")
+    return [_chunk_fingerprint(chunk) for chunk in chunks]
+
+async def delete_document_index(source: str, checksum: Optional[str] = None):
+    """Removes a document's vectors, chunk store and BM25 index, e.g. once a newer version replaced it."""
+    namespace = get_document_namespace(source, checksum)
+    await get_vector_store().delete_namespace(namespace)
+    await delete_chunks(namespace)
+    await asyncio.to_thread(delete_lexical_index, namespace)
+    print(f"INFO: Deleted the index of a superseded document (Namespace: {namespace[:10]}...).")
+
+def _fuse_rankings(namespace: str, vector_matches: List[Dict], lexical_hits: List[Tuple[int, float]]) -> List[Dict]:
+    """
+    Reciprocal-rank fusion: each chunk scores sum(1 / (RRF_K + rank)) over the rankings
+    it appears in. Returns all the chunks as matches, best first; chunks found by the
+    vector query keep their "values", and chunks only BM25 found have empty metadata.
+    """
+    fused: Dict[str, Dict] = {}
+    for rank, match in enumerate(vector_matches):
+        fused[match['id']] = dict(match, score=1 / (config.RRF_K + rank + 1))
+    for rank, (position, _) in enumerate(lexical_hits):
+        vector_id = f"{namespace}-{position}"
+        entry = fused.setdefault(vector_id, {"id": vector_id, "score": 0.0, "metadata": {}})
+        entry["score"] += 1 / (config.RRF_K + rank + 1)
+    return sorted(fused.values(), key=lambda match: match["score"], reverse=True)
+
+def _select_matches(namespace: str, query_embedding: List[float], vector_matches: List[Dict], lexical_hits: List[Tuple[int, float]]) -> List[Dict]:
+    """
+    Cuts the weak tail of each ranking on its own score scale, fuses what is left and
+    re-selects a diverse subset of at most TOP_K_CLAUSES with maximal marginal relevance.
+    Each match also gets its cosine "similarity" to the question, which unlike the fused
+    score is comparable across documents; chunks only BM25 found are given the lowest
+    similarity among the vector candidates kept.
+    """
+    vector_scores = np.array([match['score'] for match in vector_matches], dtype=np.float32)
+    keep = adaptive_cutoff(vector_scores, config.RETRIEVAL_MIN_SIMILARITY, config.RETRIEVAL_MAX_SCORE_DROP, config.MIN_CLAUSES)
+    candidates = [dict(match, similarity=match['score']) for match, kept in zip(vector_matches, keep) if kept]
+    if lexical_hits:
+        lexical_scores = np.array([score for _, score in lexical_hits], dtype=np.float32)
+        keep = lexical_scores >= lexical_scores[0] * config.LEXICAL_MIN_RELATIVE_SCORE
+        lexical_hits = [hit for hit, kept in zip(lexical_hits, keep) if kept]
+        candidates = _fuse_rankings(namespace, candidates, lexical_hits)
+    if not candidates:
+        return []
+
+    # Scores are on different scales with and without fusion, so relevance is relative to the best
+    relevance = np.array([match['score'] for match in candidates], dtype=np.float32)
+    relevance /= relevance.max() or 1.0
+    # Chunks only BM25 found have no vector and are never treated as redundant
+    vectors = np.zeros((len(candidates), len(query_embedding)), dtype=np.float32)
+    for row, match in zip(vectors, candidates):
+        if "values" in match:
+            row[:] = match["values"]
+    selected = select_mmr(relevance, vectors, config.MIN_CLAUSES, config.TOP_K_CLAUSES, config.MMR_DIVERSITY, config.MMR_DUPLICATE_SIMILARITY)
+    floor = min((match['similarity'] for match in candidates if 'similarity' in match), default=config.RETRIEVAL_MIN_SIMILARITY)
+    return [
+        {"id": candidates[i]['id'], "score": candidates[i]['score'], "similarity": candidates[i].get('similarity', floor),
+         "metadata": candidates[i]['metadata']}
+        for i in selected
+    ]
+
+def _resolve_chunks(chunk_store: ChunkStore, matches: List[Dict]) -> List[Dict]:
+    """Fills in the metadata of matches from the chunk store in one batched read, dropping unknown chunks."""
+    positions = [int(match['id'].rsplit("-", 1)[1]) for match in matches]
+    chunks = chunk_store.read(positions)
+    return [
+        dict(match, metadata=chunks[position])
+        for match, position in zip(matches, positions) if position in chunks
+    ]
+
+async def get_relevant_matches(source: str, query_embedding: List[float], checksum: Optional[str] = None, question: Optional[str] = None) -> List[Dict]:
+    """
+    Returns the matches (id, score, similarity and chunk metadata) for an already-embedded question, in
+    selection order: between MIN_CLAUSES and TOP_K_CLAUSES of them, fewer when the scores fall
+    off quickly or the candidates repeat each other.
+
+    When the document has a chunk store on this host, the vector store returns only ids,
+    scores and vectors, and the selected chunks are read from the chunk store. Then, if the
+    question text is given and the document has a BM25 index, vector and lexical candidates
+    are fused with reciprocal-rank fusion, so exact terms like clause numbers are found too.
+    Documents without a chunk store here are served from the vector metadata, and raise
+    ChunkStoreMissingError if it holds no texts (ingested with VECTOR_METADATA_TEXT off).
+    """
+    namespace = get_document_namespace(source, checksum)
+    has_chunk_store = get_chunk_store(namespace) is not None
+    lexical_index = get_lexical_index(namespace) if question and has_chunk_store else None
+    with metrics.stage("vector_query"):
+        vector_matches = await get_vector_store().query(
+            namespace, query_embedding, top_k=config.RETRIEVAL_CANDIDATES,
+            include_values=True, include_metadata=not has_chunk_store
         )
-        batch_embeddings = response['embedding']
-
-        vectors_to_upsert = []
-        for j, chunk in enumerate(batch_chunks):
-            vector_id = f"{namespace}-{i+j}"
-            vectors_to_upsert.append({
-                "id": vector_id,
-                "values": batch_embeddings[j],
-                # FIX: Removed the oversized 'doc_source' to prevent Pinecone metadata limit errors
-                "metadata": {"text": chunk}
-            })
-
-        if vectors_to_upsert:
-            index.upsert(vectors=vectors_to_upsert, namespace=namespace)
-    
-    print(f"INFO: Successfully upserted {len(chunks)} chunks to Pinecone.")
-
-async def get_relevant_clauses(source: str, question: str, checksum: Optional[str] = None) -> List[str]:
-    """Finds and returns the most relevant text clauses for a given question."""
-    index_name = config.PINECONE_INDEX_NAME
-    namespace = _get_document_namespace(source, checksum)
-    index = pinecone_client.Index(index_name)
-
-    query_embedding = await get_embedding(question, task_type="RETRIEVAL_QUERY")
-
-    query_result = index.query(
-        namespace=namespace,
-        vector=query_embedding,
-        top_k=config.TOP_K_CLAUSES,
-        include_metadata=True
-    )
-    
-    clauses = [match['metadata']['text'] for match in query_result['matches']]
-    return clauses
\ No newline at end of file
+    lexical_hits = []
+    if lexical_index is not None:
+        with metrics.stage("lexical_search"):
+            lexical_hits = lexical_index.search(question, config.RETRIEVAL_CANDIDATES)
+    with metrics.stage("select_clauses"):
+        matches = _select_matches(namespace, query_embedding, vector_matches, lexical_hits)
+    # Looked up again rather than kept across the awaits above, where it may be replaced or evicted
+    chunk_store = get_chunk_store(namespace) if has_chunk_store else None
+    if chunk_store is None:
+        if any('text' not in match['metadata'] for match in matches):
+            raise ChunkStoreMissingError(
+                f"The chunk texts of document namespace {namespace[:10]}... are not on this host and not in the "
+                f"vector store. Re-ingest the document on this host, or set VECTOR_METADATA_TEXT before ingesting."
+            )
+        return matches
+    with metrics.stage("chunk_store_read"):
+        return _resolve_chunks(chunk_store, matches)
+
+async def get_corpus_matches(documents: List[Tuple[str, Optional[str]]], query_embedding: List[float],
+                             question: Optional[str] = None, top_k: Optional[int] = None) -> List[Dict]:
+    """
+    Retrieves matches for one already-embedded question from several documents, given as
+    (source, checksum) pairs, and returns the `top_k` (config.CORPUS_TOP_K_CLAUSES) with the
+    highest similarity across all of them, best first. Each match gets a "document" key with
+    the index of its document in `documents`.
+
+    Documents are searched concurrently, at most config.CORPUS_MAX_CONCURRENT_RETRIEVALS
+    at a time, and their matches enter a bounded min-heap as each search completes, so
+    only the global top-k are ever kept. A document whose search fails is skipped.
+    """
+    top_k = top_k or config.CORPUS_TOP_K_CLAUSES
+    semaphore = asyncio.Semaphore(config.CORPUS_MAX_CONCURRENT_RETRIEVALS)
+
+    async def search(index: int) -> Tuple[int, List[Dict]]:
+        source, checksum = documents[index]
+        async with semaphore:
+            return index, await get_relevant_matches(source, query_embedding, checksum=checksum, question=question)
+
+    # Entries are (similarity, document index, rank within the document, match); the weakest is at heap[0]
+    heap: List[Tuple[float, int, int, Dict]] = []
+    tasks = [asyncio.create_task(search(i)) for i in range(len(documents))]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            try:
+                index, matches = await completed
+            except Exception as e:
+                print(f"WARNING: Corpus retrieval skipped a document. Error: {e}")
+                continue
+            for rank, match in enumerate(matches):
+                # Ties go to earlier documents and ranks, hence the negated indexes
+                entry = (match['similarity'], -index, -rank, dict(match, document=index))
+                if len(heap) < top_k:
+                    heapq.heappush(heap, entry)
+                elif entry[:3] > heap[0][:3]:
+                    heapq.heapreplace(heap, entry)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return [entry[3] for entry in sorted(heap, key=lambda entry: entry[:3], reverse=True)]
@@ -0,0 +1,490 @@
+# vector_store.py
+import asyncio
+import json
+import os
+import shutil
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config
+from lru import LRUCache
+
+
+class VectorStore(ABC):
+    """
+    Minimal interface the vector service needs from a vector index.
+    A vector is a dict of the form {"id": str, "values": List[float], "metadata": dict},
+    and a query returns matches of the form {"id": str, "score": float, "metadata": dict},
+    plus the stored "values" when asked for with include_values. Without include_metadata
+    the metadata is left empty, so only ids and scores cross the network.
+    """
+
+    @abstractmethod
+    async def upsert(self, namespace: str, vectors: List[Dict]) -> None:
+        """Inserts or replaces vectors in a namespace."""
+
+    @abstractmethod
+    async def delete_namespace(self, namespace: str) -> None:
+        """Removes a namespace and all its vectors; an unknown namespace is ignored."""
+
+    @abstractmethod
+    async def query(self, namespace: str, vector: List[float], top_k: int, include_values: bool = False, include_metadata: bool = True) -> List[Dict]:
+        """Returns the top_k most similar vectors in a namespace, best match first."""
+
+    async def finish_upserts(self, namespace: str) -> None:
+        """Called once a batch of upserts, such as a document's ingestion, is complete. Optional."""
+
+    async def warm_up(self) -> None:
+        """Opens connections or handles ahead of the first request. Optional."""
+
+
+class PineconeVectorStore(VectorStore):
+    """Vector store backed by a Pinecone serverless index."""
+
+    def __init__(self, api_key: str, index_name: str, dimension: int):
+        from pinecone import Pinecone
+
+        self.client = Pinecone(api_key=api_key)
+        self.index_name = index_name
+        self.dimension = dimension
+        self._index_ready = False
+        self._index = None
+
+    def _ensure_index(self):
+        from pinecone import ServerlessSpec
+
+        if self._index_ready:
+            return
+        if self.index_name not in self.client.list_indexes().names():
+            self.client.create_index(
+                name=self.index_name,
+                dimension=self.dimension,
+                metric='cosine',
+                spec=ServerlessSpec(cloud='aws', region='us-east-1')
+            )
+        self._index_ready = True
+
+    def _get_index(self):
+        # The index handle owns the HTTP connection pool, so it is built once and reused
+        if self._index is None:
+            self._index = self.client.Index(self.index_name)
+        return self._index
+
+    async def warm_up(self) -> None:
+        await asyncio.to_thread(self._ensure_index)
+        index = self._get_index()
+        await asyncio.to_thread(index.describe_index_stats)
+
+    async def upsert(self, namespace: str, vectors: List[Dict]) -> None:
+        await asyncio.to_thread(self._ensure_index)
+        index = self._get_index()
+        await asyncio.to_thread(index.upsert, vectors=vectors, namespace=namespace)
+
+    async def delete_namespace(self, namespace: str) -> None:
+        from pinecone.exceptions import NotFoundException
+
+        index = self._get_index()
+        try:
+            await asyncio.to_thread(index.delete, delete_all=True, namespace=namespace)
+        except NotFoundException:
+            pass
+
+    async def query(self, namespace: str, vector: List[float], top_k: int, include_values: bool = False, include_metadata: bool = True) -> List[Dict]:
+        index = self._get_index()
+        # The Pinecone client is synchronous; run it in a thread so concurrent questions don't block the event loop
+        query_result = await asyncio.to_thread(
+            index.query,
+            namespace=namespace,
+            vector=vector,
+            top_k=top_k,
+            include_metadata=include_metadata,
+            include_values=include_values
+        )
+        matches = []
+        for match in query_result['matches']:
+            entry = {"id": match['id'], "score": match['score'], "metadata": match['metadata'] if include_metadata else {}}
+            if include_values:
+                entry["values"] = match['values']
+            matches.append(entry)
+        return matches
+
+
+class _LocalNamespace:
+    """
+    An open view of one namespace on disk.
+    Vectors are L2-normalised float32 rows in a memory-mapped matrix, so cosine
+    similarity is a single matrix-vector product. `meta.json` names the files of the
+    current generation: the matrix, the log of rows written since the generation began
+    (one JSON line per row, appended to, so an upsert batch costs its own size) and the
+    IVF partition, if any. The first `trained` rows are grouped by partition, with
+    `offsets[c]:offsets[c+1]` the row range of partition c; rows after them are
+    appended rows, always scanned.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Taken before reading, so a meta.json replaced meanwhile is seen as changed on the next lookup
+        self.meta_stamp = _file_stamp(os.path.join(path, "meta.json"))
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.dimension: int = meta["dimension"]
+        self.ids: List[str] = meta["ids"]
+        self.metadata: List[Dict] = meta["metadata"]
+        # Namespaces written before generations existed have fixed file names and no log
+        self.vectors_file: str = meta.get("vectors", "vectors.f32")
+        self.log_file: Optional[str] = meta.get("log")
+        ivf_file = meta.get("ivf", "ivf.npz")
+
+        # Bytes of the log replayed so far
+        self.log_offset = 0
+        self.positions: Dict[str, int] = {vector_id: i for i, vector_id in enumerate(self.ids)}
+        self._replay_log()
+
+        self.centroids = None
+        self.offsets = None
+        self.trained = 0
+        if ivf_file and os.path.exists(os.path.join(path, ivf_file)):
+            with np.load(os.path.join(path, ivf_file)) as ivf:
+                self.centroids = ivf["centroids"]
+                self.offsets = ivf["offsets"]
+            self.trained = int(self.offsets[-1])
+        self._map_matrix()
+
+    def _log_size(self) -> int:
+        try:
+            return os.path.getsize(os.path.join(self.path, self.log_file))
+        except OSError:
+            return 0
+
+    def _replay_log(self) -> bool:
+        """Applies the complete log lines after `log_offset`. Returns whether there were any."""
+        if not self.log_file or self._log_size() <= self.log_offset:
+            return False
+        with open(os.path.join(self.path, self.log_file), "rb") as f:
+            f.seek(self.log_offset)
+            data = f.read()
+        # A last line without its newline is still being appended, by this or another process
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            entry = json.loads(line)
+            if entry["id"] not in self.positions:
+                self.positions[entry["id"]] = entry["row"]
+            self._set_row(entry["row"], entry["id"], entry["metadata"])
+        self.log_offset += len(complete)
+        return bool(complete)
+
+    def is_current(self) -> bool:
+        """Whether no process has replaced meta.json or appended to the log since this view read them."""
+        return _file_stamp(os.path.join(self.path, "meta.json")) == self.meta_stamp and (
+            not self.log_file or self._log_size() == self.log_offset
+        )
+
+    def sync(self) -> bool:
+        """
+        Catches up with rows another process appended to the log. Returns False when
+        meta.json was replaced (a new generation) or removed, and the namespace must be
+        opened again instead. The caller holds the store's lock.
+        """
+        if _file_stamp(os.path.join(self.path, "meta.json")) != self.meta_stamp:
+            return False
+        if self._replay_log():
+            self._map_matrix()
+        return True
+
+    def _set_row(self, row: int, vector_id: str, metadata: Dict):
+        if row == len(self.ids):
+            self.ids.append(vector_id)
+            self.metadata.append(metadata)
+        else:
+            self.metadata[row] = metadata
+
+    def _map_matrix(self):
+        count = len(self.ids)
+        if count:
+            self.matrix = np.memmap(os.path.join(self.path, self.vectors_file), dtype=np.float32, mode="r", shape=(count, self.dimension))
+        else:
+            self.matrix = np.zeros((0, self.dimension), dtype=np.float32)
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+    def write_rows(self, vectors: List[Dict], values: np.ndarray):
+        """
+        Writes vectors in place (known ids) or after the last row (new ids), then appends
+        them to the log. The caller holds the store's lock; concurrent searches keep
+        using the rows they already mapped.
+        """
+        row_bytes = 4 * self.dimension
+        entries, count = [], self.count
+        new_positions: Dict[str, int] = {}
+        vectors_path = os.path.join(self.path, self.vectors_file)
+        with open(vectors_path, "r+b" if os.path.exists(vectors_path) else "w+b") as f:
+            for vector, row_values in zip(vectors, values):
+                row = self.positions.get(vector["id"], new_positions.get(vector["id"]))
+                if row is None:
+                    row = new_positions[vector["id"]] = count
+                    count += 1
+                f.seek(row * row_bytes)
+                f.write(row_values.tobytes())
+                entries.append({"row": row, "id": vector["id"], "metadata": vector.get("metadata", {})})
+            # Drops rows a crash may have left past the last logged one
+            f.truncate(count * row_bytes)
+        # Rows are logged only once their vectors are on disk
+        with open(os.path.join(self.path, self.log_file), "ab") as f:
+            # Drops a line a crash may have left unfinished, which would corrupt the next one
+            f.truncate(self.log_offset)
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries).encode())
+            self.log_offset = f.tell()
+        for entry in entries:
+            self._set_row(entry["row"], entry["id"], entry["metadata"])
+        self.positions.update(new_positions)
+        self._map_matrix()
+
+    def search(self, query: np.ndarray, top_k: int, nprobe: int, include_values: bool = False, include_metadata: bool = True) -> List[Dict]:
+        # Read once, so rows appended by a concurrent write are either all seen or not at all
+        matrix, count = self.matrix, len(self.matrix)
+        if self.centroids is not None and nprobe < len(self.centroids):
+            probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            ranges = [np.arange(self.offsets[c], self.offsets[c + 1]) for c in probe]
+            ranges.append(np.arange(self.trained, count))
+            rows = np.concatenate(ranges)
+        else:
+            rows = None
+
+        candidates = matrix if rows is None else matrix[rows]
+        if not len(candidates):
+            return []
+        scores = candidates @ query
+
+        k = min(top_k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        if rows is not None:
+            positions = rows[best]
+        else:
+            positions = best
+        matches = [
+            {"id": self.ids[p], "score": float(s), "metadata": self.metadata[p] if include_metadata else {}}
+            for p, s in zip(positions.tolist(), scores[best].tolist())
+        ]
+        if include_values:
+            # Rows are stored normalised; copy them out of the memory map in one gather
+            for match, values in zip(matches, np.array(matrix[positions])):
+                match["values"] = values
+        return matches
+
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int, int]]:
+    """Identifies a version of a file: os.replace gives it a new inode, writes a new mtime or size."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _train_ivf(matrix: np.ndarray, n_lists: int, iterations: int = 10):
+    """Spherical k-means; returns (centroids, assignment of each row)."""
+    rng = np.random.default_rng(0)
+    centroids = matrix[rng.choice(len(matrix), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(matrix @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_lists)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        non_empty = counts > 0
+        sums = np.add.reduceat(matrix[order], starts[non_empty], axis=0)
+        centroids[non_empty] = _normalize(sums)
+    assignments = np.argmax(matrix @ centroids.T, axis=1)
+    return centroids.astype(np.float32), assignments
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector store. Each namespace is a directory holding a memory-mapped
+    float32 matrix, its ids and metadata and, for namespaces of at least
+    `ivf_min_vectors` rows, an IVF partition so that a query only scans the `nprobe`
+    closest partitions (see _LocalNamespace). Upserts append to the matrix and to a
+    log; the partition is trained when a batch of upserts is finished, and retrained
+    during upserts once the rows appended since exceed `ivf_retrain_growth` of the
+    partitioned ones. Disk reads and searches run in threads, off the event loop.
+    Open namespaces are cached per process and checked against meta.json and the log on
+    every lookup, so each worker sees what the others wrote.
+    """
+
+    def __init__(self, root: str, dimension: int, ivf_min_vectors: int, ivf_nprobe: int, max_open_namespaces: int,
+                 ivf_retrain_growth: float):
+        self.root = root
+        self.dimension = dimension
+        self.ivf_min_vectors = ivf_min_vectors
+        self.ivf_nprobe = ivf_nprobe
+        self.ivf_retrain_growth = ivf_retrain_growth
+        # Evicted namespaces are only dropped, not closed: their memory maps are released once
+        # the last query still searching them finishes
+        self._namespaces: LRUCache[_LocalNamespace] = LRUCache(max_open_namespaces)
+        # Held by writes, and by reads that open a namespace, so the cache never holds a stale copy
+        self._lock = threading.RLock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, namespace: str) -> str:
+        return os.path.join(self.root, namespace)
+
+    def _open(self, namespace: str) -> Optional[_LocalNamespace]:
+        """
+        Returns the cached view of a namespace, brought up to date with what other worker
+        processes wrote since it was read: rows they appended are replayed, and a new
+        generation (or a deleted namespace) is read again.
+        """
+        opened = self._namespaces.get(namespace)
+        if opened is not None and opened.is_current():
+            return opened
+        with self._lock:
+            opened = self._namespaces.get(namespace)
+            if opened is not None and opened.sync():
+                return opened
+            path = self._path(namespace)
+            if not os.path.exists(os.path.join(path, "meta.json")):
+                self._namespaces.pop(namespace)
+                return None
+            opened = _LocalNamespace(path)
+            self._namespaces.put(namespace, opened)
+            return opened
+
+    def _write_generation(self, namespace: str, ids: List[str], metadata: List[Dict], matrix: np.ndarray,
+                          centroids: Optional[np.ndarray] = None, offsets: Optional[np.ndarray] = None) -> _LocalNamespace:
+        """
+        Writes a namespace as a new generation of files and switches to it by replacing
+        meta.json, then removes the previous generation's files. Caller holds the lock.
+        """
+        path = self._path(namespace)
+        os.makedirs(path, exist_ok=True)
+        generation = uuid.uuid4().hex[:12]
+        meta = {"dimension": self.dimension, "vectors": f"vectors.{generation}.f32", "log": f"log.{generation}.jsonl", "ivf": None}
+        matrix.astype(np.float32).tofile(os.path.join(path, meta["vectors"]))
+        if centroids is not None:
+            meta["ivf"] = f"ivf.{generation}.npz"
+            with open(os.path.join(path, meta["ivf"]), "wb") as f:
+                np.savez(f, centroids=centroids, offsets=offsets)
+        meta["ids"], meta["metadata"] = ids, metadata
+        with open(os.path.join(path, "meta.json.tmp"), "w") as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+
+        opened = _LocalNamespace(path)
+        self._namespaces.put(namespace, opened)
+        # Searches still running on the previous generation keep their maps of the removed files
+        current = {"meta.json", meta["vectors"], meta["log"], meta["ivf"]}
+        for name in os.listdir(path):
+            if name not in current:
+                os.remove(os.path.join(path, name))
+        return opened
+
+    def _train(self, namespace: str, opened: _LocalNamespace) -> _LocalNamespace:
+        """Partitions a namespace with k-means and rewrites it grouped by partition. Caller holds the lock."""
+        matrix = np.array(opened.matrix, dtype=np.float32)
+        centroids, assignments = _train_ivf(matrix, int(np.sqrt(len(matrix))))
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=len(centroids)))))
+        print(f"INFO: Trained an IVF partition of {len(matrix)} vectors into {len(centroids)} lists (Namespace: {namespace[:10]}...).")
+        return self._write_generation(
+            namespace, [opened.ids[i] for i in order], [opened.metadata[i] for i in order], matrix[order], centroids, offsets
+        )
+
+    def _needs_training(self, opened: _LocalNamespace, finished: bool) -> bool:
+        """A partition is first trained when upserts finish; after that, whenever the appended rows outgrow it."""
+        if opened.count < self.ivf_min_vectors:
+            return False
+        if opened.centroids is None:
+            return finished
+        return opened.count - opened.trained > self.ivf_retrain_growth * opened.trained
+
+    def _write(self, namespace: str, vectors: List[Dict]) -> None:
+        with self._lock:
+            opened = self._open(namespace)
+            if opened is None or opened.log_file is None:
+                # New namespaces, and ones written before the append log existed, start a generation
+                existing = opened
+                opened = self._write_generation(
+                    namespace,
+                    list(existing.ids) if existing else [],
+                    list(existing.metadata) if existing else [],
+                    np.array(existing.matrix, dtype=np.float32) if existing else np.zeros((0, self.dimension), dtype=np.float32),
+                    existing.centroids if existing else None,
+                    existing.offsets if existing else None,
+                )
+            values = _normalize(np.asarray([v["values"] for v in vectors], dtype=np.float32).reshape(-1, self.dimension))
+            opened.write_rows(vectors, values)
+            if self._needs_training(opened, finished=False):
+                self._train(namespace, opened)
+
+    def _finish(self, namespace: str) -> None:
+        with self._lock:
+            opened = self._open(namespace)
+            if opened is not None and self._needs_training(opened, finished=True):
+                self._train(namespace, opened)
+
+    def _remove_namespace(self, namespace: str) -> None:
+        with self._lock:
+            self._namespaces.pop(namespace)
+            shutil.rmtree(self._path(namespace), ignore_errors=True)
+
+    def _search(self, namespace: str, query: np.ndarray, top_k: int, include_values: bool, include_metadata: bool) -> List[Dict]:
+        opened = self._open(namespace)
+        if opened is None:
+            return []
+        return opened.search(query, top_k, self.ivf_nprobe, include_values, include_metadata)
+
+    async def upsert(self, namespace: str, vectors: List[Dict]) -> None:
+        if vectors:
+            await asyncio.to_thread(self._write, namespace, vectors)
+
+    async def finish_upserts(self, namespace: str) -> None:
+        await asyncio.to_thread(self._finish, namespace)
+
+    async def delete_namespace(self, namespace: str) -> None:
+        await asyncio.to_thread(self._remove_namespace, namespace)
+
+    async def query(self, namespace: str, vector: List[float], top_k: int, include_values: bool = False, include_metadata: bool = True) -> List[Dict]:
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        # Opening a namespace reads its metadata, and large ones take a while to scan
+        return await asyncio.to_thread(self._search, namespace, query, top_k, include_values, include_metadata)
+
+
+_vector_store: Optional[VectorStore] = None
+
+def get_vector_store() -> VectorStore:
+    """Returns the process-wide vector store selected by config.VECTOR_STORE_BACKEND."""
+    global _vector_store
+    if _vector_store is None:
+        if config.VECTOR_STORE_BACKEND == "local":
+            _vector_store = LocalVectorStore(
+                root=config.LOCAL_INDEX_DIR,
+                dimension=config.EMBEDDING_DIMENSION,
+                ivf_min_vectors=config.LOCAL_IVF_MIN_VECTORS,
+                ivf_nprobe=config.LOCAL_IVF_NPROBE,
+                max_open_namespaces=config.MAX_OPEN_NAMESPACES,
+                ivf_retrain_growth=config.LOCAL_IVF_RETRAIN_GROWTH,
+            )
+        elif config.VECTOR_STORE_BACKEND == "pinecone":
+            _vector_store = PineconeVectorStore(
+                api_key=config.PINECONE_API_KEY,
+                index_name=config.PINECONE_INDEX_NAME,
+                dimension=config.EMBEDDING_DIMENSION,
+            )
+        else:
+            raise ValueError(f"Unknown vector store backend: {config.VECTOR_STORE_BACKEND}")
+    return _vector_store